@@ -19,7 +19,7 @@
 """Plone Behaviors for `psj.content`.
 
 """
-import md5
+import transaction
 from collective import dexteritytextindexer
 from five import grok
 from plone.app.dexterity.behaviors.metadata import DCFieldProperty
@@ -32,23 +32,25 @@ from plone.formwidget.autocomplete import (
     AutocompleteMultiFieldWidget)
 from plone.formwidget.contenttree import ObjPathSourceBinder
 from plone.namedfile.field import NamedBlobFile as NamedBlobFileField
-from plone.namedfile.file import NamedBlobFile
 from plone.supermodel import model
-from Products.CMFCore.utils import getToolByName
 from z3c.form.browser.orderedselect import OrderedSelectFieldWidget
 from z3c.form.interfaces import IEditForm
 from z3c.relationfield.schema import RelationChoice, RelationList
+from zope.annotation.interfaces import IAnnotations
 from zope.component import adapts, queryUtility
 from zope.interface import implements, alsoProvides
-from zope.lifecycleevent.interfaces import IObjectModifiedEvent
+from zope.lifecycleevent.interfaces import (
+    IObjectAddedEvent, IObjectModifiedEvent)
 from zope.schema import TextLine, Text, Choice, List, ASCIILine
 from psj.content import _
-from psj.content.interfaces import IRedisStoreConfig
+from psj.content.conversion import create_or_enqueue, create_reprs
+from psj.content.interfaces import IPSJGNDTermsGetter
 from psj.content.sources import (
     subjectgroup_source, ddcgeo_source, ddcsach_source,
-    ddczeit_source, RedisSource, language_source, institutes_source,
+    ddczeit_source, language_source, institutes_source,
     licenses_source, gndterms_source
 )
+from psj.content.utils import file_digest
 
 
 class PSJMetadataBase(object):
@@ -472,6 +474,9 @@ alsoProvides(IPSJEdition, IFormFieldProvider)
 class IPSJSubjectIndexing(IPSJBehavior):
     """Fields to categorize some document.
     """
+    form.widget(psj_ddc_geo=AutocompleteMultiFieldWidget)
+    form.widget(psj_ddc_sach=AutocompleteMultiFieldWidget)
+    form.widget(psj_ddc_zeit=AutocompleteMultiFieldWidget)
     fieldset(
         'psj_metadata',
         label=_(u'PSJ Metadata'),
@@ -622,7 +627,8 @@ class IPSJOfficeDocTransformer(IPSJBehavior):
     fieldset(
         'psj_docholder',
         label=_(u'Office Docs'),
-        fields=('psj_office_doc', 'psj_pdf_repr', 'psj_html_repr', 'psj_md5'),
+        fields=('psj_office_doc', 'psj_pdf_repr', 'psj_html_repr', 'psj_md5',
+                'psj_conversion_state'),
         )
 
     primary('psj_office_doc')
@@ -654,6 +660,15 @@ class IPSJOfficeDocTransformer(IPSJBehavior):
         readonly=True,
         )
 
+    psj_conversion_state = ASCIILine(
+        title=_(u'Conversion State'),
+        description=_(
+            u'State of the conversion of the source document '
+            u'(pending, done, or failed).'),
+        required=False,
+        readonly=True,
+        )
+
 alsoProvides(IPSJOfficeDocTransformer, IFormFieldProvider)
 
 
@@ -901,74 +916,75 @@ class PSJOfficeDocTransformer(PSJMetadataBase):
         get_name='psj_html_repr',
         )
 
+    psj_conversion_state = DCFieldProperty(
+        IPSJOfficeDocTransformer['psj_conversion_state'],
+        get_name='psj_conversion_state',
+        )
+
 
-def psj_create_reprs(obj):
+def psj_create_reprs(obj, digest=None):
     """Create PDF, HTML, etc. representations of source doc.
     """
-    transforms = getToolByName(obj, 'portal_transforms')
-    in_data = getattr(obj.psj_office_doc, 'data', None)
-    if in_data is not None:  # safety belt
-        psj_create_pdf(obj, transforms)
-        psj_create_html(obj, transforms)
-    return
+    return create_reprs(obj, digest)
+
+
+@grok.subscribe(IPSJOfficeDocTransformer, IObjectModifiedEvent)
+def update_representations(obj, event):
+    """Update office representations of file connected to context obj.
+    """
+    md5_sum = file_digest(obj.psj_office_doc)
+    if md5_sum != getattr(obj, 'psj_md5', ''):
+        create_or_enqueue(obj, create_reprs, md5_sum)
+
 
+#: The annotation key under which counted GND terms are stored.
+GNDTERMS_COUNTED_KEY = 'psj.content.gndterms_counted'
 
-def psj_create_pdf(obj, transforms):
-    """Event handler for freshly created IPSJOfficeDocTransforms.
 
-    Creates PDF representation of uploaded office doc on creation.
+def record_gndterms_usage(obj):
+    """Count GND terms newly selected for `obj`.
+
+    The counts are used to rank autocomplete results of the GND terms
+    source. They are recorded only after the current transaction was
+    committed successfully. The terms already counted for `obj` are
+    kept in an annotation.
     """
-    out_data = transforms.convertTo(
-        'application/pdf', getattr(obj.psj_office_doc, 'data'),
-        mimetype='application/vnd.oasis.opendocument.text')
-    if out_data is None:
-        # transform failed
+    adapted = IPSJGNDTerms(obj, None)
+    annotations = IAnnotations(obj, None)
+    if adapted is None or annotations is None:
+        return
+    terms = list(getattr(adapted, 'psj_gndterms', None) or [])
+    counted = list(annotations.get(GNDTERMS_COUNTED_KEY, None) or [])
+    if terms == counted:
+        return
+    annotations[GNDTERMS_COUNTED_KEY] = terms
+    new_terms = [term for term in terms if term not in counted]
+    if not new_terms:
         return
-    new_filename = obj.psj_office_doc.filename + '.pdf'
-    obj.psj_pdf_repr = NamedBlobFile(
-        data=out_data.getData(), filename=new_filename)
 
+    def hook(success, obj=obj, keys=new_terms):
+        if not success:
+            return
+        source = gndterms_source(obj)
+        record_usage = getattr(source, 'record_usage', None)
+        if record_usage is not None:
+            record_usage(keys)
 
-def psj_create_html(obj, transforms):
-    """Create an HTML representation of `in_data`.
+    transaction.get().addAfterCommitHook(hook)
 
-    `in_data` is supposed to be the binary content of an office
-    document.
 
-    `transforms` are the portal transforms.
+@grok.subscribe(IPSJGNDTerms, IObjectAddedEvent)
+def count_gndterms_on_add(obj, event):
+    """Count GND terms selected for new objects.
     """
-    out_data = transforms.convertTo(
-        'text/html', getattr(obj.psj_office_doc, 'data'),
-        mimetype='application/vnd.oasis.opendocument.text')
-    obj.psj_md5 = md5.new(getattr(obj.psj_office_doc, 'data')).hexdigest()
-    if out_data is None:
-        # transform failed
-        return
-    new_filename = obj.psj_office_doc.filename + '.html'
-    html = out_data.getData()
-    obj.psj_html_repr = NamedBlobFile(
-        data=html, filename=new_filename)
-    for name in obj.keys():
-        # make sure all old extra-files (images, etc.) are
-        # deleted.
-        del obj[name]
-    for name, subdata in out_data.getSubObjects().items():
-        name = name.decode('utf8')
-        if name.lower()[-4:] in (u'.png', u'.jpg', u'.gif', u'.tif'):
-            new_name = obj.invokeFactory('Image', name)
-        else:
-            new_name = obj.invokeFactory('File', name)
-        new_context = obj[new_name]
-        new_context.file = NamedBlobFile(subdata, filename=name)
+    record_gndterms_usage(obj)
 
 
-@grok.subscribe(IPSJOfficeDocTransformer, IObjectModifiedEvent)
-def update_representations(obj, event):
-    """Update office representations of file connected to context obj.
+@grok.subscribe(IPSJGNDTerms, IObjectModifiedEvent)
+def count_gndterms_on_modify(obj, event):
+    """Count GND terms newly selected for modified objects.
     """
-    md5_sum = md5.new(getattr(obj.psj_office_doc, 'data', '')).hexdigest()
-    if md5_sum != getattr(obj, 'psj_md5', ''):
-        psj_create_reprs(obj)
+    record_gndterms_usage(obj)
 
 
 class PSJSubjectIndexing(PSJMetadataBase):
@@ -1015,17 +1031,7 @@ class PSJSubjectIndexing(PSJMetadataBase):
     def psj_gnd_terms(self):
         if not hasattr(self, 'psj_gnd_id'):
             return []
-        conf = queryUtility(IRedisStoreConfig, name="psj.content.redis-GND")
-        if conf is None:
+        getter = queryUtility(IPSJGNDTermsGetter)
+        if getter is None:
             return []
-        redis_source = RedisSource(
-            host=conf['host'], port=conf['port'], db=conf['db'])
-        result = []
-        for elem in self.psj_gnd_id:
-            try:
-                val = redis_source.getTerm(elem)
-                result.append(val.title)
-            except LookupError:
-                # id not in store.
-                result.append(elem)
-        return result
+        return getter.terms_from_ids(self.psj_gnd_id or [])
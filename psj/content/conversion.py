@@ -0,0 +1,381 @@
+#  psj.content is copyright (c) 2014, 2015 Uli Fouquet
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#  MA 02111-1307 USA.
+#
+"""Conversions of office documents.
+
+Office documents are converted into PDF and HTML by an
+`IOfficeDocConverter` utility. If the Python bridge of LibreOffice
+(`uno`) can be imported, a `UnoConverter` is used by default:
+documents are loaded only once by LibreOffice and exported into all
+formats, without reading them into memory. Otherwise
+`TransformsConverter` asks the portal transforms for each format. Other
+converters can be registered as utility (for instance in
+``site.zcml``)::
+
+  <utility
+      factory="psj.content.conversion.TransformsConverter"
+      provides="psj.content.interfaces.IOfficeDocConverter" />
+
+Results can be cached (see `psj.content.conversioncache`).
+
+Converting office documents can take a long time. By default
+conversions are done in the request adding or modifying an office
+document.
+
+If a Redis store config named ``psj.content.conversion_queue`` is
+registered, requests only put the path of the object into a Redis
+list. Conversions are then done by a worker process (see
+`psj.content.worker`). Meanwhile the `psj_conversion_state` of the
+object tells whether the conversion is pending, done, or failed.
+"""
+import hashlib
+import logging
+import os
+import redis
+import shutil
+import tempfile
+import transaction
+from five import grok
+from plone.namedfile.file import NamedBlobFile
+from Products.CMFCore.utils import getToolByName
+from zope.component import queryUtility
+from psj.content.conversioncache import cache_key, get_cache
+from psj.content.interfaces import IOfficeDocConverter, IRedisStoreConfig
+from psj.content.sources import connection_pools, connection_options
+from psj.content.utils import open_file, file_digest
+
+
+logger = logging.getLogger('psj.content')
+
+#: The name of the Redis store config enabling queued conversions.
+QUEUE_CONF_NAME = u'psj.content.conversion_queue'
+
+#: The Redis list containing paths of objects waiting for conversion.
+QUEUE_NAME = 'psj-conversion-queue'
+
+#: The Redis list containing paths of objects being converted.
+PROCESSING_NAME = 'psj-conversion-processing'
+
+#: Conversion states.
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+#: Mimetypes of source documents and representations.
+SOURCE_TYPE = 'application/vnd.oasis.opendocument.text'
+PDF_TYPE = 'application/pdf'
+HTML_TYPE = 'text/html'
+
+#: The connection string of the LibreOffice instance used by
+#: `UnoConverter`. This is the instance also used by ulif.openoffice.
+UNO_URL = 'socket,host=localhost,port=2002;urp;StarOffice.ComponentContext'
+
+#: LibreOffice export filters and filename extensions by mimetype.
+UNO_FILTERS = {
+    PDF_TYPE: ('writer_pdf_Export', '.pdf'),
+    HTML_TYPE: ('HTML (StarWriter)', '.html'),
+    }
+
+
+class TransformsConverter(object):
+    """Convert office documents with the portal transforms.
+
+    Each format is created by a separate transform, i.e. the document
+    is loaded once per format. As portal transforms accept strings
+    only, the document is read into memory.
+    """
+    grok.implements(IOfficeDocConverter)
+
+    version = 'transforms-1'
+
+    def convert(self, context, stream, filename):
+        # transforms expect strings. We read them once for all formats.
+        data = stream.read()
+        transforms = getToolByName(context, 'portal_transforms')
+        result = {}
+        for mimetype in (PDF_TYPE, HTML_TYPE):
+            out_data = transforms.convertTo(
+                mimetype, data, mimetype=SOURCE_TYPE)
+            if out_data is None:
+                # transform failed
+                continue
+            result[mimetype] = (out_data.getData(), out_data.getSubObjects())
+        return result
+
+
+class UnoConverter(object):
+    """Convert office documents with a running LibreOffice instance.
+
+    Documents are loaded once and exported into all formats. Files
+    embedded in HTML (images, etc.) are returned as subobjects.
+
+    Documents stored in the filesystem (like blobs) are passed to
+    LibreOffice by path, without reading them into memory.
+
+    `url` is the connection string of the LibreOffice instance. If we
+    cannot connect to it (or the `uno` module is not available), or if
+    LibreOffice cannot load the document, we fall back to the portal
+    transforms.
+    """
+    grok.implements(IOfficeDocConverter)
+
+    version = 'uno-1'
+
+    def __init__(self, url=UNO_URL):
+        self.url = url
+
+    def _get_desktop(self):
+        import uno
+        local = uno.getComponentContext()
+        resolver = local.ServiceManager.createInstanceWithContext(
+            "com.sun.star.bridge.UnoUrlResolver", local)
+        ctx = resolver.resolve("uno:%s" % self.url)
+        return ctx.ServiceManager.createInstanceWithContext(
+            "com.sun.star.frame.Desktop", ctx)
+
+    def _props(self, **props):
+        from com.sun.star.beans import PropertyValue
+        result = []
+        for name, value in props.items():
+            prop = PropertyValue()
+            prop.Name, prop.Value = name, value
+            result.append(prop)
+        return tuple(result)
+
+    def convert(self, context, stream, filename):
+        try:
+            import uno
+            desktop = self._get_desktop()
+        except Exception:
+            logger.exception("Cannot connect to LibreOffice at %s", self.url)
+            return TransformsConverter().convert(context, stream, filename)
+        workdir = tempfile.mkdtemp()
+        try:
+            # LibreOffice detects formats by filename extension
+            path = os.path.join(workdir, 'source' + os.path.splitext(
+                filename or '')[1])
+            src_path = getattr(stream, 'name', None)
+            if isinstance(src_path, basestring) and os.path.isfile(src_path):
+                os.symlink(os.path.abspath(src_path), path)
+            else:
+                with open(path, 'wb') as fd:
+                    shutil.copyfileobj(stream, fd)
+            doc = desktop.loadComponentFromURL(
+                uno.systemPathToFileUrl(path), "_blank", 0,
+                self._props(Hidden=True))
+            if doc is None:
+                raise IOError("Cannot load document")
+            try:
+                return self._export(doc, workdir)
+            finally:
+                doc.close(True)
+        except Exception:
+            logger.exception("Cannot convert %s with LibreOffice", filename)
+        finally:
+            shutil.rmtree(workdir)
+        stream.seek(0)
+        return TransformsConverter().convert(context, stream, filename)
+
+    def _export(self, doc, workdir):
+        """Export the loaded `doc` into all formats in `UNO_FILTERS`.
+        """
+        import uno
+        result = {}
+        for mimetype, (filter_name, ext) in UNO_FILTERS.items():
+            out_dir = os.path.join(workdir, mimetype.replace('/', '-'))
+            os.mkdir(out_dir)
+            out_path = os.path.join(out_dir, 'out' + ext)
+            try:
+                doc.storeToURL(
+                    uno.systemPathToFileUrl(out_path),
+                    self._props(FilterName=filter_name))
+            except Exception:
+                logger.exception("Export to %s failed", mimetype)
+                continue
+            subobjects = {}
+            for name in os.listdir(out_dir):
+                with open(os.path.join(out_dir, name), 'rb') as fd:
+                    subobjects[name] = fd.read()
+            result[mimetype] = (subobjects.pop('out' + ext), subobjects)
+        return result
+
+
+def get_converter():
+    """Get the registered `IOfficeDocConverter`.
+
+    Defaults to a `UnoConverter` if the `uno` module can be imported
+    and to a `TransformsConverter` else.
+    """
+    converter = queryUtility(IOfficeDocConverter)
+    if converter is not None:
+        return converter
+    try:
+        import uno  # NOQA
+    except ImportError:
+        return TransformsConverter()
+    return UnoConverter()
+
+
+def create_reprs(obj, digest=None):
+    """Create PDF, HTML, etc. representations of the office doc of
+    `obj`.
+
+    `digest` is the MD5 sum of the office doc. Pass it in if it is
+    already known, so that the document is not read again for hashing.
+
+    The document is converted by the registered `IOfficeDocConverter`.
+    Files embedded in the HTML representation are stored as `Image`
+    and `File` objects inside `obj` (see `update_subobjects`).
+
+    If a conversion cache is configured, results for documents already
+    converted are taken from the cache.
+
+    Returns ``True`` if the PDF and HTML representations were created.
+    """
+    named_file = getattr(obj, 'psj_office_doc', None)
+    if named_file is None:  # safety belt
+        return False
+    filename = named_file.filename
+    if digest is None:
+        digest = file_digest(named_file)
+    result = None
+    converter = get_converter()
+    cache = get_cache()
+    if cache is not None:
+        key = cache_key(digest, converter)
+        result = cache.get(key)
+    if result is None:
+        stream = open_file(named_file)
+        try:
+            result = converter.convert(obj, stream, filename)
+        finally:
+            stream.close()
+        if cache is not None and PDF_TYPE in result and HTML_TYPE in result:
+            # failed conversions are not cached
+            cache.set(key, result)
+    obj.psj_md5 = digest
+    if PDF_TYPE in result:
+        obj.psj_pdf_repr = NamedBlobFile(
+            data=result[PDF_TYPE][0], filename=filename + '.pdf')
+    if HTML_TYPE not in result:
+        return False
+    html, subobjects = result[HTML_TYPE]
+    obj.psj_html_repr = NamedBlobFile(data=html, filename=filename + '.html')
+    update_subobjects(obj, subobjects)
+    return PDF_TYPE in result
+
+
+def _set_subobject_data(context, name, data):
+    update_data = getattr(context, 'update_data', None)
+    if update_data is not None:
+        update_data(data)
+    else:
+        context.file = NamedBlobFile(data, filename=name)
+
+
+def update_subobjects(obj, subobjects):
+    """Make the contents of `obj` match `subobjects`.
+
+    `subobjects` is a dict mapping filenames to data of files embedded
+    in the HTML representation (images, etc.). Images and other files
+    are stored as `Image` or `File` objects inside `obj`.
+
+    Only objects added, removed, or changed are touched. Each object
+    remembers the MD5 sum of its data in `psj_md5`, so that unchanged
+    files (and their blobs) are kept. Objects without `psj_md5` are
+    considered changed.
+    """
+    subobjects = dict(
+        [(name.decode('utf8'), data) for name, data in subobjects.items()])
+    for name in list(obj.keys()):
+        if not isinstance(name, unicode):
+            name = name.decode('utf8')
+        if name not in subobjects:
+            # make sure old extra-files (images, etc.) are deleted.
+            del obj[name]
+    for name, subdata in subobjects.items():
+        digest = hashlib.md5(subdata).hexdigest()
+        if name in obj:
+            new_context = obj[name]
+            if getattr(new_context, 'psj_md5', None) == digest:
+                continue
+            _set_subobject_data(new_context, name, subdata)
+            new_context.psj_md5 = digest
+            new_context.reindexObject()
+            continue
+        if name.lower()[-4:] in (u'.png', u'.jpg', u'.gif', u'.tif'):
+            new_name = obj.invokeFactory('Image', name)
+        else:
+            new_name = obj.invokeFactory('File', name)
+        new_context = obj[new_name]
+        _set_subobject_data(new_context, name, subdata)
+        new_context.psj_md5 = digest
+
+
+def get_queue_client(conf=None):
+    """Get a client of the Redis store holding the conversion queue.
+
+    `conf` defaults to the registered `IRedisStoreConfig` named
+    `QUEUE_CONF_NAME`. If no such config exists, we return ``None``.
+    """
+    if conf is None:
+        conf = queryUtility(IRedisStoreConfig, name=QUEUE_CONF_NAME)
+    if conf is None:
+        return None
+    return connection_pools.get_client(
+        host=conf['host'], port=conf['port'], db=conf['db'],
+        **connection_options(conf))
+
+
+def enqueue(obj, client):
+    """Queue a conversion job for `obj` in the Redis store of
+    `client`.
+
+    The job is queued only after the current transaction was
+    committed successfully. Until then, workers could not see the
+    changes anyway.
+    """
+    obj.psj_conversion_state = PENDING
+    path = '/'.join(obj.getPhysicalPath())
+
+    def hook(success, client=client, path=path):
+        if not success:
+            return
+        try:
+            client.lpush(QUEUE_NAME, path)
+        except redis.RedisError:
+            logger.exception("Could not queue conversion of %s", path)
+
+    transaction.get().addAfterCommitHook(hook)
+
+
+def create_or_enqueue(obj, create_reprs, digest=None):
+    """Create the representations of `obj` or queue a job doing so.
+
+    `create_reprs` is a callable creating the representations when
+    called with `obj` and `digest`, the MD5 sum of the office doc (if
+    known). It should return ``True`` on success. If queued
+    conversions are not enabled, we call it immediately.
+    """
+    client = get_queue_client()
+    if client is not None:
+        enqueue(obj, client)
+        return
+    if create_reprs(obj, digest):
+        obj.psj_conversion_state = DONE
+    else:
+        obj.psj_conversion_state = FAILED
@@ -0,0 +1,146 @@
+#  psj.content is copyright (c) 2014, 2015 Uli Fouquet
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#  MA 02111-1307 USA.
+#
+"""A content-addressed cache of office document conversions.
+
+Conversion results are stored in the local filesystem, keyed by the
+digest of the source document and the version of the converter. The
+same document uploaded several times is therefore converted only
+once.
+
+The cache is enabled with the ``conversion-cache`` ZCML directive,
+for instance in ``site.zcml``::
+
+  <psj:conversion-cache path="/var/cache/psj" max_size="1024" />
+
+`max_size` is the maximum size of the cache in megabytes. If it is
+exceeded, the least recently used results are removed.
+"""
+import hashlib
+import logging
+import marshal
+import os
+import tempfile
+from zope.component import queryUtility
+from psj.content.interfaces import IConversionCacheConfig
+
+
+logger = logging.getLogger('psj.content')
+
+#: The version of the cache file format. Change it, if the format
+#: changes.
+CACHE_VERSION = 1
+
+
+def cache_key(digest, converter):
+    """Get the cache key for a document with `digest` converted by
+    `converter`.
+
+    Converters can provide a `version` attribute, which should change
+    whenever their results change. The class name is used otherwise.
+    """
+    version = getattr(converter, 'version', converter.__class__.__name__)
+    return hashlib.sha1(
+        '%s:%s:%s' % (CACHE_VERSION, digest, version)).hexdigest()
+
+
+class ConversionCache(object):
+    """A cache of conversion results in directory `path`.
+
+    Results are dicts as returned by `IOfficeDocConverter.convert`.
+    Each result is stored as marshal file named after its key. File
+    modification times are updated on access and the least recently
+    used files are removed if all files take more than `max_bytes`.
+    """
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+
+    def _path(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def get(self, key):
+        """Get the result stored under `key` or ``None``.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as fd:
+                result = marshal.load(fd)
+            os.utime(path, None)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return None
+        return result
+
+    def __contains__(self, key):
+        return os.path.isfile(self._path(key))
+
+    def set(self, key, result):
+        """Store `result` under `key`.
+
+        The file is written under a temporary name and renamed
+        afterwards, so that other processes never see incomplete
+        files. Errors are logged, but not raised.
+        """
+        path = self._path(key)
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as out:
+                marshal.dump(result, out)
+            os.rename(tmp_path, path)
+        except (IOError, OSError, ValueError):
+            logger.exception("Could not cache conversion result %s", key)
+            return
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used results until the cache size is
+        not above `max_bytes`.
+
+        Returns the number of results removed.
+        """
+        entries = []
+        for dirpath, dirnames, filenames in os.walk(self.path):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue  # removed by another process
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum([size for mtime, size, path in entries])
+        num = 0
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+            num += 1
+        return num
+
+
+def get_cache():
+    """Get the configured `ConversionCache` or ``None``.
+    """
+    conf = queryUtility(IConversionCacheConfig)
+    if conf is None:
+        return None
+    return ConversionCache(conf['path'], conf['max_size'] * 1024 * 1024)
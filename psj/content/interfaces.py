@@ -21,7 +21,7 @@
 """
 from zope.configuration.fields import Path
 from zope.interface import Interface
-from zope.schema import TextLine, ASCIILine, Int
+from zope.schema import TextLine, ASCIILine, Int, Float, Bool
 from z3c.relationfield.interfaces import IHasRelations
 
 
@@ -41,6 +41,11 @@ class IExternalVocabConfig(Interface):
 
     `name` is the name under which the vocabulary is registered
     (globally).
+
+    `cache_dir` is the directory where cache and record files of the
+    vocabulary are stored. It must be owned by the Zope user and must
+    not be writable by others. Defaults to a directory in the var dir
+    of the instance.
     """
     path = Path(
         title=u'Path',
@@ -54,6 +59,12 @@ class IExternalVocabConfig(Interface):
         required=True,
         )
 
+    cache_dir = Path(
+        title=u'Cache directory',
+        description=u'Directory where vocab cache files are stored.',
+        required=False,
+        )
+
 
 class IRedisStoreConfig(Interface):
     """Configuration for connections to a Redis store.
@@ -81,6 +92,44 @@ class IRedisStoreConfig(Interface):
         default=0,
         )
 
+    max_connections = Int(
+        title=u'Maximum connections',
+        description=u'Maximum number of pooled connections per process',
+        required=False,
+        )
+
+    socket_timeout = Float(
+        title=u'Socket timeout',
+        description=u'Seconds to wait for answers of the Redis store',
+        required=False,
+        )
+
+    socket_connect_timeout = Float(
+        title=u'Socket connect timeout',
+        description=u'Seconds to wait for connections to the Redis store',
+        required=False,
+        )
+
+    socket_keepalive = Bool(
+        title=u'Socket keepalive',
+        description=u'Enable TCP keepalive for connections',
+        required=False,
+        )
+
+    unix_socket_path = ASCIILine(
+        title=u'Unix socket path',
+        description=u'Path of a unix socket to connect to instead of '
+                    u'host and port',
+        required=False,
+        )
+
+    snapshot_path = Path(
+        title=u'Snapshot path',
+        description=u'Path of a snapshot file to read from when the '
+                    u'Redis store is not available',
+        required=False,
+        )
+
     name = TextLine(
         title=u'Name',
         description=u'Name this config should be registered under.',
@@ -104,6 +153,25 @@ class IRedisStoreZSetConfig(IRedisStoreConfig):
     )
 
 
+class IConversionCacheConfig(Interface):
+    """Configuration of a cache for office document conversions.
+
+    See `zcml.py` for hints how to use this ZCML directive.
+    """
+    path = Path(
+        title=u'Path',
+        description=u'Directory where conversion results are stored.',
+        required=True,
+        )
+
+    max_size = Int(
+        title=u'Maximum size',
+        description=u'Maximum size of all cached results in megabytes.',
+        required=True,
+        default=1024,
+        )
+
+
 class ISearchableTextGetter(Interface):
     """A utility determining the searchable text of objects.
     """
@@ -123,3 +191,23 @@ class IPSJGNDTermsGetter(Interface):
 
         `ids` is expected to be an iterable as well.
         """
+
+
+class IOfficeDocConverter(Interface):
+    """A utility converting office documents into other formats.
+    """
+    def convert(context, stream, filename):
+        """Convert the office document read from `stream` into PDF and
+        HTML.
+
+        `stream` is a file object. If it is a file in the filesystem,
+        its `name` is the path of this file. `context` is the object
+        the document belongs to. `filename` is the name of the
+        uploaded document.
+
+        Returns a dict mapping mimetypes (``application/pdf``,
+        ``text/html``) to tuples ``(<DATA>, <SUBOBJECTS>)``, where
+        `<SUBOBJECTS>` is a dict mapping names of embedded files
+        (images, etc.) to their contents. Formats that could not be
+        created are missing.
+        """
@@ -0,0 +1,601 @@
+# -*- coding: utf-8 -*-
+#  psj.content is copyright (c) 2014, 2015 Uli Fouquet
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#  MA 02111-1307 USA.
+#
+"""Loading term lists into Redis stores.
+
+Term lists are expected in the format generated by
+``scripts/normalize.py``, i.e. lines like::
+
+   <KEY>&&<NORMALIZED-VALUE>&&<VALUE>
+
+For each entry we store the autocomplete entry
+``<NORMALIZED-VALUE> (<KEY>)&&<KEY>`` in a ZSET and the ``<VALUE>``
+under ``<KEY>``. This is the layout expected by
+`psj.content.sources.RedisAutocompleteSource`.
+
+Alternatively values can be stored in hashes (see `HashLayout`) as
+expected by `psj.content.sources.RedisHashAutocompleteSource`.
+
+Stores can be dumped into snapshot files (see `dump_snapshot`), which
+sources read from while the Redis store is not available.
+
+For typo-tolerant searches, an n-gram index of the autocomplete ZSET
+can be built (see `build_ngram_index`).
+"""
+import argparse
+import re
+import sys
+import time
+import redis
+from psj.content.recordfile import write_records
+from psj.content.sources import (
+    publish_invalidation, hash_bucket, buckets_name, bucket_count, ngrams,
+    ngram_index_name, DEFAULT_BUCKETS, BUCKET_FILL, SNAPSHOT_ZSET_PREFIX,
+    SNAPSHOT_TITLE_PREFIX,
+    )
+
+#: The regular expression lines of term files must match.
+ENTRY_FORM = re.compile("^(.+)\&\&(.+)\&\&(.+)\n$")
+
+
+def read_entries(lines):
+    """Get `(key, normalized, value)` tuples from `lines`.
+
+    Lines not matching `ENTRY_FORM` are skipped.
+    """
+    for line in lines:
+        match = ENTRY_FORM.match(line)
+        if match:
+            yield match.groups()
+
+
+def batches(iterable, size):
+    """Split `iterable` into lists of at most `size` elements.
+    """
+    batch = []
+    for elem in iterable:
+        batch.append(elem)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def scan_apply(client, pattern, func, batch_size):
+    """Apply `func` to batches of names of keys matching `pattern`.
+
+    `func` gets a list of at most `batch_size` names and returns the
+    number of keys it changed. ``SCAN`` might miss keys when keys are
+    changed while scanning, therefore keys are scanned again until
+    `func` changed no key in a whole scan.
+    """
+    changed = True
+    while changed:
+        changed = False
+        names = client.scan_iter(match=pattern, count=batch_size)
+        for batch in batches(names, batch_size):
+            if func(batch):
+                changed = True
+
+
+def zset_entry(key, normalized):
+    """Get the autocomplete ZSET entry for `key` and `normalized`.
+    """
+    return "%s (%s)&&%s" % (normalized, key, key)
+
+
+class KeyLayout(object):
+    """Store values as top-level keys.
+
+    Layouts tell how to queue commands for getting, setting, and
+    deleting values in a redis pipeline.
+    """
+    def prepare(self, client, store=True):
+        """Prepare the layout for use with the Redis store of `client`.
+
+        If `store` is set, data describing the layout may be written.
+        """
+        pass
+
+    def get(self, pipe, key):
+        pipe.get(key)
+
+    def set(self, pipe, key, value):
+        pipe.set(key, value)
+
+    def delete(self, pipe, keys):
+        pipe.delete(*keys)
+
+
+class HashLayout(KeyLayout):
+    """Store values in `buckets` hashes named ``<HASH_PREFIX>:<NUM>``.
+
+    The number of hashes is stored next to them (see
+    `psj.content.sources.buckets_name`). If `buckets` is ``None``, the
+    stored number is used, or `DEFAULT_BUCKETS` if none is stored.
+
+    `max_length` is the length of the longest value set.
+    """
+    def __init__(self, hash_prefix, buckets=None):
+        self.hash_prefix = hash_prefix
+        self.buckets = buckets
+        self.max_length = 0
+
+    def prepare(self, client, store=True):
+        """Read the number of hashes from the store if not set.
+
+        If `store` is set, we store the number of hashes. Raises
+        `ValueError` if the store uses a different number.
+        """
+        stored = client.get(buckets_name(self.hash_prefix))
+        stored = stored and int(stored) or None
+        if self.buckets is None:
+            self.buckets = stored or DEFAULT_BUCKETS
+        elif stored is not None and stored != self.buckets:
+            raise ValueError(
+                "The store uses %d buckets, not %d" % (stored, self.buckets))
+        if store:
+            client.set(buckets_name(self.hash_prefix), self.buckets)
+
+    def get(self, pipe, key):
+        pipe.hget(hash_bucket(key, self.hash_prefix, self.buckets), key)
+
+    def set(self, pipe, key, value):
+        self.max_length = max(self.max_length, len(value))
+        pipe.hset(
+            hash_bucket(key, self.hash_prefix, self.buckets), key, value)
+
+    def delete(self, pipe, keys):
+        for key in keys:
+            pipe.hdel(hash_bucket(key, self.hash_prefix, self.buckets), key)
+
+
+class Progress(object):
+    """Report the number of processed entries and the throughput.
+
+    A line is written to `out` every `every` entries.
+    """
+    def __init__(self, out=None, every=100000):
+        self.out = out
+        self.every = every
+        self.count = 0
+        self.start = time.time()
+        self._next = every
+
+    @property
+    def rate(self):
+        """Entries processed per second.
+        """
+        return self.count / max(time.time() - self.start, 1e-6)
+
+    def add(self, num):
+        self.count += num
+        if self.out is not None and self.count >= self._next:
+            self.out.write("%d entries (%.0f entries/s)\n" % (
+                self.count, self.rate))
+            self._next = self.count + self.every
+
+
+def load_terms(client, lines, zset_name='gnd-autocomplete', batch_size=1000,
+               out=None, layout=None):
+    """Load terms from `lines` into the Redis store of `client`.
+
+    Entries are sent in pipelined batches of `batch_size` entries.
+    The new ZSET is filled under a temporary name and renamed to
+    `zset_name` when complete. Keys of entries that are not contained
+    in `lines` any more are removed after the swap, so that the ZSET
+    never references deleted keys.
+
+    Autocomplete therefore keeps working while we load. Values of
+    existing keys are replaced in place.
+
+    `layout` tells how values are stored (`KeyLayout` by default).
+
+    Progress is reported to `out`, if given. Returns the number of
+    entries loaded.
+    """
+    layout = layout or KeyLayout()
+    layout.prepare(client)
+    tmp_zset = '%s-loading' % zset_name
+    tmp_keys = '%s-loading-keys' % zset_name
+    old_zset = '%s-replaced' % zset_name
+    client.delete(tmp_zset, tmp_keys, old_zset)
+    progress = Progress(out)
+    for batch in batches(read_entries(lines), batch_size):
+        pipe = client.pipeline(transaction=False)
+        args = []
+        for key, normalized, value in batch:
+            args.extend([0, zset_entry(key, normalized)])
+            layout.set(pipe, key, value)
+        pipe.zadd(tmp_zset, *args)
+        pipe.sadd(tmp_keys, *[entry[0] for entry in batch])
+        pipe.execute()
+        progress.add(len(batch))
+    # swap the ZSETs atomically, keeping the old one to find stale keys
+    pipe = client.pipeline()
+    if client.exists(zset_name):
+        pipe.rename(zset_name, old_zset)
+    if progress.count:
+        pipe.rename(tmp_zset, zset_name)
+    pipe.execute()
+    remove_stale_keys(client, old_zset, tmp_keys, batch_size, layout)
+    client.delete(old_zset, tmp_keys)
+    publish_invalidation(client)
+    if out is not None:
+        out.write("Loaded %d entries (%.0f entries/s)\n" % (
+            progress.count, progress.rate))
+    return progress.count
+
+
+def remove_stale_keys(client, zset_name, keys_name, batch_size=1000,
+                      layout=None):
+    """Delete keys referenced in `zset_name` but not in set `keys_name`.
+
+    Returns the number of keys deleted.
+    """
+    layout = layout or KeyLayout()
+    num = 0
+    entries = client.zscan_iter(zset_name, count=batch_size)
+    for batch in batches(entries, batch_size):
+        keys = [entry.split('&&', 1)[1] for entry, score in batch]
+        pipe = client.pipeline(transaction=False)
+        for key in keys:
+            pipe.sismember(keys_name, key)
+        stale = [key for key, found in zip(keys, pipe.execute())
+                 if not found]
+        if stale:
+            pipe = client.pipeline(transaction=False)
+            layout.delete(pipe, stale)
+            pipe.execute()
+            num += len(stale)
+    return num
+
+
+def apply_delta(client, lines, zset_name='gnd-autocomplete',
+                batch_size=1000, out=None, layout=None):
+    """Update the Redis store of `client` to contain the terms in
+    `lines`.
+
+    Different to `load_terms` we compare `lines` with the data
+    already stored and write only entries that were added, changed,
+    or removed. Lookups and writes are done in pipelined batches of
+    `batch_size` entries.
+
+    While running, we keep track of entries and keys seen in two
+    temporary Redis SETs.
+
+    `layout` tells how values are stored (`KeyLayout` by default).
+
+    Progress is reported to `out`, if given. Returns a dict with the
+    number of entries `added`, `changed`, `removed`, and `unchanged`.
+    """
+    layout = layout or KeyLayout()
+    layout.prepare(client)
+    seen_entries = '%s-delta-entries' % zset_name
+    seen_keys = '%s-delta-keys' % zset_name
+    client.delete(seen_entries, seen_keys)
+    stats = dict(added=0, changed=0, removed=0, unchanged=0)
+    progress = Progress(out)
+    for batch in batches(read_entries(lines), batch_size):
+        entries = [zset_entry(key, normalized)
+                   for key, normalized, value in batch]
+        keys = [key for key, normalized, value in batch]
+        pipe = client.pipeline(transaction=False)
+        for entry, key in zip(entries, keys):
+            pipe.zscore(zset_name, entry)
+            layout.get(pipe, key)
+        results = pipe.execute()
+        pipe = client.pipeline(transaction=False)
+        pipe.sadd(seen_entries, *entries)
+        pipe.sadd(seen_keys, *keys)
+        args = []
+        for num, (key, normalized, value) in enumerate(batch):
+            score, old_value = results[2 * num], results[2 * num + 1]
+            if score is None:
+                args.extend([0, entries[num]])
+            if old_value != value:
+                layout.set(pipe, key, value)
+            if old_value is None:
+                stats['added'] += 1
+            elif score is None or old_value != value:
+                stats['changed'] += 1
+            else:
+                stats['unchanged'] += 1
+        if args:
+            pipe.zadd(zset_name, *args)
+        pipe.execute()
+        progress.add(len(batch))
+    stale_entries = client.zscan_iter(zset_name, count=batch_size)
+    for batch in batches(stale_entries, batch_size):
+        entries = [entry for entry, score in batch]
+        pipe = client.pipeline(transaction=False)
+        for entry in entries:
+            pipe.sismember(seen_entries, entry)
+        stale = [entry for entry, found in zip(entries, pipe.execute())
+                 if not found]
+        if not stale:
+            continue
+        keys = [entry.split('&&', 1)[1] for entry in stale]
+        pipe = client.pipeline(transaction=False)
+        for key in keys:
+            pipe.sismember(seen_keys, key)
+        removed = [key for key, found in zip(keys, pipe.execute())
+                   if not found]
+        pipe = client.pipeline(transaction=False)
+        pipe.zrem(zset_name, *stale)
+        if removed:
+            layout.delete(pipe, removed)
+        pipe.execute()
+        stats['removed'] += len(removed)
+    client.delete(seen_entries, seen_keys)
+    if stats['added'] or stats['changed'] or stats['removed']:
+        publish_invalidation(client)
+    if out is not None:
+        out.write(
+            "Checked %d entries (%.0f entries/s): %d added, %d changed, "
+            "%d removed, %d unchanged\n" % (
+                progress.count, progress.rate, stats['added'],
+                stats['changed'], stats['removed'], stats['unchanged']))
+    return stats
+
+
+def migrate_to_hashes(client, zset_name='gnd-autocomplete', hash_prefix=None,
+                      buckets=None, batch_size=1000, out=None):
+    """Move values of all keys referenced in `zset_name` into hashes.
+
+    Afterwards the store can be read by `RedisHashAutocompleteSource`
+    with same `hash_prefix`. `hash_prefix` defaults to
+    ``<ZSET_NAME>-titles``. The old keys are deleted.
+
+    `buckets` is the number of hashes. By default it is derived from
+    the number of entries (see `psj.content.sources.bucket_count`),
+    unless the store tells already.
+
+    Returns the number of values moved.
+    """
+    if hash_prefix is None:
+        hash_prefix = '%s-titles' % zset_name
+    if buckets is None and not client.exists(buckets_name(hash_prefix)):
+        buckets = bucket_count(client.zcard(zset_name))
+    layout = HashLayout(hash_prefix, buckets)
+    layout.prepare(client)
+    progress = Progress(out)
+    entries = client.zscan_iter(zset_name, count=batch_size)
+    for batch in batches(entries, batch_size):
+        keys = [entry.split('&&', 1)[1] for entry, score in batch]
+        pipe = client.pipeline(transaction=False)
+        moved = []
+        for key, value in zip(keys, client.mget(keys)):
+            if value is None:
+                continue
+            layout.set(pipe, key, value)
+            moved.append(key)
+        if moved:
+            pipe.delete(*moved)
+            pipe.execute()
+        progress.add(len(moved))
+    publish_invalidation(client)
+    if out is not None:
+        out.write("Moved %d values (%.0f values/s)\n" % (
+            progress.count, progress.rate))
+        report_hashes(layout, out)
+    return progress.count
+
+
+def report_hashes(layout, out):
+    """Write the Redis server settings needed to store the hashes of
+    `layout` compactly to `out`.
+    """
+    out.write(
+        "Values are stored in %d hashes. Longest value: %d bytes. "
+        "Make sure the redis option hash-max-ziplist-value (or "
+        "hash-max-listpack-value) is not smaller.\n" % (
+            layout.buckets, layout.max_length))
+
+
+def count_lines(path):
+    """Get the number of lines in the file at `path`.
+    """
+    with open(path, 'r') as fd:
+        return sum(1 for line in fd)
+
+
+def dump_snapshot(client, path, zset_name='gnd-autocomplete', batch_size=1000,
+                  out=None, layout=None):
+    """Write a snapshot of the autocomplete store to `path`.
+
+    The snapshot is a record file containing all entries of
+    `zset_name` and the values of all keys referenced therein, as
+    read by `psj.content.sources.RedisSnapshot`. Values are read as
+    stored in `layout`.
+
+    Returns the number of ZSET entries written.
+    """
+    if layout is None:
+        layout = KeyLayout()
+    layout.prepare(client, store=False)
+    progress = Progress(out)
+
+    def records():
+        entries = client.zscan_iter(zset_name, count=batch_size)
+        for batch in batches(entries, batch_size):
+            entries = [entry for entry, score in batch]
+            keys = [entry.split('&&', 1)[1] for entry in entries]
+            pipe = client.pipeline(transaction=False)
+            for key in keys:
+                layout.get(pipe, key)
+            for entry, key, value in zip(entries, keys, pipe.execute()):
+                if value is None:
+                    continue
+                yield SNAPSHOT_ZSET_PREFIX + entry, ''
+                yield SNAPSHOT_TITLE_PREFIX + key, value
+            progress.add(len(batch))
+
+    write_records(path, records())
+    if out is not None:
+        out.write("Dumped %d entries (%.0f entries/s)\n" % (
+            progress.count, progress.rate))
+    return progress.count
+
+
+def build_ngram_index(client, zset_name='gnd-autocomplete', batch_size=1000,
+                      out=None):
+    """Build an n-gram index of all entries in `zset_name`.
+
+    For each n-gram of the normalized titles in `zset_name` we store
+    the keys of the respective terms in a SET named
+    ``<ZSET_NAME>-ngram:<NGRAM>`` (see
+    `psj.content.sources.ngram_index_name`). These sets are read by
+    `psj.content.sources.RedisAutocompleteSource.search_ngrams`.
+
+    The sets are filled under temporary names and renamed when
+    complete. Sets of n-grams not occurring any more are removed. Set
+    names are not collected in memory, but read with ``SCAN`` in
+    batches of `batch_size` names. Entries added with `apply_delta`
+    are indexed only after the index was rebuilt.
+
+    Returns the number of entries indexed.
+    """
+    tmp_zset = '%s-ngram-loading' % zset_name
+    prefix = ngram_index_name(zset_name, u'')
+    tmp_prefix = ngram_index_name(tmp_zset, u'')
+    for batch in batches(
+            client.scan_iter(match=tmp_prefix + '*', count=batch_size),
+            batch_size):
+        client.delete(*batch)  # leftovers of aborted runs
+    progress = Progress(out)
+    entries = client.zscan_iter(zset_name, count=batch_size)
+    for batch in batches(entries, batch_size):
+        pipe = client.pipeline(transaction=False)
+        for entry, score in batch:
+            normalized, key = entry.split('&&', 1)
+            suffix = ' (%s)' % key
+            if normalized.endswith(suffix):
+                normalized = normalized[:-len(suffix)]
+            for gram in ngrams(normalized.decode('utf-8')):
+                pipe.sadd(ngram_index_name(tmp_zset, gram), key)
+        pipe.execute()
+        progress.add(len(batch))
+    def delete_stale(names):
+        # sets without new counterpart belong to n-grams not occurring
+        pipe = client.pipeline(transaction=False)
+        for name in names:
+            pipe.exists(tmp_prefix + name[len(prefix):])
+        stale = [name for name, found in zip(names, pipe.execute())
+                 if not found]
+        return stale and client.delete(*stale)
+
+    def rename(names):
+        pipe = client.pipeline(transaction=False)
+        for name in names:
+            pipe.rename(name, prefix + name[len(tmp_prefix):])
+        # SCAN might deliver names twice. Renaming them again fails
+        # harmlessly.
+        results = pipe.execute(raise_on_error=False)
+        return len([result for result in results if result is True])
+
+    scan_apply(client, prefix + '*', delete_stale, batch_size)
+    scan_apply(client, tmp_prefix + '*', rename, batch_size)
+    if out is not None:
+        out.write("Indexed %d entries (%.0f entries/s)\n" % (
+            progress.count, progress.rate))
+    return progress.count
+
+
+def main(argv=None):
+    """Load a term file into a Redis store.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument(
+        'path', nargs='?', default='terms.txt',
+        help='term file as created by normalize.py (default: terms.txt)')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=6379)
+    parser.add_argument('--db', type=int, default=0)
+    parser.add_argument(
+        '--zset', default='gnd-autocomplete',
+        help='name of the autocomplete ZSET (default: gnd-autocomplete)')
+    parser.add_argument(
+        '--batch-size', type=int, default=1000,
+        help='number of entries sent at once (default: 1000)')
+    parser.add_argument(
+        '--delta', action='store_true',
+        help='write only entries that differ from the stored ones')
+    parser.add_argument(
+        '--layout', choices=['keys', 'hash'], default='keys',
+        help='store values as top-level keys (default) or in hashes')
+    parser.add_argument(
+        '--hash-prefix', default=None,
+        help='prefix of hash names (default: <ZSET>-titles)')
+    parser.add_argument(
+        '--buckets', type=int, default=None,
+        help='number of hashes (default: as stored, or about one per '
+        '%s terms for new stores)' % BUCKET_FILL)
+    parser.add_argument(
+        '--migrate', action='store_true',
+        help='move values of an existing store from keys into hashes. '
+        'No term file is read.')
+    parser.add_argument(
+        '--snapshot', metavar='SNAPSHOT_PATH', default=None,
+        help='write a snapshot of the store to SNAPSHOT_PATH. '
+        'No term file is read.')
+    parser.add_argument(
+        '--ngrams', action='store_true',
+        help='(re-)build the n-gram index for typo-tolerant searches '
+        'after loading')
+    args = parser.parse_args(argv)
+    client = redis.StrictRedis(host=args.host, port=args.port, db=args.db)
+    hash_prefix = args.hash_prefix or '%s-titles' % args.zset
+    if args.migrate:
+        try:
+            migrate_to_hashes(
+                client, zset_name=args.zset, hash_prefix=hash_prefix,
+                buckets=args.buckets, batch_size=args.batch_size,
+                out=sys.stdout)
+        except ValueError as err:
+            parser.error(str(err))
+        return
+    layout = KeyLayout()
+    if args.layout == 'hash':
+        buckets = args.buckets
+        new_store = not (client.exists(args.zset) or client.exists(
+            buckets_name(hash_prefix)))
+        if buckets is None and not args.snapshot and new_store:
+            # size hashes by the number of terms.
+            buckets = bucket_count(count_lines(args.path))
+        layout = HashLayout(hash_prefix, buckets)
+    if args.snapshot:
+        dump_snapshot(
+            client, args.snapshot, zset_name=args.zset,
+            batch_size=args.batch_size, out=sys.stdout, layout=layout)
+        return
+    try:
+        layout.prepare(client)
+    except ValueError as err:
+        parser.error(str(err))
+    loader = args.delta and apply_delta or load_terms
+    with open(args.path, 'r') as fd:
+        loader(client, fd, zset_name=args.zset, batch_size=args.batch_size,
+               out=sys.stdout, layout=layout)
+    if args.layout == 'hash':
+        report_hashes(layout, sys.stdout)
+    if args.ngrams:
+        build_ngram_index(
+            client, zset_name=args.zset, batch_size=args.batch_size,
+            out=sys.stdout)
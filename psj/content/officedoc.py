@@ -18,21 +18,20 @@
 """Dexterity type for office docs.
 
 """
-import md5
 from five import grok
 from plone.dexterity.content import Container
 from plone.directives.dexterity import DisplayForm
 from plone.namedfile.field import NamedBlobFile as NamedBlobFileField
-from plone.namedfile.file import NamedBlobFile
 from plone.supermodel import model
-from Products.CMFCore.utils import getToolByName
 from zope import schema
 from zope.component import queryUtility
 from zope.lifecycleevent.interfaces import (
     IObjectAddedEvent, IObjectModifiedEvent
     )
 from psj.content import _
+from psj.content.conversion import create_or_enqueue, create_reprs
 from psj.content.interfaces import ISearchableTextGetter
+from psj.content.utils import file_digest
 
 
 class IOfficeDoc(model.Schema):
@@ -71,8 +70,21 @@ class IOfficeDoc(model.Schema):
         readonly=True,
         )
 
-    def psj_create_reprs():
+    psj_conversion_state = schema.ASCIILine(
+        title=_(u'Conversion State'),
+        description=_(
+            u'State of the conversion of the source document '
+            u'(pending, done, or failed).'),
+        required=False,
+        readonly=True,
+        )
+
+    def psj_create_reprs(digest=None):
         """Create PDF, HTML, etc. representations of source doc.
+
+        `digest` is the MD5 sum of the source doc, if already known.
+
+        Returns ``True`` if all representations were created.
         """
 
 
@@ -87,66 +99,12 @@ class OfficeDoc(Container):
     psj_md5 = None
     psj_html_repr = None
     psj_pdf_repr = None
+    psj_conversion_state = None
 
-    def psj_create_pdf(self, transforms, in_data):
-        """Create a PDF representation of `in_data`.
-
-        `in_data` is supposed to be the binary content of an office
-        document.
-
-        `transforms` are the portal transforms.
-        """
-        out_data = transforms.convertTo(
-            'application/pdf', in_data,
-            mimetype='application/vnd.oasis.opendocument.text')
-        if out_data is None:
-            # transform failed
-            return
-        new_filename = self.psj_office_doc.filename + '.pdf'
-        self.psj_pdf_repr = NamedBlobFile(
-            data=out_data.getData(), filename=new_filename)
-
-    def psj_create_html(self, transforms, in_data):
-        """Create an HTML representation of `in_data`.
-
-        `in_data` is supposed to be the binary content of an office
-        document.
-
-        `transforms` are the portal transforms.
-        """
-        out_data = transforms.convertTo(
-            'text/html', in_data,
-            mimetype='application/vnd.oasis.opendocument.text')
-        self.psj_md5 = md5.new(in_data).hexdigest()
-        if out_data is None:
-            # transform failed
-            return
-        new_filename = self.psj_office_doc.filename + '.html'
-        html = out_data.getData()
-        self.psj_html_repr = NamedBlobFile(
-            data=html, filename=new_filename)
-        for name in self.keys():
-            # make sure all old extra-files (images, etc.) are
-            # deleted.
-            del self[name]
-        for name, subdata in out_data.getSubObjects().items():
-            name = name.decode('utf8')
-            if name.lower()[-4:] in (u'.png', u'.jpg', u'.gif', u'.tif'):
-                new_name = self.invokeFactory('Image', name)
-            else:
-                new_name = self.invokeFactory('File', name)
-            new_context = self[new_name]
-            new_context.update_data(subdata)
-
-    def psj_create_reprs(self):
+    def psj_create_reprs(self, digest=None):
         """Create PDF, HTML, etc. representations of source doc.
         """
-        transforms = getToolByName(self, 'portal_transforms')
-        in_data = getattr(self.psj_office_doc, 'data', None)
-        if in_data is not None:  # safety belt
-            self.psj_create_pdf(transforms, in_data)
-            self.psj_create_html(transforms, in_data)
-        return
+        return create_reprs(self, digest)
 
     def SearchableText(self):
         """The text searchable in this document.
@@ -167,9 +125,10 @@ class OfficeDoc(Container):
 def create_representations(obj, event):
     """Event handler for freshly created IOfficeDocs.
 
-    Creates PDF representation of uploaded office doc on creation.
+    Creates PDF representation of uploaded office doc on creation (or
+    queues a conversion job, if queued conversions are enabled).
     """
-    obj.psj_create_reprs()
+    create_or_enqueue(obj, OfficeDoc.psj_create_reprs)
     return
 
 
@@ -180,11 +139,11 @@ def update_representations(obj, event):
     Checks, whether source doc was really changed (by comparing MD5
     sums) and if so updates all respective representations.
     """
-    md5_sum = md5.new(getattr(obj.psj_office_doc, 'data', '')).hexdigest()
+    md5_sum = file_digest(obj.psj_office_doc)
     old_md5 = getattr(obj, 'psj_md5', '')
     if md5_sum == old_md5:
         return
-    obj.psj_create_reprs()
+    create_or_enqueue(obj, OfficeDoc.psj_create_reprs, md5_sum)
     return
 
 
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+#  psj.content is copyright (c) 2014, 2015 Uli Fouquet
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#  MA 02111-1307 USA.
+#
+"""Sorted record files.
+
+A record file stores `(key, value)` pairs of byte strings in a compact
+binary format that can be searched without loading it into memory.
+The file consists of
+
+- a header (magic bytes and number of records),
+
+- an index of record offsets, sorted by record keys,
+
+- the records in the order they were written. Each record is stored
+  as key length, value length, key and value.
+
+All numbers are stored little-endian. Files are accessed via `mmap`,
+so several processes reading the same file share its memory through
+the page cache.
+"""
+import mmap
+import os
+import struct
+import tempfile
+
+#: Magic bytes every record file starts with.
+MAGIC = 'PSJREC1\n'
+
+_HEADER = struct.Struct('<8sQ')
+_OFFSET = struct.Struct('<Q')
+_RECORD = struct.Struct('<II')
+
+
+def write_records(path, records):
+    """Write `records` to a record file at `path`.
+
+    `records` is an iterable of `(key, value)` tuples of byte
+    strings. If a key occurs more than once, only the first record is
+    kept.
+
+    The file is written under a temporary name and renamed to `path`
+    afterwards, so readers never see incomplete files.
+
+    Returns the number of records written.
+    """
+    dirname = os.path.dirname(os.path.abspath(path))
+    fd, data_path = tempfile.mkstemp(dir=dirname)
+    offsets = {}
+    try:
+        with os.fdopen(fd, 'wb') as data_file:
+            pos = 0
+            for key, value in records:
+                if key in offsets:
+                    continue
+                offsets[key] = pos
+                data_file.write(_RECORD.pack(len(key), len(value)))
+                data_file.write(key)
+                data_file.write(value)
+                pos += _RECORD.size + len(key) + len(value)
+        fd, tmp_path = tempfile.mkstemp(dir=dirname)
+        with os.fdopen(fd, 'wb') as out:
+            start = _HEADER.size + _OFFSET.size * len(offsets)
+            out.write(_HEADER.pack(MAGIC, len(offsets)))
+            for key in sorted(offsets):
+                out.write(_OFFSET.pack(start + offsets[key]))
+            with open(data_path, 'rb') as data_file:
+                while True:
+                    chunk = data_file.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    out.write(chunk)
+        os.rename(tmp_path, path)
+    finally:
+        os.unlink(data_path)
+    return len(offsets)
+
+
+class RecordFile(object):
+    """Read-only access to a record file at `path`.
+
+    Lookups by key are done by binary search over the sorted index.
+    Raises `ValueError` if `path` is not a record file.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as fd:
+            self._map = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map.size() < _HEADER.size:
+            raise ValueError('Not a record file: %s' % path)
+        magic, self._len = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError('Not a record file: %s' % path)
+        self._start = _HEADER.size + _OFFSET.size * self._len
+
+    def __len__(self):
+        return self._len
+
+    def _record(self, offset):
+        """Get the `(key, value, next_offset)` stored at `offset`.
+        """
+        key_len, value_len = _RECORD.unpack_from(self._map, offset)
+        start = offset + _RECORD.size
+        end = start + key_len + value_len
+        return (self._map[start:start + key_len],
+                self._map[start + key_len:end], end)
+
+    def _sorted_record(self, num):
+        """Get the `(key, value)` that is `num`-th in sort order.
+        """
+        offset, = _OFFSET.unpack_from(
+            self._map, _HEADER.size + _OFFSET.size * num)
+        return self._record(offset)[:2]
+
+    def _bisect(self, key):
+        """Get the sort position of the first record with a key not
+        lower than `key`.
+        """
+        low, high = 0, self._len
+        while low < high:
+            mid = (low + high) // 2
+            if self._sorted_record(mid)[0] < key:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def get(self, key, default=None):
+        """Get the value stored for `key` or `default`.
+        """
+        num = self._bisect(key)
+        if num < self._len:
+            found, value = self._sorted_record(num)
+            if found == key:
+                return value
+        return default
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __iter__(self):
+        """Iterate over all `(key, value)` tuples in the order they
+        were written.
+        """
+        offset = self._start
+        for num in xrange(self._len):
+            key, value, offset = self._record(offset)
+            yield key, value
+
+    def from_key(self, start, limit=None):
+        """Iterate over `(key, value)` tuples of all records with keys
+        not lower than `start` in sort order.
+
+        At most `limit` records are delivered, if `limit` is set.
+        """
+        num = self._bisect(start)
+        end = self._len
+        if limit is not None:
+            end = min(end, num + limit)
+        while num < end:
+            yield self._sorted_record(num)
+            num += 1
+
+    def prefixed(self, prefix, limit=None):
+        """Iterate over `(key, value)` tuples of all records with keys
+        starting with `prefix` in sort order.
+
+        At most `limit` records are delivered, if `limit` is set.
+        """
+        for key, value in self.from_key(prefix, limit):
+            if not key.startswith(prefix):
+                break
+            yield key, value
+
+    def close(self):
+        self._map.close()
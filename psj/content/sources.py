@@ -19,16 +19,666 @@
 """Sources (in the zope.schema sense) and source context binders.
 
 """
+import bisect
+import hashlib
+import logging
+import marshal
 import os
 import redis
+import stat
+import tempfile
+import threading
+import time
+import zlib
 from dinsort import normalize
 from five import grok
 from z3c.formwidget.query.interfaces import IQuerySource
 from zope.component import queryUtility
-from zope.schema.interfaces import IContextSourceBinder
+from zope.schema.interfaces import (
+    IContextSourceBinder, ITitledTokenizedTerm, IVocabularyTokenized,
+    )
 from zope.schema.vocabulary import SimpleVocabulary, SimpleTerm
-from psj.content.interfaces import IExternalVocabConfig, IRedisStoreConfig
-from psj.content.utils import make_terms, tokenize, untokenize, to_string
+from psj.content import _
+from psj.content.interfaces import (
+    IExternalVocabConfig, IRedisStoreConfig, IPSJGNDTermsGetter,
+    )
+from psj.content.recordfile import RecordFile, write_records
+from psj.content.utils import (
+    tokenize, untokenize, to_string, LRUCache,
+    )
+
+
+logger = logging.getLogger('psj.content')
+
+#: The maximum number of connections kept per redis connection pool.
+MAX_CONNECTIONS = 32
+
+#: The number of hashes of stores that do not tell (see `buckets_name`).
+#: Older versions always distributed titles over this many hashes.
+DEFAULT_BUCKETS = 65536
+
+#: The average number of titles per hash aimed at by `bucket_count`.
+#: Redis stores hashes compactly only up to ``hash-max-ziplist-entries``
+#: (128 by default) fields. Titles are not distributed evenly, so we
+#: leave some room.
+BUCKET_FILL = 64
+
+#: Optional connection parameters of `IRedisStoreConfig`. The
+#: `snapshot_path` of configs is not passed to connections.
+CONNECTION_OPTIONS = (
+    'max_connections', 'socket_timeout', 'socket_connect_timeout',
+    'socket_keepalive', 'unix_socket_path')
+
+#: The maximum length of prefixes usage rankings are kept for.
+RANKING_PREFIX_LENGTH = 4
+
+#: The number of most used terms kept per prefix.
+RANKING_SIZE = 50
+
+#: The length of n-grams in n-gram indexes.
+NGRAM_SIZE = 3
+
+#: The maximum number of n-gram posting sets merged in fuzzy searches.
+NGRAM_UNION_SIZE = 6
+
+#: The maximum size of n-gram posting sets intersected or merged in
+#: fuzzy searches. Bigger sets belong to n-grams too common to tell
+#: terms apart. Redis blocks all clients while combining sets, which
+#: takes time proportional to their sizes.
+NGRAM_MAX_SET_SIZE = 2000
+
+#: Prefixes of ZSET entries and titles in snapshot record files.
+SNAPSHOT_ZSET_PREFIX = 'z:'
+SNAPSHOT_TITLE_PREFIX = 't:'
+
+#: Errors telling that a Redis store is not available.
+REDIS_UNAVAILABLE = (redis.ConnectionError, redis.TimeoutError)
+
+#: The version of the vocab cache file format.
+VOCAB_CACHE_VERSION = 1
+
+#: The directory for vocab cache and record files. If ``None``, we use
+#: the one returned by `default_vocab_cache_dir`.
+VOCAB_CACHE_DIR = None
+
+
+def connection_options(conf, timeout=None):
+    """Get the optional connection parameters set in `conf`.
+
+    `conf` is an `IRedisStoreConfig`. Returns a dict that can be
+    passed as `connection_options` to sources.
+
+    If `timeout` is given, it is used as `socket_timeout` and
+    `socket_connect_timeout`, unless these are set in `conf`. Pools
+    are keyed by options, so everybody connecting to a store with a
+    certain timeout should get the options from here to share pools.
+    """
+    options = dict([(key, conf[key]) for key in CONNECTION_OPTIONS
+                    if conf.get(key) is not None])
+    if timeout is not None:
+        options.setdefault('socket_timeout', timeout)
+        options.setdefault('socket_connect_timeout', timeout)
+    return options
+
+
+class CircuitBreaker(object):
+    """Stop calling an unavailable service for a while.
+
+    Callers ask `allow()` before calling the service and report the
+    outcome with `success()` or `failure()`. After `max_failures`
+    failures in a row, the circuit opens and `allow()` returns
+    ``False``. Every `reset_timeout` seconds one call is allowed to
+    try again. The circuit closes with the next success.
+    """
+    def __init__(self, max_failures=3, reset_timeout=30):
+        self.max_failures = max_failures
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened is not None
+
+    def allow(self):
+        """Tell whether the service should be called.
+        """
+        with self._lock:
+            if self.opened is None:
+                return True
+            now = time.time()
+            if now - self.opened >= self.reset_timeout:
+                self.opened = now
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.max_failures:
+                self.opened = time.time()
+
+
+class RedisConnectionPools(object):
+    """A registry of redis connection pools.
+
+    Pools are keyed by `(host, port, db)` plus connection options and
+    created on first request. All sources and behaviors in a process
+    share the pools of this registry, instead of opening own
+    connections each time they are bound.
+
+    `max_connections` limits the number of connections held by each
+    pool, unless set in the options of a pool. Requesting more
+    connections from a pool raises a `redis.ConnectionError`.
+
+    Other options (see `CONNECTION_OPTIONS`) are passed to the
+    connections. If `unix_socket_path` is set, we connect to this
+    unix socket instead of `host` and `port`.
+
+    For each pool we also keep a `CircuitBreaker` (see `breaker`).
+
+    An instance of this class is available as `connection_pools`.
+    """
+    def __init__(self, max_connections=MAX_CONNECTIONS):
+        self.max_connections = max_connections
+        self._pools = {}
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def _create(self, host, port, db, options):
+        """Create a connection pool.
+        """
+        options = dict(options)
+        max_connections = options.pop(
+            'max_connections', self.max_connections)
+        path = options.pop('unix_socket_path', None)
+        if path is not None:
+            return redis.ConnectionPool(
+                connection_class=redis.UnixDomainSocketConnection,
+                path=path, db=db, max_connections=max_connections,
+                socket_timeout=options.get('socket_timeout'))
+        return redis.ConnectionPool(
+            host=host, port=port, db=db, max_connections=max_connections,
+            **options)
+
+    def get(self, host='localhost', port=6379, db=0, **options):
+        """Get the connection pool for `host`, `port`, and `db`.
+
+        `options` are optional connection parameters.
+        """
+        key = (host, port, db) + tuple(sorted(options.items()))
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = self._create(host, port, db, options)
+                self._pools[key] = pool
+        return pool
+
+    def get_client(self, host='localhost', port=6379, db=0, **options):
+        """Get a redis client using a pooled connection.
+        """
+        return redis.StrictRedis(
+            connection_pool=self.get(host, port, db, **options))
+
+    def breaker(self, host='localhost', port=6379, db=0, **options):
+        """Get the circuit breaker for connections to `host`, `port`,
+        and `db`.
+        """
+        key = (host, port, db) + tuple(sorted(options.items()))
+        with self._lock:
+            breaker = self._breakers.get(key)
+            if breaker is None:
+                breaker = self._breakers[key] = CircuitBreaker()
+        return breaker
+
+    def stats(self):
+        """Report the usage of all pools.
+
+        Returns a dict mapping pool keys (`(host, port, db)` tuples,
+        followed by connection options, if any) to dicts with
+        the number of connections `created`, `in_use`, and `available`
+        and the `max_connections` allowed.
+        """
+        result = {}
+        with self._lock:
+            items = list(self._pools.items())
+        for key, pool in items:
+            result[key] = dict(
+                created=getattr(pool, '_created_connections', 0),
+                in_use=len(getattr(pool, '_in_use_connections', ())),
+                available=len(getattr(pool, '_available_connections', ())),
+                max_connections=pool.max_connections,
+                )
+        return result
+
+    def clear(self):
+        """Disconnect and forget all pools and circuit breakers.
+        """
+        with self._lock:
+            pools, self._pools = list(self._pools.values()), {}
+            self._breakers = {}
+        for pool in pools:
+            pool.disconnect()
+
+
+#: The process-wide registry of redis connection pools.
+connection_pools = RedisConnectionPools()
+
+#: The pub/sub channel to announce changed keys on.
+INVALIDATION_CHANNEL = 'psj-invalidate'
+
+#: Marker for missing cache entries.
+_MARKER = object()
+
+
+def publish_invalidation(client, keys=None, channel=INVALIDATION_CHANNEL):
+    """Tell term caches listening on `client` that `keys` changed.
+
+    If `keys` is ``None``, all cached entries are invalidated.
+    """
+    if keys is None:
+        client.publish(channel, '*')
+        return
+    for key in keys:
+        client.publish(channel, key)
+
+
+class RedisCacheInvalidator(threading.Thread):
+    """A thread removing changed keys from a term cache.
+
+    We listen for keyspace notifications of the Redis store given by
+    `host`, `port`, and `db` and for messages published on `channel`.
+    Each key announced is removed from `cache`. A message ``*`` on
+    `channel` empties the cache.
+
+    Keyspace notifications have to be enabled in the Redis server
+    (``notify-keyspace-events`` must contain ``K`` and ``A`` or the
+    respective event types). Bulk operations like ``FLUSHDB`` are not
+    announced via keyspace notifications; loaders should call
+    `publish_invalidation` afterwards.
+
+    Keyspace notifications of hash commands (``HSET``, ``HDEL``, ...)
+    name the changed hash, not the changed field. As
+    `RedisHashAutocompleteSource` caches titles by field, we empty
+    the cache on these events.
+
+    Messages are polled every `poll_interval` seconds. If the
+    connection breaks or anything else goes wrong, we empty the cache
+    (we might miss notifications in between) and try to reconnect
+    every `retry_delay` seconds.
+    """
+    def __init__(self, cache, host='localhost', port=6379, db=0,
+                 channel=INVALIDATION_CHANNEL, retry_delay=5,
+                 connection_options=None, poll_interval=0.1):
+        super(RedisCacheInvalidator, self).__init__(
+            name='psj-cache-invalidator-%s:%s/%s' % (host, port, db))
+        self.daemon = True
+        self.cache = cache
+        self.host = host
+        self.port = port
+        self.db = db
+        self.channel = channel
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self.connection_options = connection_options or {}
+        self.prefix = '__keyspace@%s__:' % db
+        self._stopped = threading.Event()
+
+    def handle(self, message):
+        """Handle a pub/sub `message`.
+        """
+        if message['type'] == 'pmessage':
+            if message['data'].startswith('h'):
+                self.cache.clear()  # a hash field changed
+                return
+            key = message['channel'][len(self.prefix):]
+            self.cache.invalidate(key)
+        elif message['type'] == 'message':
+            if message['data'] == '*':
+                self.cache.clear()
+            else:
+                self.cache.invalidate(message['data'])
+
+    def run(self):
+        while not self._stopped.is_set():
+            pubsub = connection_pools.get_client(
+                self.host, self.port, self.db,
+                **self.connection_options).pubsub(
+                    ignore_subscribe_messages=True)
+            try:
+                pubsub.psubscribe('%s*' % self.prefix)
+                pubsub.subscribe(self.channel)
+                while not self._stopped.is_set():
+                    message = pubsub.get_message()
+                    if message is None:
+                        self._stopped.wait(self.poll_interval)
+                    else:
+                        self.handle(message)
+            except Exception:
+                logger.exception(
+                    "Cache invalidation for Redis store %s:%s/%s failed. "
+                    "Reconnecting in %s seconds.",
+                    self.host, self.port, self.db, self.retry_delay)
+                self.cache.clear()
+                self._stopped.wait(self.retry_delay)
+            finally:
+                pubsub.close()
+
+    def stop(self):
+        """Stop listening.
+        """
+        self._stopped.set()
+
+
+def default_vocab_cache_dir():
+    """Get the default directory for vocab cache and record files.
+
+    This is ``psj-vocab-cache`` in the var directory of the Zope
+    instance (its `clienthome`). Outside of Zope instances we use a
+    directory in the system temp dir, named after the current user id.
+    """
+    try:
+        from App.config import getConfiguration
+        clienthome = getattr(getConfiguration(), 'clienthome', None)
+    except ImportError:
+        clienthome = None
+    if clienthome:
+        return os.path.join(clienthome, 'psj-vocab-cache')
+    return os.path.join(
+        tempfile.gettempdir(), 'psj-vocab-cache-%s' % os.getuid())
+
+
+def trusted_dir(path):
+    """Tell whether we can trust the files in directory `path`.
+
+    The directory is created with mode 0700 if it does not exist yet.
+    It must be owned by the current user and must not be writable by
+    others, as we read cached vocab entries from it.
+    """
+    if not os.path.exists(path):
+        try:
+            os.makedirs(path, 0o700)
+        except OSError:
+            pass
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return (stat.S_ISDIR(st.st_mode) and st.st_uid == os.getuid() and
+            not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH))
+
+
+def vocab_cache_path(path, suffix, cache_dir=None):
+    """Get the path of a cache file for the vocab file at `path`.
+
+    Cache files are kept in `cache_dir`, which defaults to
+    `VOCAB_CACHE_DIR` or `default_vocab_cache_dir`, and not next to
+    the vocab files, which might live in a source tree or on a
+    read-only filesystem. The filename contains an MD5 sum of the
+    absolute vocab file path, so vocab files with the same basename
+    do not share caches. `suffix` is appended.
+
+    Returns ``None`` if the cache directory cannot be trusted (see
+    `trusted_dir`).
+    """
+    if cache_dir is None:
+        cache_dir = VOCAB_CACHE_DIR or default_vocab_cache_dir()
+    if not trusted_dir(cache_dir):
+        logger.warning("Not caching vocabs in untrusted dir %s", cache_dir)
+        return None
+    path = os.path.abspath(path)
+    if isinstance(path, unicode):
+        path = path.encode('utf-8')
+    return os.path.join(cache_dir, '%s-%s%s' % (
+        os.path.basename(path), hashlib.md5(path).hexdigest(), suffix))
+
+
+def read_vocab_entries(path, cache_path=None, cache_dir=None):
+    """Get `(token, value)` tuples for the lines of the vocab file at
+    `path`.
+
+    Tokens and values equal the ones created by ``make_terms`` for the
+    stripped lines of the file. As tokenizing and decoding all lines
+    takes its time for large files, the result is cached in a
+    marshalled file at `cache_path`, which defaults to a `.cache` file
+    in `cache_dir` (see `vocab_cache_path`). The cache is only used if
+    it was made from a file with the same MD5 sum and with the current
+    `VOCAB_CACHE_VERSION`.
+
+    If the cache file cannot be written or the cache dir is not
+    trusted, we do without.
+    """
+    if cache_path is None:
+        cache_path = vocab_cache_path(path, '.cache', cache_dir)
+    with open(path, 'rb') as fd:
+        data = fd.read()
+    digest = hashlib.md5(data).hexdigest()
+    entries = None
+    if cache_path is not None:
+        try:
+            with open(cache_path, 'rb') as fd:
+                version, cached_digest, cached_entries = marshal.load(fd)
+            if (version, cached_digest) == (VOCAB_CACHE_VERSION, digest):
+                entries = cached_entries
+        except (IOError, EOFError, ValueError, TypeError):
+            pass
+    if entries is None:
+        entries = [(tokenize(line), line.decode('utf-8'))
+                   for line in (x.strip() for x in data.split('\n'))
+                   if line]
+        if cache_path is None:
+            return entries
+        tmp_path = '%s.%s.tmp' % (cache_path, os.getpid())
+        try:
+            with open(tmp_path, 'wb') as fd:
+                marshal.dump((VOCAB_CACHE_VERSION, digest, entries), fd)
+            os.rename(tmp_path, cache_path)
+        except (IOError, OSError):
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+    return entries
+
+
+def read_vocab_file(path, cache_path=None, cache_dir=None):
+    """Get the terms for the lines of the vocab file at `path`.
+
+    The result equals ``make_terms`` for the stripped lines of the
+    file. See `read_vocab_entries` for caching.
+    """
+    return [SimpleTerm(value=_(value), token=token, title=_(value))
+            for token, value in read_vocab_entries(
+                path, cache_path, cache_dir)]
+
+
+def compile_vocab_file(path, sorted_path=None, force=False, cache_dir=None):
+    """Compile the external vocab file at `path` into a record file.
+
+    The path of the record file is `sorted_path`, which defaults to a
+    `.sorted` file in `cache_dir` (see `vocab_cache_path`), plus
+    the modification time (in milliseconds) and size of `path`. Any
+    change of `path`, including a replacement by a file with older
+    modification time, therefore leads to a new record file. Unless
+    `force` is set, existing record files are reused. Record files of
+    former versions of `path` are removed.
+
+    Returns the path of the record file. Raises `IOError` if the cache
+    dir cannot be trusted.
+    """
+    if sorted_path is None:
+        sorted_path = vocab_cache_path(path, '.sorted', cache_dir)
+    if sorted_path is None:
+        raise IOError("No trusted cache dir for %s" % path)
+    st = os.stat(path)
+    record_path = '%s.%d-%d' % (
+        sorted_path, int(st.st_mtime * 1000), st.st_size)
+    if not force and os.path.isfile(record_path):
+        return record_path
+    with open(path, 'r') as fd:
+        write_records(
+            record_path,
+            ((line, '') for line in (x.strip() for x in fd) if line))
+    dirname, prefix = os.path.split(sorted_path)
+    prefix += '.'
+    for name in os.listdir(dirname or os.curdir):
+        if name == os.path.basename(record_path):
+            continue
+        stamp = name[len(prefix):]
+        if name.startswith(prefix) and stamp.replace('-', '').isdigit():
+            try:
+                os.unlink(os.path.join(dirname, name))
+            except OSError:
+                pass
+    return record_path
+
+
+class MMapVocabulary(object):
+    """A vocabulary served from a record file.
+
+    Terms look like the ones created by `make_terms`, but are created
+    on request only. Lookups are done by binary search in the
+    memory-mapped record file at `path`, so the vocabulary itself
+    needs almost no memory and the file contents are shared between
+    processes.
+    """
+    grok.implements(IVocabularyTokenized)
+
+    def __init__(self, path):
+        self.records = RecordFile(path)
+
+    def _make_term(self, key):
+        value = _(key.decode('utf-8'))
+        return SimpleTerm(value=value, token=tokenize(key), title=value)
+
+    def __contains__(self, value):
+        try:
+            return to_string(value) in self.records
+        except UnicodeError:
+            return False
+
+    def getTerm(self, value):
+        if value not in self:
+            raise LookupError(value)
+        return self._make_term(to_string(value))
+
+    def getTermByToken(self, token):
+        try:
+            key = untokenize(token)
+        except (TypeError, ValueError):
+            raise LookupError(token)
+        if not key or key not in self.records:
+            raise LookupError(token)
+        return self._make_term(key)
+
+    def __iter__(self):
+        for key, value in self.records:
+            yield self._make_term(key)
+
+    def __len__(self):
+        return len(self.records)
+
+
+class CompactTerm(object):
+    """A lightweight term.
+
+    Works like the `SimpleTerm` instances created by `make_terms`, but
+    needs less memory.
+    """
+    grok.implements(ITitledTokenizedTerm)
+
+    __slots__ = ('value', 'token', 'title')
+
+    def __init__(self, value):
+        self.value = self.title = _(value)
+        self.token = tokenize(value.encode('utf-8'))
+
+
+class CompactVocabulary(object):
+    """A vocabulary for lots of unicode `values`.
+
+    Works like a `SimpleVocabulary` made by `make_terms`, but stores
+    only the values and a map of value positions. Terms are created
+    when requested. Tokens are turned into values by decoding instead
+    of looking them up.
+
+    If a value is passed in more than once, only the first one is
+    kept.
+    """
+    grok.implements(IVocabularyTokenized)
+
+    def __init__(self, values):
+        self._values = []
+        self._positions = {}
+        for value in values:
+            if value in self._positions:
+                continue
+            self._positions[value] = len(self._values)
+            self._values.append(value)
+
+    def __contains__(self, value):
+        try:
+            return value in self._positions
+        except TypeError:
+            return False
+
+    def getTerm(self, value):
+        if value not in self:
+            raise LookupError(value)
+        return CompactTerm(self._values[self._positions[value]])
+
+    def getTermByToken(self, token):
+        try:
+            value = untokenize(token).decode('utf-8')
+        except (TypeError, ValueError):
+            raise LookupError(token)
+        return self.getTerm(value)
+
+    def __iter__(self):
+        for value in self._values:
+            yield CompactTerm(value)
+
+    def __len__(self):
+        return len(self._values)
+
+
+class SearchableVocabulary(SimpleVocabulary):
+    """A `SimpleVocabulary` that can be searched for title prefixes.
+
+    A sorted list of normalized term titles is built once when
+    creating the vocabulary. Searches are done by binary search in
+    this list.
+    """
+    grok.implements(IQuerySource)
+
+    def __init__(self, terms, *interfaces):
+        super(SearchableVocabulary, self).__init__(terms, *interfaces)
+        entries = sorted(
+            [(normalize(term.title or term.value), num)
+             for num, term in enumerate(self._terms)])
+        self._index_keys = [entry[0] for entry in entries]
+        self._index_terms = [self._terms[entry[1]] for entry in entries]
+
+    def search(self, query_string, limit=10):
+        """Return an iterable of terms with normalized titles starting
+        with `query_string`.
+
+        "normalized" means what `dinsort` defines as normalizing. At
+        most `limit` terms are delivered (see
+        `RedisAutocompleteSource.search` for the default).
+        """
+        query_string = normalize(query_string)
+        num = bisect.bisect_left(self._index_keys, query_string)
+        end = min(len(self._index_keys), num + limit)
+        while num < end:
+            if not self._index_keys[num].startswith(query_string):
+                break
+            yield self._index_terms[num]
+            num += 1
 
 
 class ExternalVocabBinder(object):
@@ -46,33 +696,188 @@ class ExternalVocabBinder(object):
     If one of these steps fails (the external vocab was not
     registered, the path given in a config does not exist, etc.), we
     return an empty vocabulary.
+
+    If `use_mmap` is set, the vocab file is compiled into a sorted
+    record file in the cache directory (see `compile_vocab_file`) and
+    an `MMapVocabulary` is returned instead. This is meant for large
+    vocabularies. If the record file cannot be written, we fall back
+    to a `CompactVocabulary`.
+
+    If `searchable` is set, we return a `SearchableVocabulary` (unless
+    `use_mmap` is set), which can be used with autocomplete widgets.
+
+    If `compact` is set (or `use_mmap` fails), we return a
+    `CompactVocabulary`, which needs less memory than a
+    `SimpleVocabulary`, but creates terms on each access.
+
+    Once loaded, the vocab file is checked for changes (modification
+    time, size, inode) at most every `check_interval` seconds. Changed
+    files are read in a background thread, while the old vocabulary is
+    still served. The new vocabulary replaces the old one when
+    completely built. Set `vocab` to ``None`` to force a reload with
+    the next call.
     """
     grok.implements(IContextSourceBinder)
 
     name = None
     vocab = None
+    use_mmap = False
+    searchable = False
+    compact = False
+    check_interval = 10
+    stamp = None
+    reloader = None
 
-    def __init__(self, name):
+    def __init__(self, name, use_mmap=False, check_interval=10,
+                 searchable=False, compact=False):
         self.name = name
+        self.use_mmap = use_mmap
+        self.searchable = searchable
+        self.compact = compact
+        self.check_interval = check_interval
+        self._checked = 0
+        self._lock = threading.Lock()
 
-    def __call__(self, context):
-        if self.vocab is not None:
-            return self.vocab
+    def _get_path(self):
+        """Get the path of the vocab file configured for us.
+
+        Returns ``None`` if no config or no file exists.
+        """
         util = queryUtility(IExternalVocabConfig, name=self.name)
         if util is None:
-            return SimpleVocabulary.fromValues([])
+            return None
         path = util.get('path', None)
         if not path or not os.path.isfile(path):
+            return None
+        return path
+
+    def _get_cache_dir(self):
+        """Get the cache directory configured for us.
+
+        Returns ``None`` if none was set.
+        """
+        util = queryUtility(IExternalVocabConfig, name=self.name)
+        if util is None:
+            return None
+        return util.get('cache_dir', None)
+
+    def _get_stamp(self, path):
+        """Get a tuple that changes whenever the file at `path`
+        changes.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_mtime, st.st_size, st.st_ino)
+
+    def _load(self, path, force=False):
+        """Read the vocab file at `path` and set it as our vocabulary.
+
+        If `force` is set, record files are rebuilt in any case.
+        """
+        stamp = self._get_stamp(path)
+        cache_dir = self._get_cache_dir()
+        vocab = None
+        if self.use_mmap:
+            try:
+                vocab = MMapVocabulary(compile_vocab_file(
+                    path, force=force, cache_dir=cache_dir))
+            except (IOError, OSError, ValueError):
+                pass
+        if vocab is None and (self.compact or self.use_mmap):
+            vocab = CompactVocabulary(
+                [value for token, value in read_vocab_entries(
+                    path, cache_dir=cache_dir)])
+        if vocab is None:
+            factory = SimpleVocabulary
+            if self.searchable:
+                factory = SearchableVocabulary
+            vocab = factory(read_vocab_file(path, cache_dir=cache_dir))
+        self.stamp = stamp
+        self.vocab = vocab
+        return vocab
+
+    def _reload(self, path):
+        try:
+            self._load(path, force=True)
+        except Exception:
+            logger.exception("Could not reload vocab file %s", path)
+
+    def _check(self):
+        """Start a background reload if the vocab file changed.
+
+        Checks are done at most every `check_interval` seconds.
+        """
+        now = time.time()
+        with self._lock:
+            if now - self._checked < self.check_interval:
+                return
+            self._checked = now
+            if self.reloader is not None and self.reloader.is_alive():
+                return
+            path = self._get_path()
+            if path is None or self._get_stamp(path) == self.stamp:
+                return
+            self.reloader = threading.Thread(
+                target=self._reload, args=(path, ))
+            self.reloader.daemon = True
+            self.reloader.start()
+
+    def __call__(self, context):
+        vocab = self.vocab
+        if vocab is not None:
+            self._check()
+            return vocab
+        path = self._get_path()
+        if path is None:
             return SimpleVocabulary.fromValues([])
-        self.vocab = SimpleVocabulary(
-            make_terms([line.strip() for line in open(path, 'r')]))
-        return self.vocab
+        self._checked = time.time()
+        return self._load(path)
 
 
 class ExternalRedisBinder(ExternalVocabBinder):
     """A source that looks up an external REDIS store to retrieve
     valid entries.
+
+    If `index_name` is given, the created sources use the ZSET of that
+    name as search index.
+
+    If `cache_size` is greater than zero, all sources created by this
+    binder share a term cache of that size. Cached entries expire
+    after `cache_ttl` seconds (if set) or when the Redis store
+    announces a change of the respective key (see
+    `RedisCacheInvalidator`). Set `cache` to ``None`` to drop the
+    cache.
     """
+    cache = None
+    invalidator = None
+    timeout = None
+
+    def __init__(self, name, index_name=None, cache_size=0, cache_ttl=None):
+        self.name = name
+        self.index_name = index_name
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+
+    def _get_cache(self, util):
+        """Get the term cache for sources connecting as configured in
+        `util`.
+
+        Returns ``None`` if caching is disabled.
+        """
+        if not self.cache_size:
+            return None
+        if self.cache is None:
+            if self.invalidator is not None:
+                self.invalidator.stop()
+            self.cache = LRUCache(self.cache_size, ttl=self.cache_ttl)
+            self.invalidator = RedisCacheInvalidator(
+                self.cache, host=util['host'], port=util['port'],
+                db=util['db'], connection_options=connection_options(util))
+            self.invalidator.start()
+        return self.cache
+
     def __call__(self, context):
         if self.vocab is not None:
             return self.vocab
@@ -80,10 +885,12 @@ class ExternalRedisBinder(ExternalVocabBinder):
         if util is None:
             return SimpleVocabulary.fromValues([])
         return RedisSource(
-            host=util['host'], port=util['port'], db=util['db'])
+            host=util['host'], port=util['port'], db=util['db'],
+            index_name=self.index_name, cache=self._get_cache(util),
+            connection_options=connection_options(util))
 
 
-class ExternalRedisAutocompleteBinder(ExternalVocabBinder):
+class ExternalRedisAutocompleteBinder(ExternalRedisBinder):
     """A source that looks up an external REDIS store to retrieve
     valid entries.
 
@@ -93,10 +900,45 @@ class ExternalRedisAutocompleteBinder(ExternalVocabBinder):
 
     Please note, that we provide sources with `allow_iter` set to
     False. This should work even with huge amounts of data.
+
+    If `hash_prefix` is set, we provide `RedisHashAutocompleteSource`
+    instances, which expect titles stored in `buckets` hashes. By
+    default the number of hashes is read from the store.
+
+    Sources are protected by the circuit breaker of their connection
+    pool. If `timeout` is set, we wait at most `timeout` seconds for
+    connections and answers (unless the config sets other socket
+    timeouts). If the config contains a `snapshot_path`, sources fall
+    back to this snapshot when the Redis store is not available.
+
+    If `ranked` is set, sources deliver most used terms first. If
+    `fuzzy` is set, sources also find terms with typos or different
+    word order (requires an n-gram index).
     """
-    def __init__(self, name, zset_name="autcomplete"):
+    snapshot = None
+
+    def __init__(self, name, zset_name="autcomplete", cache_size=0,
+                 cache_ttl=None, hash_prefix=None, buckets=None,
+                 timeout=None, ranked=False, fuzzy=False):
         self.name = name
         self.zset_name = zset_name
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.hash_prefix = hash_prefix
+        self.buckets = buckets
+        self.timeout = timeout
+        self.ranked = ranked
+        self.fuzzy = fuzzy
+
+    def _get_snapshot(self, util):
+        """Get the snapshot configured in `util` or ``None``.
+        """
+        path = util.get('snapshot_path')
+        if path is None:
+            return None
+        if self.snapshot is None or self.snapshot.path != path:
+            self.snapshot = RedisSnapshot(path)
+        return self.snapshot
 
     def __call__(self, context):
         if self.vocab is not None:
@@ -104,35 +946,71 @@ class ExternalRedisAutocompleteBinder(ExternalVocabBinder):
         util = queryUtility(IRedisStoreConfig, name=self.name)
         if util is None:
             return SimpleVocabulary.fromValues([])
-        return RedisAutocompleteSource(
+        options = connection_options(util, self.timeout)
+        kw = dict(
             host=util['host'], port=util['port'], db=util['db'],
-            zset_name=self.zset_name, allow_iter=False)
+            zset_name=self.zset_name, allow_iter=False,
+            cache=self._get_cache(util), connection_options=options,
+            breaker=connection_pools.breaker(
+                util['host'], util['port'], util['db'], **options),
+            snapshot=self._get_snapshot(util), ranked=self.ranked,
+            fuzzy=self.fuzzy)
+        if self.hash_prefix is not None:
+            return RedisHashAutocompleteSource(
+                hash_prefix=self.hash_prefix, buckets=self.buckets, **kw)
+        return RedisAutocompleteSource(**kw)
 
 
 class RedisSource(object):
     """A zope.schema ISource containing values from a Redis Store.
 
     This source contains keys of a Redis Store db.
+
+    `page_size` gives the number of entries fetched at once when
+    iterating over the source.
+
+    `index_name` is the name of a ZSET used as search index. If set,
+    `search` looks up matching terms in this index instead of scanning
+    all keys. The index contains entries of the form
+    ``<TITLE>&&<KEY>`` and can be (re-)built with `rebuild_index`.
+
+    `cache` is an optional `LRUCache` holding values (or ``None`` for
+    keys not found) of single key lookups.
+
+    `connection_options` is a dict of optional connection parameters
+    (see `RedisConnectionPools`).
     """
     grok.implements(IQuerySource)
 
     _client = None
+    index_name = None
+    cache = None
+    connection_options = None
+
+    #: Separator between titles and keys in search index entries.
+    index_separator = "&&"
 
-    def __init__(self, host='localhost', port=6379, db=0):
+    def __init__(self, host='localhost', port=6379, db=0, page_size=500,
+                 index_name=None, cache=None, connection_options=None):
         self.host = host
         self.port = port
         self.db = db
+        self.page_size = page_size
+        self.index_name = index_name
+        self.cache = cache
+        self.connection_options = connection_options
 
     def _get_client(self):
         if self._client is None:
-            # create a client as late as possible but keep it then
-            self._client = redis.StrictRedis(
-                host=self.host, port=self.port, db=self.db)
+            # create a client as late as possible but keep it then.
+            # Connections are taken from the shared pools.
+            self._client = connection_pools.get_client(
+                host=self.host, port=self.port, db=self.db,
+                **(self.connection_options or {}))
         return self._client
 
     def __contains__(self, value):
-        result = self._get_client().get(value)
-        return result is not None
+        return self._get_value(value) is not None
 
     def getTerm(self, value):
         """Return the ITerm object for term `value`.
@@ -146,27 +1024,105 @@ class RedisSource(object):
         The `title` of any resulting term will be set to the
         corresponding `value`.
         """
-        db_val = self._get_client().get(value)
+        db_val = self._get_value(value)
         if db_val is None:
             raise LookupError('No such term: %s' % value)
+        return self._make_term(value, db_val)
+
+    def _make_term(self, key, db_val):
+        """Create an ITerm from a redis `key` and its stored `db_val`.
+        """
         return SimpleTerm(
-            value, token=tokenize(value), title=db_val.decode('utf-8'))
+            key, token=tokenize(key), title=db_val.decode('utf-8'))
+
+    def _fetch_value(self, key):
+        """Fetch the value stored for `key` from the Redis store.
+
+        Returns a tuple ``(value, from_store)``. `from_store` is
+        ``False`` if `value` was not read from the store (see
+        `RedisAutocompleteSource`). Such values are not cached.
+        """
+        return self._get_client().get(key), True
+
+    def _fetch_values(self, keys):
+        """Fetch the values stored for `keys` from the Redis store.
+
+        Returns a tuple ``(values, from_store)`` like `_fetch_value`.
+        """
+        return self._get_client().mget(keys), True
+
+    def _get_value(self, key):
+        """Get the value stored for `key` or ``None``.
+
+        Use the cache, if one is set.
+        """
+        if self.cache is None:
+            return self._fetch_value(key)[0]
+        cache_key = to_string(key)
+        value = self.cache.get(cache_key, _MARKER)
+        if value is _MARKER:
+            generation = self.cache.generation
+            value, from_store = self._fetch_value(key)
+            if from_store:
+                self.cache.set(cache_key, value, generation)
+        return value
+
+    def _get_values(self, keys, use_cache=True):
+        """Get the stored values for all `keys` in one round trip.
+
+        Returns a list of values in the same order as `keys`. Values
+        of keys that do not exist are ``None``.
+
+        If a cache is set and `use_cache` is ``True``, only values not
+        cached are fetched and cached afterwards.
+        """
+        if not keys:
+            return []
+        if self.cache is None or not use_cache:
+            return self._fetch_values(keys)[0]
+        cache_keys = [to_string(key) for key in keys]
+        values = [self.cache.get(key, _MARKER) for key in cache_keys]
+        missing = [num for num, value in enumerate(values)
+                   if value is _MARKER]
+        if missing:
+            generation = self.cache.generation
+            fetched, from_store = self._fetch_values(
+                [keys[num] for num in missing])
+            for num, value in zip(missing, fetched):
+                values[num] = value
+                if from_store:
+                    self.cache.set(cache_keys[num], value, generation)
+        return values
 
     def __iter__(self):
         """Required by IIterableVocabulary.
 
         Return an iterator over all elements in source.
+
+        Keys are scanned in pages of (roughly) `page_size` entries and
+        the values of each page are fetched in one go. Keys that
+        vanished or do not hold string values are skipped.
         """
         client = self._get_client()
-        for key in client.scan_iter():
-            value = self._get_client().get(key)
-            yield SimpleTerm(
-                key, token=tokenize(key), title=value.decode('utf-8'))
+        cursor = '0'
+        while cursor != 0:
+            cursor, keys = client.scan(cursor=cursor, count=self.page_size)
+            values = self._get_values(keys, use_cache=False)
+            for key, value in zip(keys, values):
+                if value is None:
+                    continue
+                yield self._make_term(key, value)
 
     def __len__(self):
         """Required by IIterableVocabulary.
+
+        The search index (if any) is not counted.
         """
-        return self._get_client().dbsize()
+        client = self._get_client()
+        size = client.dbsize()
+        if self.index_name is not None and client.exists(self.index_name):
+            size -= 1
+        return size
 
     def getTermByToken(self, token):
         key = untokenize(token)
@@ -176,19 +1132,76 @@ class RedisSource(object):
         """Return an iterable of ITerms matching `query_string`.
 
         A term matches, if its title starts with `query_string`.
+
+        If an `index_name` is set, matching entries are looked up in
+        the search index. Otherwise all terms are scanned.
         """
-        for term in self:
-            if term.title.startswith(query_string):
-                yield term
+        if self.index_name is None:
+            for term in self:
+                if term.title.startswith(query_string):
+                    yield term
+            return
+        prefix = to_string(query_string)
+        # no utf-8 encoded string contains \xff, so "[<PREFIX>\xff" is
+        # greater than any entry starting with <PREFIX>.
+        db_entries = self._get_client().zrangebylex(
+            self.index_name, "[%s" % prefix, "[%s\xff" % prefix)
+        keys = [entry.rsplit(self.index_separator, 1)[1]
+                for entry in db_entries]
+        for key, value in zip(keys, self._get_values(keys)):
+            if value is None:
+                continue
+            yield self._make_term(key, value)
+
+    def _index_entry(self, key, db_val):
+        """Get the search index entry for `key` with value `db_val`.
+        """
+        return "%s%s%s" % (db_val, self.index_separator, key)
+
+    def rebuild_index(self):
+        """(Re-)build the search index from the existing keys.
+
+        The new index is built under a temporary name and renamed to
+        `index_name` afterwards. Searches therefore use the old index
+        until the new one is complete.
+
+        Returns the number of entries indexed.
+        """
+        if self.index_name is None:
+            raise ValueError('No index_name set.')
+        client = self._get_client()
+        tmp_name = "%s-rebuild" % self.index_name
+        client.delete(tmp_name)
+        num = 0
+        cursor = '0'
+        while cursor != 0:
+            cursor, keys = client.scan(cursor=cursor, count=self.page_size)
+            args = []
+            values = self._get_values(keys, use_cache=False)
+            for key, value in zip(keys, values):
+                if value is None or key in (self.index_name, tmp_name):
+                    continue
+                args.extend([0, self._index_entry(key, value)])
+            if args:
+                client.zadd(tmp_name, *args)
+                num += len(args) // 2
+        if num:
+            client.rename(tmp_name, self.index_name)
+        else:
+            client.delete(self.index_name)
+        return num
 
 
 class RedisKeysSource(RedisSource):
     """A redis source that only looks for keys in Redis stores.
+
+    Terms of this source use keys as titles.
     """
-    def getTerm(self, value):
-        result = super(RedisKeysSource, self).getTerm(value)
-        return SimpleTerm(
-            result.value, token=result.token, title=result.value)
+    def _make_term(self, key, db_val):
+        return SimpleTerm(key, token=tokenize(key), title=key)
+
+    def _index_entry(self, key, db_val):
+        return "%s%s%s" % (key, self.index_separator, key)
 
 
 class RedisAutocompleteSource(RedisSource):
@@ -205,15 +1218,100 @@ class RedisAutocompleteSource(RedisSource):
     Plone widgets use it to render unchosen values. For huge datasets
     (say 100k+ items at least) we recommend to disable iteration. You
     should set `allow_iter` to `False` then.
+
+    `page_size` gives the number of ZSET entries fetched at once when
+    iterating.
+
+    `cache` is an optional `LRUCache` for looked up terms.
+
+    `connection_options` are passed to the connection pool as with
+    `RedisSource`.
+
+    If a `CircuitBreaker` is passed in as `breaker`, we stop asking the
+    Redis store after repeated connection errors or timeouts. Lookups
+    and searches are answered from `snapshot`, a `RedisSnapshot`, then
+    (or find nothing, if no snapshot is given). Set a `socket_timeout`
+    in `connection_options` to limit the time spent waiting for
+    answers.
+
+    If `ranked` is set, `search` delivers the most used matches first
+    (see `record_usage`). If `fuzzy` is set, `search` also delivers
+    terms similar to the query (see `search_ngrams`).
     """
+    breaker = None
+    snapshot = None
+    ranked = False
+    fuzzy = False
+
     def __init__(self, host='localhost', port=6379, db=0,
-                 zset_name="autocomplete", separator="&&", allow_iter=True):
+                 zset_name="autocomplete", separator="&&", allow_iter=True,
+                 page_size=500, cache=None, connection_options=None,
+                 breaker=None, snapshot=None, ranked=False, fuzzy=False):
         self.host = host
         self.port = port
         self.db = db
+        self.page_size = page_size
+        self.cache = cache
+        self.connection_options = connection_options
         self.zset_name = zset_name
         self.separator = to_string(separator)
         self.allow_iter = allow_iter
+        self.breaker = breaker
+        self.snapshot = snapshot
+        self.ranked = ranked
+        self.fuzzy = fuzzy
+
+    def _guarded(self, func, fallback, *args):
+        """Get `func(*args)` or `fallback(*args)` if the Redis store
+        is not available.
+
+        Returns a tuple ``(result, from_store)``. `from_store` tells
+        whether `func` delivered the result.
+        """
+        breaker = self.breaker
+        if breaker is None:
+            return func(*args), True
+        if not breaker.allow():
+            return fallback(*args), False
+        try:
+            result = func(*args)
+        except REDIS_UNAVAILABLE:
+            breaker.failure()
+            return fallback(*args), False
+        breaker.success()
+        return result, True
+
+    def _read_value(self, key):
+        """Read the title stored for `key` from the Redis store.
+        """
+        return self._get_client().get(key)
+
+    def _read_values(self, keys):
+        """Read the titles stored for `keys` from the Redis store.
+        """
+        return self._get_client().mget(keys)
+
+    def _fetch_value(self, key):
+        return self._guarded(self._read_value, self._snapshot_title, key)
+
+    def _fetch_values(self, keys):
+        return self._guarded(
+            self._read_values, self._snapshot_titles, keys)
+
+    def _snapshot_title(self, key):
+        if self.snapshot is None:
+            return None
+        return self.snapshot.title(key)
+
+    def _snapshot_titles(self, keys):
+        if self.snapshot is None:
+            return [None] * len(keys)
+        return self.snapshot.titles(keys)
+
+    def _snapshot_entries(self, start, limit):
+        if self.snapshot is None:
+            return []
+        return self.snapshot.entries(start, limit)
 
     def _split_entry(self, entry):
         """Split an entry as found in ZSETs into pieces.
@@ -229,14 +1327,18 @@ class RedisAutocompleteSource(RedisSource):
         """
         if self.allow_iter:
             client = self._get_client()
-            for entry, score in client.zscan_iter(self.zset_name):
+            for entry, score in client.zscan_iter(
+                    self.zset_name, count=self.page_size):
                 token, title = self._split_entry(entry)
                 yield SimpleTerm(token, token, title)
 
     def __len__(self):
         """Required by IIterableVocabulary.
+
+        If the Redis store is not available, we report zero entries.
         """
-        return self._get_client().zcard(self.zset_name)
+        return self._guarded(
+            lambda: self._get_client().zcard(self.zset_name), lambda: 0)[0]
 
     def getTerm(self, key):
         """Return the ITerm object for term `key`.
@@ -252,10 +1354,15 @@ class RedisAutocompleteSource(RedisSource):
            "<VALUE> (<KEY>)"
 
         """
-        value = self._get_client().get(key)
+        value = self._get_value(key)
         if value is None:
             raise LookupError('No such term: %s' % key)
-        title = "%s (%s)" % (value.decode("utf-8"), key)
+        return self._make_term(key, value)
+
+    def _make_term(self, key, db_val):
+        """Create an ITerm from a redis `key` and its stored `db_val`.
+        """
+        title = "%s (%s)" % (db_val.decode("utf-8"), key)
         return SimpleTerm(key, key, title)
 
     def getTermByToken(self, token):
@@ -281,25 +1388,478 @@ class RedisAutocompleteSource(RedisSource):
         unpickable at all. Giving 10 entries, we can be sure that the
         (in *our* ordering) first picked term is displayed by the
         autocomplete widget.
+
+        The titles of all found entries are fetched with a single
+        ``MGET``, so a search costs two round trips to the Redis store
+        regardless of the number of results. Entries in the ZSET that
+        have no value stored are skipped.
+
+        If `ranked` is set, the most used matching terms are delivered
+        first. Remaining places are filled with the first matches in
+        lexical order. Rankings are read in the same round trip as the
+        lexical matches.
+
+        If `fuzzy` is set, only entries starting with the query are
+        taken from the lexical order and remaining places are filled
+        with results of `search_ngrams`. If less than 10 entries start
+        with the query, this costs up to three more round trips: two for
+        `search_ngrams` and one to fetch the titles of found terms.
         """
         query_string = normalize(query_string)
-        search_term = "(%s" % to_string(query_string)
-        db_entries = self._get_client().zrangebylex(
-            self.zset_name, search_term, "+", 0, 10)
-        for entry in db_entries:
-            normalized, token = self._split_entry(entry)
-            term = self.getTerm(token)
-            yield term
+        (ranked_keys, db_entries), from_store = self._guarded(
+            self._read_search_entries, self._snapshot_search_entries,
+            query_string, 10)
+        entries = [self._split_entry(entry) for entry in db_entries]
+        if self.fuzzy:
+            entries = [
+                (normalized, token) for normalized, token in entries
+                if normalized.startswith(to_string(query_string))]
+        tokens = [token for normalized, token in entries]
+        values = self._get_values(ranked_keys + tokens)
+        found = [
+            (key, value) for key, value in zip(ranked_keys, values)
+            if value is not None and normalize(
+                value.decode('utf-8')).startswith(query_string)][:10]
+        self._extend_found(found, tokens, values[len(ranked_keys):])
+        if self.fuzzy and len(found) < 10:
+            self._extend_found(found, self.search_ngrams(query_string, 10))
+        for token, value in found[:10]:
+            if value is None:
+                continue
+            yield self._make_term(token, value)
+
+    def _extend_found(self, found, tokens, values=None):
+        """Add `(token, value)` tuples for `tokens` not contained in
+        `found` yet to `found`.
+
+        `values` are the values of `tokens`, if they were fetched
+        already.
+        """
+        if values is None:
+            values = self._get_values(tokens)
+        seen = set([token for token, value in found])
+        found.extend([(token, value) for token, value in zip(tokens, values)
+                      if token not in seen])
+
+    def search_ngrams(self, query_string, limit=10):
+        """Get keys of up to `limit` terms similar to `query_string`.
+
+        Requires an n-gram index as built by
+        `psj.content.loader.build_ngram_index`. Terms containing all
+        n-grams of the query (in any word order) are delivered first.
+        If these are less than `limit`, we add the terms sharing most
+        n-grams with the query, so that terms with typos are found as
+        well.
+
+        Posting sets are intersected and merged in the Redis store,
+        which costs two round trips. Sets with more than
+        `NGRAM_MAX_SET_SIZE` entries belong to frequent n-grams and
+        are left out. Merges use only the `NGRAM_UNION_SIZE` smallest
+        remaining sets. The costs of a search are therefore bounded.
+        Queries consisting of frequent n-grams only find nothing.
+
+        Nothing is found while the Redis store is not available.
+        """
+        grams = ngrams(normalize(query_string))
+        if not grams:
+            return []
+        keys, from_store = self._guarded(
+            self._read_ngram_keys, lambda *args: [], sorted(grams), limit)
+        return [key.decode('utf-8') for key in keys]
+
+    def _read_ngram_keys(self, grams, limit):
+        """Get up to `limit` keys of terms sharing n-grams with `grams`
+        from the Redis store.
+        """
+        client = self._get_client()
+        names = [ngram_index_name(self.zset_name, gram) for gram in grams]
+        pipe = client.pipeline(transaction=False)
+        for name in names:
+            pipe.scard(name)
+        sizes = pipe.execute()
+        # if a posting set is empty, no term contains all n-grams
+        intersect = 0 not in sizes
+        names = [name for size, name in sorted(zip(sizes, names))
+                 if 0 < size <= NGRAM_MAX_SET_SIZE]
+        if not names:
+            return []
+        # intersection and merge are done in one transaction
+        tmp_name = "%s-ngram-tmp" % self.zset_name
+        pipe = client.pipeline()
+        if intersect:
+            pipe.zinterstore(tmp_name, names)
+            pipe.zrange(tmp_name, 0, limit - 1)
+        names = names[:NGRAM_UNION_SIZE]
+        pipe.zunionstore(tmp_name, names)
+        pipe.zrevrangebyscore(
+            tmp_name, '+inf', max(1, len(names) // 2),
+            start=0, num=2 * limit)
+        pipe.delete(tmp_name)
+        results = pipe.execute()
+        keys = intersect and results[1] or []
+        keys.extend([key for key in results[-2] if key not in keys])
+        return keys[:limit]
+
+    def _ranking_name(self, prefix):
+        """Get the name of the ZSET ranking terms starting with
+        `prefix`.
+        """
+        return "%s-top:%s" % (self.zset_name, to_string(prefix))
+
+    def _read_search_entries(self, query_string, limit):
+        """Read the keys of most used terms and up to `limit` ZSET
+        entries greater than `query_string` in one round trip.
+
+        Returns a tuple ``(ranked_keys, entries)``. `ranked_keys` is
+        empty if `ranked` is not set. If `query_string` is longer than
+        `RANKING_PREFIX_LENGTH`, ranked keys still have to be filtered
+        by their titles.
+        """
+        pipe = self._get_client().pipeline(transaction=False)
+        ranked = self.ranked and bool(query_string)
+        if ranked:
+            size = limit
+            if len(query_string) > RANKING_PREFIX_LENGTH:
+                size = RANKING_SIZE
+            pipe.zrevrange(self._ranking_name(
+                query_string[:RANKING_PREFIX_LENGTH]), 0, size - 1)
+        pipe.zrangebylex(
+            self.zset_name, "(%s" % to_string(query_string), "+", 0, limit)
+        results = pipe.execute()
+        ranked_keys = []
+        if ranked:
+            ranked_keys = [key.decode('utf-8') for key in results[0]]
+        return ranked_keys, results[-1]
+
+    def _snapshot_search_entries(self, query_string, limit):
+        # snapshots contain no rankings
+        return [], self._snapshot_entries(to_string(query_string), limit)
+
+    def record_usage(self, keys):
+        """Count a selection of the terms with `keys`.
+
+        The number of selections of each term is stored in the ZSET
+        ``<ZSET_NAME>-usage``. For each prefix of normalized titles (up
+        to `RANKING_PREFIX_LENGTH` chars) we keep the `RANKING_SIZE`
+        most used terms in a ZSET ``<ZSET_NAME>-top:<PREFIX>``.
+
+        Unknown keys are ignored. This costs three round trips to the
+        store, regardless of the number of keys. Like lookups, usage
+        records are protected by our `breaker`: while the store is not
+        available, we give up immediately. Errors of unavailable stores
+        are logged, but not raised.
+        """
+        keys = list(keys)
+        if not keys:
+            return
+        try:
+            self._guarded(self._write_usage, self._skip_usage, keys)
+        except REDIS_UNAVAILABLE:
+            logger.exception("Could not record usage of %s", keys)
+
+    def _write_usage(self, keys):
+        """Count a selection of the terms with `keys` in the store.
+        """
+        titles = [(key, title) for key, title in zip(
+            keys, self._read_values(keys)) if title is not None]
+        if not titles:
+            return
+        pipe = self._get_client().pipeline(transaction=False)
+        for key, title in titles:
+            pipe.zincrby("%s-usage" % self.zset_name, key, 1)
+        counts = pipe.execute()
+        for (key, title), count in zip(titles, counts):
+            title = normalize(title.decode('utf-8'))
+            for num in range(min(len(title), RANKING_PREFIX_LENGTH)):
+                name = self._ranking_name(title[:num + 1])
+                pipe.zadd(name, count, key)
+                pipe.zremrangebyrank(name, 0, -(RANKING_SIZE + 1))
+        pipe.execute()
+
+    def _skip_usage(self, keys):
+        logger.warning(
+            "Redis store not available. Usage of %s not recorded", keys)
+
+
+class RedisSnapshot(object):
+    """A read-only copy of a Redis autocomplete store.
+
+    Snapshots are record files as written by ``psj-fill-redis
+    --snapshot``. They contain the autocomplete ZSET entries (prefixed
+    by `SNAPSHOT_ZSET_PREFIX`) and the titles of all keys (prefixed by
+    `SNAPSHOT_TITLE_PREFIX`).
+
+    The file at `path` is opened on first access and reopened when it
+    changes. If it does not exist, the snapshot is empty.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._records = None
+        self._stamp = None
+        self._lock = threading.Lock()
+
+    def _get_records(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        stamp = (st.st_mtime, st.st_size, st.st_ino)
+        with self._lock:
+            if stamp != self._stamp:
+                try:
+                    self._records = RecordFile(self.path)
+                except (IOError, ValueError):
+                    self._records = None
+                self._stamp = stamp
+            return self._records
+
+    def title(self, key):
+        """Get the title stored for `key` or ``None``.
+        """
+        records = self._get_records()
+        if records is None:
+            return None
+        return records.get(SNAPSHOT_TITLE_PREFIX + to_string(key))
+
+    def titles(self, keys):
+        """Get the titles stored for `keys`.
+        """
+        return [self.title(key) for key in keys]
+
+    def entries(self, start, limit=10):
+        """Get up to `limit` ZSET entries not lower than `start`.
+        """
+        records = self._get_records()
+        if records is None:
+            return []
+        prefix = SNAPSHOT_ZSET_PREFIX
+        return [key[len(prefix):] for key, value in records.from_key(
+            prefix + to_string(start), limit) if key.startswith(prefix)]
+
+
+class GNDTermsGetter(grok.GlobalUtility):
+    """A utility mapping GND ids to GND terms.
+
+    Terms are looked up in the Redis store configured under the name
+    ``psj.content.redis-GND``. All ids not yet cached are fetched with
+    a single ``MGET``. Found terms are kept in an LRU cache holding up
+    to `cache_size` entries.
+
+    We wait at most `timeout` seconds for the Redis store (unless the
+    config sets other socket timeouts). If the store is not
+    available, terms are looked up in the snapshot configured as
+    `snapshot_path`, if any (see `RedisSnapshot`).
+
+    An instance of this class is available as an unnamed global
+    utility at runtime.
+    """
+    grok.implements(IPSJGNDTermsGetter)
+
+    conf_name = u'psj.content.redis-GND'
+    timeout = 1.0
+    snapshot = None
+
+    def __init__(self, cache_size=10000):
+        self.cache = LRUCache(cache_size)
+        self._conf_key = None
+
+    def terms_from_ids(self, ids):
+        """Get the GND terms for `ids`.
+
+        Returns a list of terms in the same order as `ids`. Ids that
+        cannot be found in the store are returned unchanged. If no
+        Redis store is configured, we return an empty list.
+        """
+        conf = queryUtility(IRedisStoreConfig, name=self.conf_name)
+        if conf is None:
+            return []
+        options = connection_options(conf, self.timeout)
+        conf_key = (conf['host'], conf['port'], conf['db'],
+                    tuple(sorted(options.items())))
+        if conf_key != self._conf_key:
+            # the store changed. Cached entries might be wrong.
+            self.cache.clear()
+            self._conf_key = conf_key
+        snapshot_path = conf.get('snapshot_path')
+        if snapshot_path is None:
+            self.snapshot = None
+        elif self.snapshot is None or self.snapshot.path != snapshot_path:
+            self.snapshot = RedisSnapshot(snapshot_path)
+        ids = list(ids)
+        terms = {}
+        missing = []
+        for gnd_id in ids:
+            if gnd_id in terms or gnd_id in missing:
+                continue
+            term = self.cache.get(gnd_id)
+            if term is None:
+                missing.append(gnd_id)
+            else:
+                terms[gnd_id] = term
+        if missing:
+            values = self._fetch(conf, options, missing)
+            if values is None:
+                # store not available. Do not cache snapshot entries.
+                values = [None] * len(missing)
+                if self.snapshot is not None:
+                    values = self.snapshot.titles(missing)
+                for gnd_id, value in zip(missing, values):
+                    if value is not None:
+                        terms[gnd_id] = value.decode('utf-8')
+            else:
+                for gnd_id, value in zip(missing, values):
+                    if value is None:
+                        continue
+                    terms[gnd_id] = self.cache[gnd_id] = value.decode(
+                        'utf-8')
+        return [terms.get(gnd_id, gnd_id) for gnd_id in ids]
+
+    def _fetch(self, conf, options, ids):
+        """Get the values stored for `ids` in the Redis store
+        configured in `conf`.
+
+        Returns ``None`` if the store is not available.
+        """
+        breaker = connection_pools.breaker(
+            conf['host'], conf['port'], conf['db'], **options)
+        if not breaker.allow():
+            return None
+        client = connection_pools.get_client(
+            conf['host'], conf['port'], conf['db'], **options)
+        try:
+            values = client.mget(ids)
+        except REDIS_UNAVAILABLE:
+            breaker.failure()
+            return None
+        breaker.success()
+        return values
+
+
+def ngrams(text, size=NGRAM_SIZE):
+    """Get the set of n-grams of length `size` of all words in `text`.
+
+    `text` is expected to be a normalized unicode string. Words are
+    padded with a blank at both ends, so that word starts and ends
+    form n-grams of their own.
+    """
+    result = set()
+    for word in text.split():
+        word = u" %s " % word
+        for num in range(max(len(word) - size, 0) + 1):
+            result.add(word[num:num + size])
+    return result
+
+
+def ngram_index_name(zset_name, ngram):
+    """Get the name of the Redis SET containing the keys of all terms
+    in `zset_name` with `ngram` in their normalized title.
+    """
+    return "%s-ngram:%s" % (zset_name, to_string(ngram))
+
+
+def hash_bucket(key, hash_prefix, buckets=DEFAULT_BUCKETS):
+    """Get the name of the Redis hash storing the value of `key`.
+
+    Keys are distributed over `buckets` hashes named
+    ``<HASH_PREFIX>:<NUM>`` by their CRC32 checksum.
+    """
+    return "%s:%d" % (
+        hash_prefix, (zlib.crc32(to_string(key)) & 0xffffffff) % buckets)
+
+
+def buckets_name(hash_prefix):
+    """Get the name of the Redis key storing the number of hashes
+    named ``<HASH_PREFIX>:<NUM>``.
+    """
+    return "%s-buckets" % hash_prefix
+
+
+def bucket_count(num_entries, fill=BUCKET_FILL):
+    """Get the number of hashes needed to store `num_entries` titles
+    with about `fill` titles per hash.
+    """
+    return max(1, (num_entries + fill - 1) // fill)
+
+
+class RedisHashAutocompleteSource(RedisAutocompleteSource):
+    """A redis autocomplete source storing titles in hashes.
+
+    Different to `RedisAutocompleteSource` titles are not stored as
+    top-level keys but in `buckets` small Redis hashes (see
+    `hash_bucket`). Redis stores small hashes in a compact encoding,
+    which takes a fraction of the memory needed for separate keys.
+    The limit for compact hashes is set by the Redis server option
+    ``hash-max-ziplist-entries`` (``hash-max-listpack-entries`` in
+    newer servers), which should be greater than the number of terms
+    divided by `buckets`. Also ``hash-max-ziplist-value`` (64 bytes by
+    default) must not be exceeded by any title. Otherwise the whole
+    hash containing the title is stored in the regular encoding.
+
+    `hash_prefix` is the common prefix of all hash names. It defaults
+    to ``<ZSET_NAME>-titles``. If `buckets` is ``None``, the number of
+    hashes is read from the key ``<HASH_PREFIX>-buckets`` (see
+    `buckets_name`) on first use. Stores without this key have
+    `DEFAULT_BUCKETS` hashes.
+
+    The `psj-fill-redis` script can load terms in this layout and
+    migrate existing stores.
+    """
+    def __init__(self, host='localhost', port=6379, db=0,
+                 zset_name="autocomplete", separator="&&", allow_iter=True,
+                 page_size=500, cache=None, hash_prefix=None,
+                 buckets=None, connection_options=None,
+                 breaker=None, snapshot=None, ranked=False, fuzzy=False):
+        super(RedisHashAutocompleteSource, self).__init__(
+            host=host, port=port, db=db, zset_name=zset_name,
+            separator=separator, allow_iter=allow_iter, page_size=page_size,
+            cache=cache, connection_options=connection_options,
+            breaker=breaker, snapshot=snapshot, ranked=ranked, fuzzy=fuzzy)
+        if hash_prefix is None:
+            hash_prefix = "%s-titles" % zset_name
+        self.hash_prefix = hash_prefix
+        self.buckets = buckets
+
+    def _get_buckets(self):
+        """Get the number of hashes.
+
+        If not set, the number is read from the store. It is cached
+        like titles, if a cache is set.
+        """
+        if self.buckets is None:
+            name = buckets_name(self.hash_prefix)
+            buckets = _MARKER
+            if self.cache is not None:
+                buckets = self.cache.get(name, _MARKER)
+                generation = self.cache.generation
+            if buckets is _MARKER:
+                buckets = self._get_client().get(name)
+                if self.cache is not None:
+                    self.cache.set(name, buckets, generation)
+            self.buckets = int(buckets or DEFAULT_BUCKETS)
+        return self.buckets
+
+    def _read_value(self, key):
+        return self._get_client().hget(
+            hash_bucket(key, self.hash_prefix, self._get_buckets()), key)
+
+    def _read_values(self, keys):
+        buckets = self._get_buckets()
+        pipe = self._get_client().pipeline(transaction=False)
+        for key in keys:
+            pipe.hget(hash_bucket(key, self.hash_prefix, buckets), key)
+        return pipe.execute()
 
 
 language_source = ExternalVocabBinder(u'psj.content.Languages')
 institutes_source = ExternalVocabBinder(u'psj.content.Institutes')
 licenses_source = ExternalVocabBinder(u'psj.content.Licenses')
-publishers_source = ExternalVocabBinder(u'psj.content.Publishers')
+publishers_source = ExternalVocabBinder(
+    u'psj.content.Publishers', searchable=True)
 subjectgroup_source = ExternalVocabBinder(u'psj.content.Subjectgroup')
-ddcgeo_source = ExternalVocabBinder(u'psj.content.DDCGeo')
-ddcsach_source = ExternalVocabBinder(u'psj.content.DDCSach')
-ddczeit_source = ExternalVocabBinder(u'psj.content.DDCZeit')
-gndid_source = ExternalVocabBinder(u'psj.content.GND_ID')
+ddcgeo_source = ExternalVocabBinder(u'psj.content.DDCGeo', searchable=True)
+ddcsach_source = ExternalVocabBinder(u'psj.content.DDCSach', searchable=True)
+ddczeit_source = ExternalVocabBinder(u'psj.content.DDCZeit', searchable=True)
+gndid_source = ExternalVocabBinder(u'psj.content.GND_ID', use_mmap=True)
 gndterms_source = ExternalRedisAutocompleteBinder(
-    u'psj.content.redis_conf', zset_name="gnd-autocomplete")
+    u'psj.content.redis_conf', zset_name="gnd-autocomplete",
+    cache_size=10000, cache_ttl=3600, timeout=1.0, ranked=True)
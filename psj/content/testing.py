@@ -30,6 +30,7 @@ from plone.app.testing import (
     )
 from plone.testing import Layer
 from zope.component import getGlobalSiteManager
+from psj.content import sources
 from psj.content.interfaces import IExternalVocabConfig
 
 
@@ -37,8 +38,11 @@ class ExternalVocabSetup(object):
 
     def setUp(self):
         self.workdir = tempfile.mkdtemp()
+        self.old_cache_dir = sources.VOCAB_CACHE_DIR
+        sources.VOCAB_CACHE_DIR = os.path.join(self.workdir, 'cache')
 
     def tearDown(self):
+        sources.VOCAB_CACHE_DIR = self.old_cache_dir
         shutil.rmtree(self.workdir)
 
     def create_external_vocab(self, name, valid_path=True):
@@ -5,6 +5,7 @@
 #      difficulties installing FSD in tests.
 #
 import redis
+import transaction
 import unittest
 from plone.behavior.interfaces import IBehavior, IBehaviorAssignable
 from plone.dexterity.interfaces import IDexterityContent
@@ -12,14 +13,16 @@ from plone.directives.form import IFormFieldProvider
 from zope.component import (
     queryUtility, adapts, provideAdapter, getGlobalSiteManager
     )
-from zope.interface import implements
+from zope.annotation.interfaces import IAnnotations, IAttributeAnnotatable
+from zope.interface import alsoProvides, implements
 from zope.schema.interfaces import (
     WrongType, ConstraintNotSatisfied, WrongContainedType,
     )
 from psj.content.behaviors import (
     IPSJAuthor, IPSJTitle, IPSJSubtitle, IPSJAbstract, IPSJContributors,
     IPSJAddRetro, IPSJPartOf, IPSJEdition, IPSJSubjectIndexing,
-    IPSJRelatedContent, IPSJGNDTerms,
+    IPSJRelatedContent, IPSJGNDTerms, record_gndterms_usage,
+    GNDTERMS_COUNTED_KEY,
     )
 from psj.content.interfaces import IRedisStoreConfig
 from psj.content.testing import (
@@ -317,3 +320,34 @@ class MetadataBehaviorsTests(ExternalVocabSetup, unittest.TestCase):
     def test_gndterms_usable(self):
         self.setup_redis_autocomplete()
         self.enum_choicelist_behavior_usable(b'psj_gndterms', IPSJGNDTerms)
+
+    def test_gndterms_usage_recorded(self):
+        # selected GND terms are counted after successful commits
+        redis_cli = self.setup_redis_autocomplete()
+        doc = self.create_behavioral_doc()
+        alsoProvides(doc, IAttributeAnnotatable)
+        IPSJGNDTerms(doc).psj_gndterms = [u'1', u'2']
+        txn = transaction.get()
+        record_gndterms_usage(doc)
+        self.assertEqual(
+            IAnnotations(doc)[GNDTERMS_COUNTED_KEY], [u'1', u'2'])
+        assert not hasattr(doc, 'psj_gndterms_counted')
+        hooks = list(txn.getAfterCommitHooks())
+        self.assertEqual(len(hooks), 1)
+        hook, args, kw = hooks[0]
+        hook(True, *args, **kw)
+        self.assertEqual(redis_cli.zscore('gnd-autocomplete-usage', '1'), 1)
+        # unchanged terms are not counted again
+        record_gndterms_usage(doc)
+        self.assertEqual(len(list(txn.getAfterCommitHooks())), 1)
+        txn.abort()
+
+    def test_gndterms_usage_not_annotatable(self):
+        # objects without annotations are not counted
+        self.setup_redis_autocomplete()
+        doc = self.create_behavioral_doc()
+        IPSJGNDTerms(doc).psj_gndterms = [u'1']
+        txn = transaction.get()
+        record_gndterms_usage(doc)
+        self.assertEqual(len(list(txn.getAfterCommitHooks())), 0)
+        txn.abort()
@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+# Tests for conversion and worker modules.
+import hashlib
+import os
+import redis
+import shutil
+import sys
+import tempfile
+import transaction
+import types
+import unittest
+from cStringIO import StringIO
+from plone.app.testing import TEST_USER_ID, setRoles
+from plone.namedfile.file import NamedBlobFile
+from zope.component import getGlobalSiteManager
+from zope.interface import implements, verify
+from psj.content.conversion import (
+    get_queue_client, enqueue, create_or_enqueue, get_converter,
+    update_subobjects, TransformsConverter, UnoConverter, QUEUE_CONF_NAME,
+    QUEUE_NAME, PROCESSING_NAME, PENDING, DONE, FAILED, PDF_TYPE, HTML_TYPE,
+    )
+from psj.content.interfaces import (
+    IRedisStoreConfig, IOfficeDocConverter, IConversionCacheConfig,
+    )
+from psj.content.testing import (
+    RedisLayer, INTEGRATION_TESTING, FUNCTIONAL_TESTING,
+    )
+from psj.content.worker import process_job, run_worker
+
+
+class DummyDocument(object):
+    # an object that can be queued for conversion
+    converted = False
+
+    def getPhysicalPath(self):
+        return ('', 'plone', 'doc1')
+
+
+def create_reprs(obj, digest=None):
+    # a fake conversion
+    obj.converted = True
+    obj.digest = digest
+    return True
+
+
+def create_no_reprs(obj, digest=None):
+    # a fake conversion delivering no representations
+    return False
+
+
+class FakeConverter(object):
+    # a converter delivering fixed results
+    implements(IOfficeDocConverter)
+
+    html = '<img src="a.png" />'
+
+    def __init__(self):
+        self.calls = []
+
+    def convert(self, context, stream, filename):
+        self.calls.append((stream.read(), filename))
+        return {
+            PDF_TYPE: ('%PDF', {}),
+            HTML_TYPE: (self.html, {'a.png': 'PNG'}),
+            }
+
+
+class FakeDesktop(object):
+    # a LibreOffice desktop that cannot load documents
+    def loadComponentFromURL(self, url, target, flags, props):
+        return None
+
+
+class FakeUnoDocument(object):
+    # a document loaded into LibreOffice
+    def __init__(self, path):
+        self.path = path
+        self.stored = []
+        self.closed = False
+
+    def storeToURL(self, url, props):
+        path = url[len('file://'):]
+        self.stored.append(props['FilterName'])
+        open(path, 'wb').write('%s of %s' % (
+            props['FilterName'], open(self.path, 'rb').read()))
+        if path.endswith('.html'):
+            open(os.path.join(os.path.dirname(path), 'img.png'),
+                 'wb').write('PNG')
+
+    def close(self, deliver_ownership):
+        self.closed = True
+
+
+class FakeUnoDesktop(object):
+    # a LibreOffice desktop loading documents
+    def __init__(self):
+        self.loaded = []
+
+    def loadComponentFromURL(self, url, target, flags, props):
+        doc = FakeUnoDocument(url[len('file://'):])
+        self.loaded.append(doc)
+        return doc
+
+
+class QueueSetup(object):
+    # register a conversion queue config in a running redis server
+
+    def setUp(self):
+        settings = self.layer['redis_server'].settings['redis_conf']
+        self.conf = {'host': settings['bind'], 'port': settings['port'],
+                     'db': 0}
+        self.redis = redis.StrictRedis(
+            host='localhost', port=settings['port'], db=0)
+        self.redis.flushdb()
+
+    def tearDown(self):
+        self.disable_queue()
+        self.redis.flushdb()
+        transaction.abort()
+
+    def enable_queue(self):
+        getGlobalSiteManager().registerUtility(
+            self.conf, provided=IRedisStoreConfig, name=QUEUE_CONF_NAME)
+
+    def disable_queue(self):
+        getGlobalSiteManager().unregisterUtility(
+            provided=IRedisStoreConfig, name=QUEUE_CONF_NAME)
+
+
+class ConversionTests(QueueSetup, unittest.TestCase):
+
+    layer = RedisLayer
+
+    def test_get_queue_client(self):
+        # we get a client only if a queue is configured
+        assert get_queue_client() is None
+        self.enable_queue()
+        assert get_queue_client().ping() is True
+
+    def test_enqueue(self):
+        # jobs are queued when the transaction was committed
+        obj = DummyDocument()
+        txn = transaction.get()
+        enqueue(obj, self.redis)
+        self.assertEqual(obj.psj_conversion_state, PENDING)
+        self.assertEqual(self.redis.llen(QUEUE_NAME), 0)
+        hook, args, kw = list(txn.getAfterCommitHooks())[0]
+        hook(True, *args, **kw)
+        self.assertEqual(
+            self.redis.lrange(QUEUE_NAME, 0, -1), ['/plone/doc1'])
+
+    def test_enqueue_aborted(self):
+        # no jobs are queued for failed transactions
+        txn = transaction.get()
+        enqueue(DummyDocument(), self.redis)
+        hook, args, kw = list(txn.getAfterCommitHooks())[0]
+        hook(False, *args, **kw)
+        self.assertEqual(self.redis.llen(QUEUE_NAME), 0)
+
+    def test_create_or_enqueue_sync(self):
+        # without queue, conversions are done immediately
+        obj = DummyDocument()
+        create_or_enqueue(obj, create_reprs)
+        assert obj.converted is True
+        self.assertEqual(obj.psj_conversion_state, DONE)
+
+    def test_create_or_enqueue_digest(self):
+        # known digests are passed to conversions
+        obj = DummyDocument()
+        create_or_enqueue(obj, create_reprs, 'd41d8cd9')
+        self.assertEqual(obj.digest, 'd41d8cd9')
+
+    def test_create_or_enqueue_sync_failed(self):
+        # conversions without representations are marked as failed
+        obj = DummyDocument()
+        create_or_enqueue(obj, create_no_reprs)
+        self.assertEqual(obj.psj_conversion_state, FAILED)
+
+    def test_create_or_enqueue_queued(self):
+        # with queue, conversions are left to workers
+        self.enable_queue()
+        obj = DummyDocument()
+        create_or_enqueue(obj, create_reprs)
+        assert obj.converted is False
+        self.assertEqual(obj.psj_conversion_state, PENDING)
+
+
+class ConverterTests(unittest.TestCase):
+
+    layer = INTEGRATION_TESTING
+
+    def setUp(self):
+        self.portal = self.layer['portal']
+        setRoles(self.portal, TEST_USER_ID, ['Manager'])
+        self.src_file = NamedBlobFile(
+            data='Hi there!', filename=u'sample.txt')
+
+    def tearDown(self):
+        getGlobalSiteManager().unregisterUtility(
+            provided=IOfficeDocConverter)
+
+    def test_iface(self):
+        # converters fullfill the promised interface
+        verify.verifyClass(IOfficeDocConverter, TransformsConverter)
+        verify.verifyClass(IOfficeDocConverter, UnoConverter)
+
+    def test_get_converter(self):
+        # we get the registered converter or a default one
+        assert isinstance(get_converter(), TransformsConverter)
+        converter = FakeConverter()
+        getGlobalSiteManager().registerUtility(
+            converter, provided=IOfficeDocConverter)
+        assert get_converter() is converter
+
+    def test_get_converter_uno(self):
+        # if LibreOffice can be reached, uno converters are the default
+        sys.modules['uno'] = types.ModuleType('uno')
+        try:
+            assert isinstance(get_converter(), UnoConverter)
+        finally:
+            del sys.modules['uno']
+
+    def test_converted_once(self):
+        # documents are passed to converters once for all formats
+        converter = FakeConverter()
+        getGlobalSiteManager().registerUtility(
+            converter, provided=IOfficeDocConverter)
+        self.portal.invokeFactory(
+            'psj.content.officedoc', 'doc1', psj_office_doc=self.src_file)
+        doc = self.portal['doc1']
+        self.assertEqual(converter.calls, [('Hi there!', u'sample.txt')])
+        self.assertEqual(doc.psj_pdf_repr.data, '%PDF')
+        self.assertEqual(doc.psj_pdf_repr.filename, u'sample.txt.pdf')
+        self.assertEqual(doc.psj_html_repr.data, '<img src="a.png" />')
+        self.assertEqual(doc.keys(), ['a.png'])
+        self.assertEqual(doc.psj_conversion_state, DONE)
+
+    def test_cached(self):
+        # identical documents are converted only once with a cache
+        converter = FakeConverter()
+        gsm = getGlobalSiteManager()
+        gsm.registerUtility(converter, provided=IOfficeDocConverter)
+        workdir = tempfile.mkdtemp()
+        gsm.registerUtility(
+            {'path': workdir, 'max_size': 1},
+            provided=IConversionCacheConfig)
+        try:
+            for name in ('doc1', 'doc2'):
+                self.portal.invokeFactory(
+                    'psj.content.officedoc', name,
+                    psj_office_doc=self.src_file)
+        finally:
+            gsm.unregisterUtility(provided=IConversionCacheConfig)
+            shutil.rmtree(workdir)
+        self.assertEqual(len(converter.calls), 1)
+        doc = self.portal['doc2']
+        self.assertEqual(doc.psj_pdf_repr.data, '%PDF')
+        self.assertEqual(doc.keys(), ['a.png'])
+
+    def test_update_subobjects(self):
+        # only added, removed or changed subobjects are touched
+        getGlobalSiteManager().registerUtility(
+            FakeConverter(), provided=IOfficeDocConverter)
+        self.portal.invokeFactory(
+            'psj.content.officedoc', 'doc1', psj_office_doc=self.src_file)
+        doc = self.portal['doc1']
+        update_subobjects(doc, {'a.png': 'PNG', 'b.txt': 'B'})
+        image, text = doc['a.png'], doc['b.txt']
+        update_subobjects(doc, {'a.png': 'PNG', 'b.txt': 'B2', 'c.gif': 'C'})
+        self.assertEqual(sorted(doc.keys()), ['a.png', 'b.txt', 'c.gif'])
+        assert doc['a.png'] is image
+        assert doc['b.txt'] is text
+        self.assertEqual(text.psj_md5, hashlib.md5('B2').hexdigest())
+        update_subobjects(doc, {'c.gif': 'C'})
+        self.assertEqual(doc.keys(), ['c.gif'])
+
+    def test_transforms_converter(self):
+        # the default converter uses portal transforms
+        result = TransformsConverter().convert(
+            self.portal, StringIO('Hi there!'), u'sample.txt')
+        assert result[PDF_TYPE][0] is not None
+        assert result[HTML_TYPE][0] is not None
+
+    def test_uno_converter_fallback(self):
+        # without LibreOffice, uno converters use the portal transforms
+        converter = UnoConverter(url='socket,host=localhost,port=1;urp;')
+        result = converter.convert(
+            self.portal, StringIO('Hi there!'), u'sample.txt')
+        assert result[PDF_TYPE][0] is not None
+
+    def test_uno_converter(self):
+        # documents are loaded once and exported into all formats
+        converter = UnoConverter()
+        desktop = FakeUnoDesktop()
+        converter._get_desktop = lambda: desktop
+        converter._props = lambda **props: props
+        uno = types.ModuleType('uno')
+        uno.systemPathToFileUrl = lambda path: 'file://' + path
+        sys.modules['uno'] = uno
+        try:
+            result = converter.convert(
+                self.portal, StringIO('Hi there!'), u'sample.odt')
+        finally:
+            del sys.modules['uno']
+        self.assertEqual(len(desktop.loaded), 1)
+        doc = desktop.loaded[0]
+        self.assertEqual(
+            sorted(doc.stored), ['HTML (StarWriter)', 'writer_pdf_Export'])
+        assert doc.closed is True
+        self.assertEqual(
+            result[PDF_TYPE], ('writer_pdf_Export of Hi there!', {}))
+        self.assertEqual(
+            result[HTML_TYPE],
+            ('HTML (StarWriter) of Hi there!', {'img.png': 'PNG'}))
+
+    def test_uno_converter_load_failed(self):
+        # documents LibreOffice cannot load are converted by transforms
+        converter = UnoConverter()
+        converter._get_desktop = FakeDesktop
+        converter._props = lambda **props: ()
+        uno = types.ModuleType('uno')
+        uno.systemPathToFileUrl = lambda path: 'file://' + path
+        sys.modules['uno'] = uno
+        try:
+            result = converter.convert(
+                self.portal, StringIO('Hi there!'), u'sample.txt')
+        finally:
+            del sys.modules['uno']
+        assert result[PDF_TYPE][0] is not None
+
+
+class WorkerTests(QueueSetup, unittest.TestCase):
+
+    layer = FUNCTIONAL_TESTING
+
+    def setUp(self):
+        super(WorkerTests, self).setUp()
+        self.app = self.layer['app']
+        self.portal = self.layer['portal']
+        setRoles(self.portal, TEST_USER_ID, ['Manager'])
+        self.enable_queue()
+        self.portal.invokeFactory(
+            'psj.content.officedoc', 'doc1', psj_office_doc=NamedBlobFile(
+                data='Hi there!', filename=u'sample.txt'))
+        transaction.commit()
+        self.path = '/'.join(self.portal['doc1'].getPhysicalPath())
+
+    def test_queued_on_add(self):
+        # adding office docs queues conversion jobs
+        doc = self.portal['doc1']
+        self.assertEqual(doc.psj_conversion_state, PENDING)
+        assert doc.psj_md5 is None
+        self.assertEqual(self.redis.lrange(QUEUE_NAME, 0, -1), [self.path])
+
+    def test_process_job(self):
+        # workers convert pending docs
+        assert process_job(self.app, self.path) is True
+        doc = self.portal['doc1']
+        self.assertEqual(doc.psj_conversion_state, DONE)
+        self.assertEqual(doc.psj_md5, '396199333edbf40ad43e62a1c1397793')
+        assert doc.psj_pdf_repr is not None
+        # done jobs are not processed again
+        assert process_job(self.app, self.path) is False
+
+    def test_process_job_failed(self):
+        # failed conversions are marked
+        # representations cannot be named without filename
+        self.portal['doc1'].psj_office_doc = NamedBlobFile(data='Hi there!')
+        transaction.commit()
+        assert process_job(self.app, self.path) is False
+        self.assertEqual(self.portal['doc1'].psj_conversion_state, FAILED)
+
+    def test_process_job_no_reprs(self):
+        # conversions delivering no representations are marked as failed
+        converter = FakeConverter()
+        converter.convert = lambda context, stream, filename: {}
+        gsm = getGlobalSiteManager()
+        gsm.registerUtility(converter, provided=IOfficeDocConverter)
+        try:
+            assert process_job(self.app, self.path) is False
+        finally:
+            gsm.unregisterUtility(provided=IOfficeDocConverter)
+        self.assertEqual(self.portal['doc1'].psj_conversion_state, FAILED)
+
+    def test_process_job_reindexes(self):
+        # the text of converted docs can be searched
+        converter = FakeConverter()
+        converter.html = '<p>Quuxwords inside</p>'
+        gsm = getGlobalSiteManager()
+        gsm.registerUtility(converter, provided=IOfficeDocConverter)
+        try:
+            assert process_job(self.app, self.path) is True
+        finally:
+            gsm.unregisterUtility(provided=IOfficeDocConverter)
+        catalog = self.portal.portal_catalog
+        self.assertEqual(
+            [brain.getPath() for brain in catalog(SearchableText='Quuxwords')],
+            [self.path])
+
+    def test_process_job_not_found(self):
+        # jobs of removed objects are skipped
+        assert process_job(self.app, '/plone/not-existing') is False
+
+    def test_run_worker(self):
+        # workers process all queued jobs and requeue unfinished ones
+        self.redis.lpush(PROCESSING_NAME, '/plone/not-existing')
+        self.assertEqual(
+            run_worker(self.app, self.redis, once=True, timeout=1), 2)
+        self.assertEqual(self.redis.llen(QUEUE_NAME), 0)
+        self.assertEqual(self.redis.llen(PROCESSING_NAME), 0)
+        self.assertEqual(self.portal['doc1'].psj_conversion_state, DONE)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# Tests for conversioncache module.
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from zope.component import getGlobalSiteManager
+from psj.content.conversioncache import (
+    cache_key, ConversionCache, get_cache,
+    )
+from psj.content.interfaces import IConversionCacheConfig
+
+
+class Converter(object):
+    # a converter without version
+    pass
+
+
+class VersionedConverter(object):
+    # a converter with version
+    version = 'v1'
+
+
+class ConversionCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.result = {
+            'application/pdf': ('%PDF', {}),
+            'text/html': ('<html />', {'a.png': 'PNG'}),
+            }
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+        getGlobalSiteManager().unregisterUtility(
+            provided=IConversionCacheConfig)
+
+    def test_cache_key(self):
+        # keys depend on source digest and converter version
+        key = cache_key('123', VersionedConverter())
+        self.assertEqual(len(key), 40)
+        self.assertEqual(key, cache_key('123', VersionedConverter()))
+        self.assertNotEqual(key, cache_key('124', VersionedConverter()))
+        self.assertNotEqual(key, cache_key('123', Converter()))
+
+    def test_get_set(self):
+        # we can store and retrieve conversion results
+        cache = ConversionCache(self.workdir, 1024)
+        assert cache.get('abc') is None
+        assert 'abc' not in cache
+        cache.set('abc', self.result)
+        assert 'abc' in cache
+        self.assertEqual(cache.get('abc'), self.result)
+        assert os.path.isfile(os.path.join(self.workdir, 'ab', 'abc'))
+
+    def test_get_broken(self):
+        # broken cache files are ignored
+        cache = ConversionCache(self.workdir, 1024)
+        os.mkdir(os.path.join(self.workdir, 'ab'))
+        with open(os.path.join(self.workdir, 'ab', 'abc'), 'wb') as fd:
+            fd.write('broken')
+        assert cache.get('abc') is None
+
+    def test_set_unwritable(self):
+        # errors when writing are not raised
+        path = os.path.join(self.workdir, 'not-a-dir')
+        open(path, 'w').write('')
+        cache = ConversionCache(path, 1024)
+        cache.set('abc', self.result)
+        assert cache.get('abc') is None
+
+    def test_evict(self):
+        # least recently used results are removed if the cache is full
+        cache = ConversionCache(self.workdir, 1024)
+        cache.set('aaa', self.result)
+        cache.set('bbb', self.result)
+        size = os.path.getsize(os.path.join(self.workdir, 'aa', 'aaa'))
+        past = time.time() - 100
+        os.utime(os.path.join(self.workdir, 'aa', 'aaa'), (past, past))
+        os.utime(os.path.join(self.workdir, 'bb', 'bbb'), (past, past - 1))
+        cache.get('bbb')  # 'bbb' is used now
+        cache.max_bytes = size + 1
+        self.assertEqual(cache.evict(), 1)
+        assert 'aaa' not in cache
+        assert 'bbb' in cache
+
+    def test_set_evicts(self):
+        # storing results keeps the cache size limited
+        cache = ConversionCache(self.workdir, 0)
+        cache.set('aaa', self.result)
+        assert 'aaa' not in cache
+
+    def test_get_cache(self):
+        # we get a cache only if one is configured
+        assert get_cache() is None
+        getGlobalSiteManager().registerUtility(
+            {'path': self.workdir, 'max_size': 2},
+            provided=IConversionCacheConfig)
+        cache = get_cache()
+        self.assertEqual(cache.path, self.workdir)
+        self.assertEqual(cache.max_bytes, 2 * 1024 * 1024)
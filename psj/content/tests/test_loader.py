@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+# Tests for loader module.
+import os
+import redis
+import shutil
+import tempfile
+import unittest
+from cStringIO import StringIO
+from psj.content.loader import (
+    read_entries, batches, zset_entry, load_terms, remove_stale_keys,
+    apply_delta, main, KeyLayout, HashLayout, migrate_to_hashes,
+    dump_snapshot, build_ngram_index,
+    )
+from psj.content.sources import (
+    hash_bucket, RedisSnapshot, DEFAULT_BUCKETS,
+    )
+from psj.content.testing import RedisLayer
+
+
+class HelperTests(unittest.TestCase):
+
+    def test_read_entries(self):
+        # we can parse term file lines
+        lines = ["1&&foo&&Foo\n", "invalid\n", "2&&bär&&Bär\n"]
+        self.assertEqual(
+            list(read_entries(lines)),
+            [("1", "foo", "Foo"), ("2", "bär", "Bär")])
+
+    def test_batches(self):
+        # we can split iterables into batches
+        self.assertEqual(
+            list(batches(range(5), 2)), [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(batches([], 2)), [])
+
+    def test_zset_entry(self):
+        # we can build autocomplete ZSET entries
+        self.assertEqual(zset_entry("1", "foo"), "foo (1)&&1")
+
+
+class LoaderTests(unittest.TestCase):
+
+    layer = RedisLayer
+
+    def setUp(self):
+        settings = self.layer['redis_server'].settings['redis_conf']
+        self.redis_host = settings['bind']
+        self.redis_port = settings['port']
+        self.redis = redis.StrictRedis(
+            host='localhost', port=settings['port'], db=0)
+        self.redis.flushdb()
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+        self.redis.flushdb()
+
+    def test_load_terms(self):
+        # we can load terms into an empty store
+        lines = ["1&&foo&&Foo\n", "2&&bar&&Bar\n"]
+        self.assertEqual(load_terms(self.redis, lines, batch_size=1), 2)
+        self.assertEqual(
+            self.redis.zrangebylex("gnd-autocomplete", "-", "+"),
+            ["bar (2)&&2", "foo (1)&&1"])
+        self.assertEqual(self.redis.get("1"), "Foo")
+        self.assertEqual(self.redis.get("2"), "Bar")
+        self.assertEqual(
+            sorted(self.redis.keys()), ["1", "2", "gnd-autocomplete"])
+
+    def test_load_terms_replaces_old(self):
+        # old entries are replaced, stale keys removed
+        load_terms(self.redis, ["1&&foo&&Foo\n", "2&&bar&&Bar\n"])
+        self.redis.set("other", "untouched")
+        load_terms(self.redis, ["1&&fuu&&Fuu\n", "3&&baz&&Baz\n"])
+        self.assertEqual(
+            self.redis.zrangebylex("gnd-autocomplete", "-", "+"),
+            ["baz (3)&&3", "fuu (1)&&1"])
+        self.assertEqual(self.redis.get("1"), "Fuu")
+        self.assertEqual(self.redis.get("2"), None)
+        self.assertEqual(self.redis.get("other"), "untouched")
+
+    def test_load_terms_removes_stale_after_swap(self):
+        # stale keys are deleted only when no longer referenced
+        load_terms(self.redis, ["1&&foo&&Foo\n", "2&&bar&&Bar\n"])
+        client = self.redis
+        referenced = []
+
+        class CheckingLayout(KeyLayout):
+            def delete(self, pipe, keys):
+                entries = client.zrangebylex("gnd-autocomplete", "-", "+")
+                referenced.extend(
+                    [key for key in keys if "bar (%s)&&%s" % (key, key)
+                     in entries])
+                super(CheckingLayout, self).delete(pipe, keys)
+
+        load_terms(self.redis, ["1&&foo&&Foo\n"], layout=CheckingLayout())
+        self.assertEqual(referenced, [])
+        self.assertEqual(self.redis.get("2"), None)
+        self.assertEqual(
+            sorted(self.redis.keys()), ["1", "gnd-autocomplete"])
+
+    def test_load_terms_empty(self):
+        # loading an empty list clears the ZSET
+        load_terms(self.redis, ["1&&foo&&Foo\n"])
+        self.assertEqual(load_terms(self.redis, []), 0)
+        self.assertEqual(self.redis.keys(), [])
+
+    def test_load_terms_progress(self):
+        # we report progress and throughput
+        out = StringIO()
+        load_terms(self.redis, ["1&&foo&&Foo\n"], out=out)
+        assert out.getvalue().startswith("Loaded 1 entries (")
+
+    def test_remove_stale_keys(self):
+        # we can remove keys not contained in a set
+        load_terms(self.redis, ["1&&foo&&Foo\n", "2&&bar&&Bar\n"])
+        self.redis.sadd("keep", "1")
+        self.assertEqual(
+            remove_stale_keys(self.redis, "gnd-autocomplete", "keep"), 1)
+        self.assertEqual(self.redis.get("1"), "Foo")
+        self.assertEqual(self.redis.get("2"), None)
+
+    def test_apply_delta(self):
+        # we can apply changes only
+        load_terms(self.redis, [
+            "1&&foo&&Foo\n", "2&&bar&&Bar\n", "3&&baz&&Baz\n",
+            "4&&boo&&Boo\n"])
+        stats = apply_delta(self.redis, [
+            "1&&foo&&Foo\n",     # unchanged
+            "2&&bar&&BAR\n",     # title changed
+            "3&&bas&&Bas\n",     # normalized and title changed
+            "5&&new&&New\n",     # added
+            ], batch_size=2)
+        self.assertEqual(
+            stats, dict(added=1, changed=2, removed=1, unchanged=1))
+        self.assertEqual(
+            self.redis.zrangebylex("gnd-autocomplete", "-", "+"),
+            ["bar (2)&&2", "bas (3)&&3", "foo (1)&&1", "new (5)&&5"])
+        self.assertEqual(
+            [self.redis.get(x) for x in "12345"],
+            ["Foo", "BAR", "Bas", None, "New"])
+        self.assertEqual(
+            sorted(self.redis.keys()),
+            ["1", "2", "3", "5", "gnd-autocomplete"])
+
+    def test_apply_delta_empty_store(self):
+        # we can apply deltas to empty stores
+        stats = apply_delta(self.redis, ["1&&foo&&Foo\n"])
+        self.assertEqual(
+            stats, dict(added=1, changed=0, removed=0, unchanged=0))
+        self.assertEqual(self.redis.get("1"), "Foo")
+
+    def test_load_terms_hash_layout(self):
+        # we can store values in hashes
+        layout = HashLayout("titles", buckets=2)
+        load_terms(self.redis, ["1&&foo&&Foo\n", "2&&bar&&Bar\n"],
+                   layout=layout)
+        self.assertEqual(
+            self.redis.hget(hash_bucket("1", "titles", 2), "1"), "Foo")
+        self.assertEqual(
+            self.redis.hget(hash_bucket("2", "titles", 2), "2"), "Bar")
+        self.assertEqual(self.redis.get("1"), None)
+        load_terms(self.redis, ["1&&foo&&Foo\n"], layout=layout)
+        self.assertEqual(
+            self.redis.hget(hash_bucket("2", "titles", 2), "2"), None)
+
+    def test_apply_delta_hash_layout(self):
+        # we can apply deltas to values stored in hashes
+        layout = HashLayout("titles", buckets=2)
+        load_terms(self.redis, ["1&&foo&&Foo\n", "2&&bar&&Bar\n"],
+                   layout=layout)
+        stats = apply_delta(
+            self.redis, ["1&&foo&&FOO\n"], layout=layout)
+        self.assertEqual(
+            stats, dict(added=0, changed=1, removed=1, unchanged=0))
+        self.assertEqual(
+            self.redis.hget(hash_bucket("1", "titles", 2), "1"), "FOO")
+        self.assertEqual(
+            self.redis.hget(hash_bucket("2", "titles", 2), "2"), None)
+
+    def test_hash_layout_buckets(self):
+        # the number of hashes is stored with the hashes
+        HashLayout("titles", buckets=2).prepare(self.redis)
+        self.assertEqual(self.redis.get("titles-buckets"), "2")
+        layout = HashLayout("titles")
+        layout.prepare(self.redis)
+        self.assertEqual(layout.buckets, 2)
+        self.assertRaises(
+            ValueError, HashLayout("titles", buckets=3).prepare, self.redis)
+
+    def test_hash_layout_legacy_buckets(self):
+        # stores not telling their number of hashes use the old default
+        layout = HashLayout("titles")
+        layout.prepare(self.redis, store=False)
+        self.assertEqual(layout.buckets, DEFAULT_BUCKETS)
+        assert self.redis.exists("titles-buckets") is False
+
+    def test_hash_layout_max_length(self):
+        # we remember the length of the longest value set
+        layout = HashLayout("titles", buckets=2)
+        load_terms(self.redis, ["1&&foo&&Foo\n", "2&&bar&&Barbaz\n"],
+                   layout=layout)
+        self.assertEqual(layout.max_length, 6)
+
+    def test_migrate_to_hashes_buckets(self):
+        # the number of hashes is derived from the number of entries
+        load_terms(self.redis, ["%s&&foo&&Foo\n" % x for x in range(100)])
+        migrate_to_hashes(self.redis)
+        self.assertEqual(
+            self.redis.get("gnd-autocomplete-titles-buckets"), "2")
+        self.assertEqual(
+            self.redis.hget(
+                hash_bucket("99", "gnd-autocomplete-titles", 2), "99"), "Foo")
+
+    def test_migrate_to_hashes(self):
+        # we can move values from keys into hashes
+        load_terms(self.redis, ["1&&foo&&Foo\n", "2&&bar&&Bar\n"])
+        self.assertEqual(
+            migrate_to_hashes(self.redis, buckets=2, batch_size=1), 2)
+        self.assertEqual(self.redis.get("1"), None)
+        self.assertEqual(
+            self.redis.hget(
+                hash_bucket("1", "gnd-autocomplete-titles", 2), "1"), "Foo")
+        self.assertEqual(
+            self.redis.zcard("gnd-autocomplete"), 2)
+
+    def test_dump_snapshot(self):
+        # we can dump stores into snapshot files
+        load_terms(self.redis, ["1&&foo&&Foo\n", "2&&bar&&B\xc3\xa4r\n"])
+        self.redis.zadd("gnd-autocomplete", 0, "baz (3)&&3")
+        path = os.path.join(self.workdir, "snapshot")
+        self.assertEqual(dump_snapshot(self.redis, path, batch_size=1), 3)
+        snapshot = RedisSnapshot(path)
+        self.assertEqual(snapshot.title("2"), "B\xc3\xa4r")
+        self.assertEqual(snapshot.title("3"), None)
+        self.assertEqual(
+            snapshot.entries("b"), ["bar (2)&&2", "foo (1)&&1"])
+
+    def test_dump_snapshot_hash_layout(self):
+        # we can dump stores with values in hashes
+        layout = HashLayout("titles", 2)
+        load_terms(self.redis, ["1&&foo&&Foo\n"], layout=layout)
+        path = os.path.join(self.workdir, "snapshot")
+        dump_snapshot(self.redis, path, layout=layout)
+        self.assertEqual(RedisSnapshot(path).title("1"), "Foo")
+
+    def test_main_snapshot(self):
+        # we can dump snapshots from the commandline
+        load_terms(self.redis, ["1&&foo&&Foo\n"])
+        path = os.path.join(self.workdir, "snapshot")
+        main(["--host", self.redis_host, "--port", str(self.redis_port),
+              "--snapshot", path])
+        self.assertEqual(RedisSnapshot(path).title("1"), "Foo")
+
+    def test_build_ngram_index(self):
+        # we can build n-gram indexes of autocomplete ZSETs
+        load_terms(self.redis, ["1&&foo bar&&Foo Bar\n", "2&&fob&&Fob\n"])
+        self.assertEqual(build_ngram_index(self.redis, batch_size=1), 2)
+        self.assertEqual(
+            self.redis.smembers("gnd-autocomplete-ngram: fo"),
+            set(["1", "2"]))
+        self.assertEqual(
+            self.redis.smembers("gnd-autocomplete-ngram:ar "), set(["1"]))
+        assert self.redis.exists("gnd-autocomplete-ngram:(1)") is False
+        assert self.redis.keys("*loading*") == []
+
+    def test_build_ngram_index_removes_stale(self):
+        # n-grams not occurring any more are removed from the index
+        load_terms(self.redis, ["1&&foo&&Foo\n"])
+        build_ngram_index(self.redis)
+        load_terms(self.redis, ["2&&bar&&Bar\n"])
+        build_ngram_index(self.redis)
+        assert self.redis.exists("gnd-autocomplete-ngram:foo") is False
+        self.assertEqual(
+            self.redis.smembers("gnd-autocomplete-ngram:bar"), set(["2"]))
+
+    def test_build_ngram_index_replaces_sets(self):
+        # sets of n-grams still occurring are replaced
+        load_terms(self.redis, ["1&&foo&&Foo\n"])
+        build_ngram_index(self.redis, batch_size=1)
+        load_terms(self.redis, ["2&&foo&&Foo\n"])
+        build_ngram_index(self.redis, batch_size=1)
+        self.assertEqual(
+            self.redis.smembers("gnd-autocomplete-ngram:foo"), set(["2"]))
+        assert self.redis.keys("*loading*") == []
+
+    def test_main_ngrams(self):
+        # we can build n-gram indexes from the commandline
+        path = os.path.join(self.workdir, "terms.txt")
+        with open(path, "w") as fd:
+            fd.write("1&&foo&&Foo\n")
+        main([path, "--host", self.redis_host, "--port",
+              str(self.redis_port), "--ngrams"])
+        self.assertEqual(
+            self.redis.smembers("gnd-autocomplete-ngram:foo"), set(["1"]))
+
+    def test_main(self):
+        # we can load term files from the commandline
+        path = os.path.join(self.workdir, "terms.txt")
+        with open(path, "w") as fd:
+            fd.write("1&&foo&&Foo\n")
+        main([path, "--host", self.redis_host, "--port",
+              str(self.redis_port), "--zset", "my-zset"])
+        self.assertEqual(self.redis.zcard("my-zset"), 1)
+
+    def test_main_hash_layout(self):
+        # new stores get a number of hashes fitting the number of terms
+        path = os.path.join(self.workdir, "terms.txt")
+        with open(path, "w") as fd:
+            fd.write("".join(["%s&&foo&&Foo\n" % x for x in range(65)]))
+        main([path, "--host", self.redis_host, "--port",
+              str(self.redis_port), "--layout", "hash"])
+        self.assertEqual(
+            self.redis.get("gnd-autocomplete-titles-buckets"), "2")
+        # the number is kept when reloading
+        with open(path, "w") as fd:
+            fd.write("1&&foo&&Foo\n")
+        main([path, "--host", self.redis_host, "--port",
+              str(self.redis_port), "--layout", "hash"])
+        self.assertEqual(
+            self.redis.hget(
+                hash_bucket("1", "gnd-autocomplete-titles", 2), "1"), "Foo")
+
+    def test_main_delta(self):
+        # we can apply deltas from the commandline
+        path = os.path.join(self.workdir, "terms.txt")
+        with open(path, "w") as fd:
+            fd.write("1&&foo&&Foo\n")
+        self.redis.set("1", "Old")
+        main([path, "--host", self.redis_host, "--port",
+              str(self.redis_port), "--delta"])
+        self.assertEqual(self.redis.get("1"), "Foo")
@@ -12,6 +12,7 @@ from zope.component import queryUtility, createObject, getMultiAdapter
 from zope.event import notify
 from zope.interface import verify
 from zope.lifecycleevent import ObjectModifiedEvent
+from psj.content import conversion
 from psj.content.officedoc import IOfficeDoc, OfficeDoc, DisplayView
 from psj.content.testing import INTEGRATION_TESTING, FUNCTIONAL_TESTING
 
@@ -71,6 +72,28 @@ class OfficeDocIntegrationTests(unittest.TestCase):
         self.assertEqual(d1.title, u'My changed title')
         self.assertEqual(d1.description, u'My changed description')
 
+    def test_editing_hashed_once(self):
+        # changed office docs are read only once for hashing
+        self.folder.invokeFactory(
+            'psj.content.officedoc', 'doc1', psj_office_doc=self.src_file)
+        d1 = self.folder['doc1']
+        d1.psj_office_doc = NamedBlobFile(
+            data='I changed!', filename=u'othersample.txt')
+        calls = []
+        orig_digest = conversion.file_digest
+
+        def file_digest(named_file):
+            calls.append(named_file)
+            return orig_digest(named_file)
+
+        conversion.file_digest = file_digest
+        try:
+            notify(ObjectModifiedEvent(d1))
+        finally:
+            conversion.file_digest = orig_digest
+        self.assertEqual(calls, [])
+        self.assertEqual(d1.psj_md5, '2e2b959667fdf3f17dd3a834b0f1f009')
+
     def test_fti(self):
         # we can get factory type infos for officedocs
         fti = queryUtility(IDexterityFTI, name='psj.content.officedoc')
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# Tests for recordfile module.
+import os
+import shutil
+import tempfile
+import unittest
+from psj.content.recordfile import RecordFile, write_records
+
+
+class RecordFileTests(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.workdir, 'records')
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def test_write_records(self):
+        # we can write records to files
+        num = write_records(self.path, [('b', '2'), ('a', '1'), ('b', '3')])
+        self.assertEqual(num, 2)
+        assert os.path.isfile(self.path)
+        self.assertEqual(os.listdir(self.workdir), ['records'])
+
+    def test_get(self):
+        # we can lookup values by key
+        write_records(self.path, [('b', '2'), ('a', '1'), ('c', '')])
+        records = RecordFile(self.path)
+        self.assertEqual(records.get('a'), '1')
+        self.assertEqual(records.get('b'), '2')
+        self.assertEqual(records.get('c'), '')
+        self.assertEqual(records.get('d'), None)
+        self.assertEqual(records.get('', 'x'), 'x')
+        assert 'c' in records
+        assert 'aa' not in records
+
+    def test_iter(self):
+        # we iterate over records in the order they were written
+        write_records(self.path, [('b', '2'), ('a', '1'), ('b', '3')])
+        records = RecordFile(self.path)
+        self.assertEqual(list(records), [('b', '2'), ('a', '1')])
+        self.assertEqual(len(records), 2)
+
+    def test_empty(self):
+        # we can handle files without records
+        write_records(self.path, [])
+        records = RecordFile(self.path)
+        self.assertEqual(len(records), 0)
+        self.assertEqual(list(records), [])
+        self.assertEqual(records.get('a'), None)
+
+    def test_prefixed(self):
+        # we can get records with keys starting with some prefix
+        write_records(
+            self.path, [('foo', '1'), ('bar', '2'), ('fob', '3'), ('f', '4')])
+        records = RecordFile(self.path)
+        self.assertEqual(
+            list(records.prefixed('fo')), [('fob', '3'), ('foo', '1')])
+        self.assertEqual(
+            list(records.prefixed('f', limit=2)), [('f', '4'), ('fob', '3')])
+        self.assertEqual(list(records.prefixed('x')), [])
+
+    def test_from_key(self):
+        # we can get records with keys not lower than some key
+        write_records(
+            self.path, [('foo', '1'), ('bar', '2'), ('fob', '3'), ('f', '4')])
+        records = RecordFile(self.path)
+        self.assertEqual(
+            list(records.from_key('fo')), [('fob', '3'), ('foo', '1')])
+        self.assertEqual(
+            list(records.from_key('b', limit=2)), [('bar', '2'), ('f', '4')])
+        self.assertEqual(list(records.from_key('x')), [])
+
+    def test_invalid_file(self):
+        # we refuse to read files that are no record files
+        open(self.path, 'wb').write('not a record file')
+        self.assertRaises(ValueError, RecordFile, self.path)
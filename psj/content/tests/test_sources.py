@@ -1,21 +1,187 @@
 # -*- coding: utf-8 -*-
 # Tests for sources module.
+import hashlib
+import marshal
+import os
 import redis
+import shutil
+import stat
+import tempfile
+import time
 import unittest
 from z3c.formwidget.query.interfaces import IQuerySource
-from zope.component import getGlobalSiteManager
+from zope.component import getGlobalSiteManager, queryUtility
 from zope.interface import verify
-from zope.schema.interfaces import IContextSourceBinder, ITitledTokenizedTerm
+from zope.schema.interfaces import (
+    IContextSourceBinder, ITitledTokenizedTerm, IVocabularyTokenized,
+    )
 from zope.schema.vocabulary import SimpleVocabulary
-from psj.content.interfaces import IRedisStoreConfig
+from psj.content.interfaces import (
+    IExternalVocabConfig, IRedisStoreConfig, IPSJGNDTermsGetter,
+    )
 from psj.content.sources import (
     ExternalVocabBinder, ExternalRedisBinder, ExternalRedisAutocompleteBinder,
     RedisSource, RedisAutocompleteSource, RedisKeysSource, institutes_source,
     licenses_source, publishers_source, subjectgroup_source, ddcgeo_source,
     ddcsach_source, ddczeit_source, gndid_source, gndterms_source,
+    RedisConnectionPools, connection_pools, GNDTermsGetter, connection_options,
+    RedisCacheInvalidator, publish_invalidation, RedisHashAutocompleteSource,
+    hash_bucket, MMapVocabulary, compile_vocab_file, SearchableVocabulary,
+    read_vocab_file, VOCAB_CACHE_VERSION, CompactVocabulary, CompactTerm,
+    CircuitBreaker, RedisSnapshot, ngrams, ngram_index_name, bucket_count,
+    DEFAULT_BUCKETS, vocab_cache_path, trusted_dir, default_vocab_cache_dir,
     )
+from psj.content import sources
+from psj.content.recordfile import write_records
 from psj.content.testing import ExternalVocabSetup, RedisLayer
-from psj.content.utils import tokenize
+from psj.content.utils import tokenize, make_terms, LRUCache
+
+
+class RedisConnectionPoolsTests(unittest.TestCase):
+
+    def test_pools_are_shared(self):
+        # we get the same pool for the same connection params
+        pools = RedisConnectionPools()
+        pool1 = pools.get('localhost', 6379, 0)
+        pool2 = pools.get('localhost', 6379, 0)
+        pool3 = pools.get('localhost', 6379, 1)
+        assert pool1 is pool2
+        assert pool1 is not pool3
+
+    def test_pools_are_bounded(self):
+        # pools do not hold more than `max_connections` connections
+        pools = RedisConnectionPools(max_connections=3)
+        pool = pools.get('localhost', 6379, 0)
+        self.assertEqual(pool.max_connections, 3)
+
+    def test_stats(self):
+        # we can get the usage of pools
+        pools = RedisConnectionPools(max_connections=3)
+        pools.get('localhost', 6379, 0)
+        self.assertEqual(
+            pools.stats(),
+            {('localhost', 6379, 0): dict(
+                created=0, in_use=0, available=0, max_connections=3)})
+
+    def test_pool_options(self):
+        # pools with different connection options are kept apart
+        pools = RedisConnectionPools(max_connections=3)
+        pool1 = pools.get('localhost', 6379, 0)
+        pool2 = pools.get(
+            'localhost', 6379, 0, socket_timeout=1.0, max_connections=5)
+        assert pool1 is not pool2
+        assert pool2 is pools.get(
+            'localhost', 6379, 0, max_connections=5, socket_timeout=1.0)
+        self.assertEqual(pool2.max_connections, 5)
+        self.assertEqual(pool2.connection_kwargs['socket_timeout'], 1.0)
+        assert ('localhost', 6379, 0, ('max_connections', 5),
+                ('socket_timeout', 1.0)) in pools.stats()
+
+    def test_pool_unix_socket(self):
+        # we can connect via unix sockets
+        pools = RedisConnectionPools()
+        pool = pools.get(
+            'localhost', 6379, 2, unix_socket_path='/tmp/redis.sock',
+            socket_keepalive=True)
+        self.assertEqual(pool.connection_kwargs['path'], '/tmp/redis.sock')
+        self.assertEqual(pool.connection_kwargs['db'], 2)
+
+    def test_connection_options(self):
+        # we get the optional connection params set in configs
+        self.assertEqual(
+            connection_options({'host': 'localhost', 'port': 6379, 'db': 0}),
+            {})
+        self.assertEqual(
+            connection_options({'host': 'localhost', 'port': 6379, 'db': 0,
+                                'socket_timeout': 1.0,
+                                'socket_keepalive': False}),
+            {'socket_timeout': 1.0, 'socket_keepalive': False})
+
+    def test_clear(self):
+        # we can drop all pools
+        pools = RedisConnectionPools()
+        pool = pools.get('localhost', 6379, 0)
+        pools.clear()
+        self.assertEqual(pools.stats(), {})
+        assert pools.get('localhost', 6379, 0) is not pool
+
+
+class CircuitBreakerTests(unittest.TestCase):
+
+    def test_open(self):
+        # circuits open after `max_failures` failures in a row
+        breaker = CircuitBreaker(max_failures=2, reset_timeout=3600)
+        breaker.failure()
+        breaker.success()
+        breaker.failure()
+        assert breaker.allow() is True
+        breaker.failure()
+        assert breaker.is_open
+        assert breaker.allow() is False
+
+    def test_reset(self):
+        # open circuits allow single calls after `reset_timeout` secs
+        breaker = CircuitBreaker(max_failures=1, reset_timeout=3600)
+        breaker.failure()
+        assert breaker.allow() is False
+        breaker.opened -= 3600
+        assert breaker.allow() is True
+        assert breaker.allow() is False
+        breaker.success()
+        assert breaker.is_open is False
+        assert breaker.allow() is True
+
+    def test_pool_breakers(self):
+        # connection pools provide shared breakers
+        pools = RedisConnectionPools()
+        breaker = pools.breaker('localhost', 6379, 0)
+        assert isinstance(breaker, CircuitBreaker)
+        assert breaker is pools.breaker('localhost', 6379, 0)
+        assert breaker is not pools.breaker('localhost', 6379, 1)
+
+
+class BrokenClient(object):
+    # a redis client that cannot connect
+    def __getattr__(self, name):
+        def method(*args, **kw):
+            raise redis.ConnectionError()
+        return method
+
+
+class RedisSnapshotTests(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.workdir, 'snapshot')
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def test_missing_file(self):
+        # snapshots without file are empty
+        snapshot = RedisSnapshot(self.path)
+        self.assertEqual(snapshot.title('1'), None)
+        self.assertEqual(snapshot.entries('foo'), [])
+
+    def test_lookups(self):
+        # we can lookup titles and ZSET entries
+        write_records(self.path, [
+            ('z:foo&&1', ''), ('t:1', 'Foo'), ('z:for&&2', ''),
+            ('t:2', 'For')])
+        snapshot = RedisSnapshot(self.path)
+        self.assertEqual(snapshot.title(u'1'), 'Foo')
+        self.assertEqual(snapshot.titles(['2', '3']), ['For', None])
+        self.assertEqual(snapshot.entries('fo'), ['foo&&1', 'for&&2'])
+        self.assertEqual(snapshot.entries('fo', limit=1), ['foo&&1'])
+        self.assertEqual(snapshot.entries('x'), [])
+
+    def test_reopen(self):
+        # changed snapshot files are reopened
+        write_records(self.path, [('t:1', 'Foo')])
+        snapshot = RedisSnapshot(self.path)
+        self.assertEqual(snapshot.title('1'), 'Foo')
+        write_records(self.path, [('t:1', 'Bar'), ('t:2', 'Baz')])
+        self.assertEqual(snapshot.title('1'), 'Bar')
 
 
 class RedisSourceTests(unittest.TestCase):
@@ -57,6 +223,59 @@ class RedisSourceTests(unittest.TestCase):
         result = u'bar' in source
         self.assertEqual(result, False)
 
+    def test_cache(self):
+        # if we have a cache, single lookups are cached
+        cache = LRUCache()
+        source = RedisSource(
+            host=self.redis_host, port=self.redis_port, cache=cache)
+        self.assertEqual(source.getTerm(u'foo').title, u'bar')
+        self.redis.set(u'foo', u'baz')
+        self.assertEqual(source.getTerm(u'foo').title, u'bar')
+        assert u'foo' in source
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+    def test_cache_negative_lookups(self):
+        # also misses are cached
+        cache = LRUCache()
+        source = RedisSource(
+            host=self.redis_host, port=self.redis_port, cache=cache)
+        assert u'bar' not in source
+        self.redis.set(u'bar', u'baz')
+        assert u'bar' not in source
+        self.assertRaises(LookupError, source.getTerm, u'bar')
+        cache.invalidate('bar')
+        assert u'bar' in source
+
+    def test_cache_invalidated_while_fetching(self):
+        # values changed while being fetched are not cached
+        cache = LRUCache()
+        source = RedisSource(
+            host=self.redis_host, port=self.redis_port, cache=cache)
+        fetch_value = source._fetch_value
+
+        def fetch_and_change(key):
+            result = fetch_value(key)
+            self.redis.set(u'foo', u'baz')
+            cache.invalidate('foo')  # as done by the invalidator
+            return result
+
+        source._fetch_value = fetch_and_change
+        self.assertEqual(source.getTerm(u'foo').title, u'bar')
+        assert 'foo' not in cache
+        del source._fetch_value
+        self.assertEqual(source.getTerm(u'foo').title, u'baz')
+
+    def test_shared_connection_pool(self):
+        # sources with same connection params share a connection pool
+        source1 = RedisSource(host=self.redis_host, port=self.redis_port)
+        source2 = RedisSource(host=self.redis_host, port=self.redis_port)
+        self.assertTrue(
+            source1._get_client().connection_pool is
+            source2._get_client().connection_pool)
+        self.assertTrue(
+            source1._get_client().connection_pool is
+            connection_pools.get(self.redis_host, self.redis_port, 0))
+
     def test_get_term_contained(self):
         # we can get contained terms as ITerm
         source = RedisSource(host=self.redis_host, port=self.redis_port)
@@ -83,6 +302,24 @@ class RedisSourceTests(unittest.TestCase):
         self.assertEqual(len(elem_list), 1)
         self.assertTrue(ITitledTokenizedTerm.providedBy(elem_list[0]))
 
+    def test_iter_pages(self):
+        # we can iterate over more elements than fit into one page
+        for n in range(20):
+            self.redis.set("key-%s" % n, "Value %s" % n)
+        source = RedisSource(
+            host=self.redis_host, port=self.redis_port, page_size=3)
+        elem_list = [x for x in source]
+        self.assertEqual(len(elem_list), 21)
+        self.assertEqual(
+            sorted(x.value for x in elem_list)[:3],
+            ['foo', 'key-0', 'key-1'])
+
+    def test_iter_skips_non_strings(self):
+        # keys that do not hold strings are skipped when iterating
+        self.redis.zadd("some-zset", 0, "bar")
+        source = RedisSource(host=self.redis_host, port=self.redis_port)
+        self.assertEqual([x.value for x in source], ['foo'])
+
     def test_get_term_by_token(self):
         # we can get a term by its token
         source = RedisSource(host=self.redis_host, port=self.redis_port)
@@ -102,6 +339,49 @@ class RedisSourceTests(unittest.TestCase):
         self.assertEqual(result2, ["hor"])
         self.assertEqual(result3, ["bar"])
 
+    def test_rebuild_index(self):
+        # we can build a search index from existing keys
+        source = RedisSource(
+            host=self.redis_host, port=self.redis_port, index_name="idx")
+        self.redis.set("far", "boo")
+        self.assertEqual(source.rebuild_index(), 2)
+        self.assertEqual(
+            self.redis.zrangebylex("idx", "-", "+"), ["bar&&foo", "boo&&far"])
+        # rebuilding replaces old entries
+        self.redis.delete("far")
+        self.assertEqual(source.rebuild_index(), 1)
+        self.assertEqual(self.redis.zrangebylex("idx", "-", "+"), ["bar&&foo"])
+
+    def test_rebuild_index_requires_name(self):
+        # we cannot build an index without knowing its name
+        source = RedisSource(host=self.redis_host, port=self.redis_port)
+        self.assertRaises(ValueError, source.rebuild_index)
+
+    def test_search_index(self):
+        # with a search index set, we look up terms in the index
+        source = RedisSource(
+            host=self.redis_host, port=self.redis_port, index_name="idx")
+        self.redis.set("far", "boo")
+        self.redis.set("gaz", u"h\xf6r")
+        source.rebuild_index()
+        result1 = [x.title for x in source.search("b")]
+        result2 = [x.title for x in source.search(u"h\xf6")]
+        result3 = [x.title for x in source.search("ba")]
+        result4 = [x.title for x in source.search("x")]
+        self.assertEqual(result1, ["bar", "boo"])
+        self.assertEqual(result2, [u"h\xf6r"])
+        self.assertEqual(result3, ["bar"])
+        self.assertEqual(result4, [])
+
+    def test_search_index_not_counted(self):
+        # the search index is neither counted nor iterated
+        source = RedisSource(
+            host=self.redis_host, port=self.redis_port, index_name="idx")
+        source.rebuild_index()
+        self.assertEqual(len(source), 1)
+        self.assertEqual([x.value for x in source], ["foo"])
+
+
 class RedisKeysSourceTests(unittest.TestCase):
 
     layer = RedisLayer
@@ -148,6 +428,16 @@ class RedisKeysSourceTests(unittest.TestCase):
         self.assertTrue(hasattr(term, 'title'))
         self.assertEqual(term.title, u'foo')
 
+    def test_search_index(self):
+        # keys sources index and search keys
+        self.redis.set(u'fox', u'baz')
+        source = RedisKeysSource(
+            host=self.redis_host, port=self.redis_port, index_name="idx")
+        source.rebuild_index()
+        self.assertEqual([x.title for x in source.search("fo")], [
+            "foo", "fox"])
+        self.assertEqual([x.title for x in source.search("b")], [])
+
 
 class RedisAutocompleteSourceTests(unittest.TestCase):
 
@@ -172,6 +462,23 @@ class RedisAutocompleteSourceTests(unittest.TestCase):
     def tearDown(self):
         self.redis.flushdb()
 
+    def count_round_trips(self, source, func, *args):
+        # get the result of `func(*args)` and the number of round trips
+        # to the store of `source` it took.
+        pool = source._get_client().connection_pool
+        calls = []
+        get_connection = pool.get_connection
+
+        def counting_get_connection(*args, **kw):
+            calls.append(args)
+            return get_connection(*args, **kw)
+        pool.get_connection = counting_get_connection
+        try:
+            result = func(*args)
+        finally:
+            del pool.get_connection
+        return result, len(calls)
+
     def test_basic(self):
         # make sure, basic redis store test setup works
         r = self.redis
@@ -316,6 +623,15 @@ class RedisAutocompleteSourceTests(unittest.TestCase):
         assert u"Bar (20)" in result
         self.assertEqual(result[0], u"Bär (10)")
 
+    def test_search_skips_entries_without_value(self):
+        # ZSET entries without a stored title are not delivered
+        self.redis.zadd(u"autocomplete-foo", 0, "fox&&5")
+        source = RedisAutocompleteSource(
+            host=self.redis_host, port=self.redis_port,
+            zset_name="autocomplete-foo")
+        result = [x.title for x in source.search("fo")]
+        self.assertEqual(result, [u"Foo (1)", u"For (2)"])
+
     def test_search_accepts_umlauts(self):
         # we can enter umlauts in searches
         source = RedisAutocompleteSource(
@@ -324,6 +640,344 @@ class RedisAutocompleteSourceTests(unittest.TestCase):
         result = [x.title for x in source.search(u"Bär")]
         assert u"Bär (4)" in result
 
+    def test_unavailable_store(self):
+        # with a breaker, we find nothing while the store is not available
+        breaker = CircuitBreaker(max_failures=2)
+        source = RedisAutocompleteSource(
+            zset_name="autocomplete-foo", breaker=breaker)
+        source._client = BrokenClient()
+        self.assertEqual(list(source.search("fo")), [])
+        assert u"1" not in source
+        assert breaker.is_open
+        self.assertEqual(len(source), 0)
+        self.assertRaises(LookupError, source.getTerm, u"1")
+
+    def test_unavailable_store_snapshot(self):
+        # with a snapshot, we can answer while the store is not available
+        workdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(workdir, "snapshot")
+            write_records(path, [
+                ("z:foo&&1", ""), ("t:1", "Foo"), ("z:for&&2", ""),
+                ("t:2", "For")])
+            source = RedisAutocompleteSource(
+                zset_name="autocomplete-foo", breaker=CircuitBreaker(),
+                snapshot=RedisSnapshot(path))
+            source._client = BrokenClient()
+            self.assertEqual(
+                [x.title for x in source.search("fo")],
+                [u"Foo (1)", u"For (2)"])
+            self.assertEqual(source.getTerm(u"2").title, u"For (2)")
+            assert u"3" not in source
+        finally:
+            shutil.rmtree(workdir)
+
+    def test_unavailable_store_not_cached(self):
+        # results found while the store is not available are not cached
+        workdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(workdir, "snapshot")
+            write_records(path, [("z:foo&&1", ""), ("t:1", "Old Foo")])
+            cache = LRUCache()
+            source = RedisAutocompleteSource(
+                host=self.redis_host, port=self.redis_port,
+                zset_name="autocomplete-foo", cache=cache,
+                breaker=CircuitBreaker(reset_timeout=0),
+                snapshot=RedisSnapshot(path))
+            source._client = BrokenClient()
+            self.assertEqual(source.getTerm(u"1").title, u"Old Foo (1)")
+            self.assertRaises(LookupError, source.getTerm, u"2")
+            self.assertEqual(
+                [x.title for x in source.search("fo")], [u"Old Foo (1)"])
+            self.assertEqual(len(cache), 0)
+            # store available again
+            source._client = None
+            self.assertEqual(source.getTerm(u"1").title, u"Foo (1)")
+            self.assertEqual(source.getTerm(u"2").title, u"For (2)")
+            self.assertEqual(cache.get("2"), "For")
+        finally:
+            shutil.rmtree(workdir)
+
+    def test_available_store_with_breaker(self):
+        # breakers do not change results while the store is available
+        breaker = CircuitBreaker(max_failures=1)
+        source = RedisAutocompleteSource(
+            host=self.redis_host, port=self.redis_port,
+            zset_name="autocomplete-foo", breaker=breaker)
+        self.assertEqual(
+            [x.title for x in source.search("fo")], [u"Foo (1)", u"For (2)"])
+        self.assertEqual(source.getTerm(u"3").title, u"Baz (3)")
+        assert breaker.is_open is False
+
+    def test_record_usage(self):
+        # we can count selections of terms
+        source = RedisAutocompleteSource(
+            host=self.redis_host, port=self.redis_port,
+            zset_name="autocomplete-foo")
+        source.record_usage([u"2", u"2", u"1"])
+        self.assertEqual(
+            self.redis.zscore("autocomplete-foo-usage", "2"), 2.0)
+        self.assertEqual(
+            self.redis.zrevrange("autocomplete-foo-top:fo", 0, -1),
+            ["2", "1"])
+        self.assertEqual(
+            self.redis.zrevrange("autocomplete-foo-top:for", 0, -1), ["2"])
+        assert self.redis.exists("autocomplete-foo-top:forx") is False
+
+    def test_record_usage_unknown_keys(self):
+        # keys without stored title are not counted
+        source = RedisAutocompleteSource(
+            host=self.redis_host, port=self.redis_port,
+            zset_name="autocomplete-foo")
+        source.record_usage([u"5"])
+        assert self.redis.exists("autocomplete-foo-usage") is False
+
+    def test_record_usage_round_trips(self):
+        # usage records cost three round trips, regardless of the keys
+        source = RedisAutocompleteSource(
+            host=self.redis_host, port=self.redis_port,
+            zset_name="autocomplete-foo")
+        result, round_trips = self.count_round_trips(
+            source, source.record_usage, [u"1", u"2", u"3", u"4"])
+        self.assertEqual(round_trips, 3)
+        self.assertEqual(
+            self.redis.zscore("autocomplete-foo-usage", "4"), 1.0)
+
+    def test_record_usage_unavailable_store(self):
+        # usage records respect the circuit breaker
+        breaker = CircuitBreaker(max_failures=1)
+        source = RedisAutocompleteSource(
+            zset_name="autocomplete-foo", breaker=breaker)
+        source._client = BrokenClient()
+        source.record_usage([u"1"])
+        assert breaker.is_open is True
+        # open breakers keep us from asking the store
+        source._client = None
+        source.record_usage([u"1"])
+        assert self.redis.exists("autocomplete-foo-usage") is False
+
+    def test_search_ranked(self):
+        # ranked sources deliver most used terms first
+        source = RedisAutocompleteSource(
+            host=self.redis_host, port=self.redis_port,
+            zset_name="autocomplete-foo", ranked=True)
+        source.record_usage([u"3", u"2", u"3"])
+        self.assertEqual(
+            [x.title for x in source.search("b")],
+            [u"Baz (3)", u"Bär (4)", u"Foo (1)", u"For (2)"])
+        self.assertEqual(
+            [x.title for x in source.search("fo")], [u"For (2)", u"Foo (1)"])
+
+    def test_search_ranked_round_trips(self):
+        # ranked searches cost two round trips to the store
+        source = RedisAutocompleteSource(
+            host=self.redis_host, port=self.redis_port,
+            zset_name="autocomplete-foo", ranked=True)
+        source.record_usage([u"3"])
+        result, round_trips = self.count_round_trips(
+            source, lambda: [x.title for x in source.search("b")])
+        self.assertEqual(result, [u"Baz (3)", u"Bär (4)", u"Foo (1)",
+                                  u"For (2)"])
+        self.assertEqual(round_trips, 2)
+
+    def test_search_ranked_long_prefix(self):
+        # rankings of shorter prefixes are filtered for longer queries
+        for n in range(20):
+            self.redis.zadd(u"autocomplete-foo", 0, "foobar %s&&f%s" % (n, n))
+            self.redis.set("f%s" % n, "Foobar %s" % n)
+        source = RedisAutocompleteSource(
+            host=self.redis_host, port=self.redis_port,
+            zset_name="autocomplete-foo", ranked=True)
+        source.record_usage([u"f7", u"f15", u"f15"])
+        result = [x.title for x in source.search("foobar 1")]
+        self.assertEqual(result[:2], [u"Foobar 15 (f15)", u"Foobar 1 (f1)"])
+        self.assertEqual(len(result), 10)
+        assert u"Foobar 7 (f7)" not in result
+
+    def setup_ngram_index(self):
+        # add an n-gram index for the terms in autocomplete-foo
+        self.redis.zadd(u"autocomplete-foo", 0, "bar baz&&5")
+        self.redis.set("5", "Bar Baz")
+        for entry in self.redis.zrange("autocomplete-foo", 0, -1):
+            normalized, key = entry.split("&&")
+            for gram in ngrams(normalized.decode("utf-8")):
+                self.redis.sadd(
+                    ngram_index_name("autocomplete-foo", gram), key)
+
+    def test_ngrams(self):
+        # we can get the n-grams of words in normalized strings
+        self.assertEqual(ngrams(u"foo"), set([u" fo", u"foo", u"oo "]))
+        self.assertEqual(
+            ngrams(u"a bc"), set([u" a ", u" bc", u"bc "]))
+        self.assertEqual(ngrams(u"  "), set())
+
+    def test_search_ngrams(self):
+        # we can find terms with different word order and typos
+        self.setup_ngram_index()
+        source = RedisAutocompleteSource(
+            host=self.redis_host, port=self.redis_port,
+            zset_name="autocomplete-foo")
+        self.assertEqual(source.search_ngrams("baz bar")[0], u"5")
+        self.assertEqual(source.search_ngrams("bar bax")[0], u"5")
+        self.assertEqual(source.search_ngrams("xyz"), [])
+        self.assertEqual(source.search_ngrams(""), [])
+        assert self.redis.exists("autocomplete-foo-ngram-tmp") is False
+
+    def test_search_ngrams_round_trips(self):
+        # n-gram searches cost two round trips to the store
+        self.setup_ngram_index()
+        source = RedisAutocompleteSource(
+            host=self.redis_host, port=self.redis_port,
+            zset_name="autocomplete-foo")
+        result, round_trips = self.count_round_trips(
+            source, source.search_ngrams, "bar bax")
+        self.assertEqual(result[0], u"5")
+        self.assertEqual(round_trips, 2)
+
+    def test_search_ngrams_max_set_size(self):
+        # posting sets of frequent n-grams are not combined
+        self.setup_ngram_index()
+        source = RedisAutocompleteSource(
+            host=self.redis_host, port=self.redis_port,
+            zset_name="autocomplete-foo")
+        max_size = sources.NGRAM_MAX_SET_SIZE
+        try:
+            # " ba" is contained in 3 terms, "baz", "bar", etc. in 2
+            sources.NGRAM_MAX_SET_SIZE = 2
+            self.assertEqual(source.search_ngrams("baz bar")[0], u"5")
+            sources.NGRAM_MAX_SET_SIZE = 1
+            self.assertEqual(source.search_ngrams("baz bar"), [])
+        finally:
+            sources.NGRAM_MAX_SET_SIZE = max_size
+
+    def test_search_ngrams_limit(self):
+        # we get at most `limit` keys
+        self.setup_ngram_index()
+        source = RedisAutocompleteSource(
+            host=self.redis_host, port=self.redis_port,
+            zset_name="autocomplete-foo")
+        self.assertEqual(len(source.search_ngrams("ba", limit=1)), 1)
+
+    def test_search_fuzzy(self):
+        # fuzzy sources deliver prefix matches first, then similar terms
+        self.setup_ngram_index()
+        source = RedisAutocompleteSource(
+            host=self.redis_host, port=self.redis_port,
+            zset_name="autocomplete-foo", fuzzy=True)
+        self.assertEqual(
+            [x.title for x in source.search("baz bar")][0], u"Bar Baz (5)")
+        result = [x.title for x in source.search("baz")]
+        self.assertEqual(result[0], u"Baz (3)")
+        assert u"Bar Baz (5)" in result
+        assert u"Foo (1)" not in result
+
+    def test_search_fuzzy_unavailable_store(self):
+        # fuzzy sources find nothing while the store is not available
+        source = RedisAutocompleteSource(
+            zset_name="autocomplete-foo", breaker=CircuitBreaker(),
+            fuzzy=True)
+        source._client = BrokenClient()
+        self.assertEqual(list(source.search("fo")), [])
+
+    def test_search_unranked_ignores_usage(self):
+        # usage counts do not change results of unranked sources
+        source = RedisAutocompleteSource(
+            host=self.redis_host, port=self.redis_port,
+            zset_name="autocomplete-foo")
+        source.record_usage([u"2"])
+        self.assertEqual(
+            [x.title for x in source.search("fo")], [u"Foo (1)", u"For (2)"])
+
+
+class RedisHashAutocompleteSourceTests(unittest.TestCase):
+
+    layer = RedisLayer
+
+    def setUp(self):
+        settings = self.layer['redis_server'].settings['redis_conf']
+        port = settings['port']
+        self.redis = redis.StrictRedis(host='localhost', port=port, db=0)
+        self.redis.flushdb()
+        for key, normalized, title in (
+                ("1", "foo", "Foo"), ("2", "for", "For"),
+                ("3", "baz", "Baz"), ("4", "bar", "B\xc3\xa4r")):
+            self.redis.zadd(
+                u"autocomplete-foo", 0, "%s&&%s" % (normalized, key))
+            self.redis.hset(
+                hash_bucket(key, "titles", 4), key, title)
+        self.redis_host = settings['bind']
+        self.redis_port = settings['port']
+
+    def tearDown(self):
+        self.redis.flushdb()
+
+    def get_source(self, **kw):
+        return RedisHashAutocompleteSource(
+            host=self.redis_host, port=self.redis_port,
+            zset_name="autocomplete-foo", hash_prefix="titles", buckets=4,
+            **kw)
+
+    def test_hash_bucket(self):
+        # keys are distributed over a fixed number of hashes
+        buckets = set([hash_bucket(str(x), "foo", 4) for x in range(100)])
+        self.assertEqual(
+            sorted(buckets), ["foo:0", "foo:1", "foo:2", "foo:3"])
+        self.assertEqual(hash_bucket(u"1", "foo"), hash_bucket("1", "foo"))
+
+    def test_bucket_count(self):
+        # the number of hashes depends on the number of entries
+        self.assertEqual(bucket_count(0), 1)
+        self.assertEqual(bucket_count(64), 1)
+        self.assertEqual(bucket_count(65), 2)
+        self.assertEqual(bucket_count(10000000), 156250)
+
+    def test_iface(self):
+        # make sure we fullfill promised interfaces
+        verify.verifyClass(IQuerySource, RedisHashAutocompleteSource)
+        verify.verifyObject(IQuerySource, self.get_source())
+
+    def test_default_hash_prefix(self):
+        # hash prefixes are derived from ZSET names by default
+        source = RedisHashAutocompleteSource(zset_name="foo")
+        self.assertEqual(source.hash_prefix, "foo-titles")
+
+    def test_get_term(self):
+        # we can get terms from hashes
+        source = self.get_source()
+        self.assertEqual(source.getTerm(u"4").title, u"B\xe4r (4)")
+        self.assertRaises(LookupError, source.getTerm, u"5")
+        assert u"1" in source
+        assert u"5" not in source
+
+    def test_stored_buckets(self):
+        # the number of hashes is read from the store by default
+        source = RedisHashAutocompleteSource(
+            host=self.redis_host, port=self.redis_port,
+            zset_name="autocomplete-foo", hash_prefix="titles",
+            cache=LRUCache())
+        self.redis.set("titles-buckets", "4")
+        self.assertEqual(source.getTerm(u"4").title, u"B\xe4r (4)")
+        self.assertEqual(source.buckets, 4)
+        self.assertEqual(source.cache.get("titles-buckets"), "4")
+
+    def test_legacy_buckets(self):
+        # stores without number of hashes use the old default
+        source = RedisHashAutocompleteSource(
+            host=self.redis_host, port=self.redis_port,
+            zset_name="autocomplete-foo", hash_prefix="titles")
+        self.assertRaises(LookupError, source.getTerm, u"4")
+        self.assertEqual(source.buckets, DEFAULT_BUCKETS)
+
+    def test_search(self):
+        # we can search sources with titles in hashes
+        source = self.get_source(cache=LRUCache())
+        self.assertEqual(
+            [x.title for x in source.search("b")],
+            [u'B\xe4r (4)', u'Baz (3)', u'Foo (1)', u'For (2)'])
+        self.assertEqual(
+            [x.title for x in source.search("fo")],
+            [u"Foo (1)", u"For (2)"])
+
 
 class ExternalVocabBinderTests(ExternalVocabSetup, unittest.TestCase):
 
@@ -396,13 +1050,359 @@ class ExternalVocabBinderTests(ExternalVocabSetup, unittest.TestCase):
         assert isinstance(src, SimpleVocabulary)
         assert u'Vocab Entry 1' in src
 
+    def test_searchable_srcs(self):
+        # some file based vocabs can be used with autocomplete widgets
+        for source in (publishers_source, ddcgeo_source, ddcsach_source,
+                       ddczeit_source):
+            self.create_external_vocab(source.name)
+            source.vocab = None
+            assert IQuerySource.providedBy(source(context=None))
+
     def test_gndid_src_w_vocab(self):
         self.create_external_vocab('psj.content.GND_ID')
         gndid_source.vocab = None  # avoid cached entries
         src = gndid_source(context=None)
-        assert isinstance(src, SimpleVocabulary)
+        assert isinstance(src, MMapVocabulary)
         assert u'Vocab Entry 1' in src
 
+    def test_external_vocab_binder_mmap(self):
+        # we can get vocabularies served from record files
+        self.create_external_vocab('psj.content.testvocab')
+        binder = ExternalVocabBinder(
+            name='psj.content.testvocab', use_mmap=True)
+        vocab = binder(context=None)
+        assert isinstance(vocab, MMapVocabulary)
+        assert vocab.records.path.startswith(vocab_cache_path(
+            os.path.join(self.workdir, 'sample_vocab.csv'), '.sorted.'))
+        self.assertEqual(len(vocab), 3)
+
+    def test_external_vocab_binder_cache_dir(self):
+        # cache files are written to the configured cache dir
+        self.create_external_vocab('psj.content.testvocab')
+        conf = queryUtility(
+            IExternalVocabConfig, name='psj.content.testvocab')
+        cache_dir = os.path.join(self.workdir, 'other-cache')
+        conf['cache_dir'] = cache_dir
+        binder = ExternalVocabBinder(
+            name='psj.content.testvocab', use_mmap=True)
+        vocab = binder(context=None)
+        self.assertEqual(len(vocab), 3)
+        self.assertEqual(os.listdir(cache_dir), [
+            os.path.basename(vocab.records.path)])
+        self.assertEqual(
+            sorted(os.listdir(self.workdir)),
+            ['other-cache', 'sample_vocab.csv'])
+
+    def test_external_vocab_binder_mmap_unwritable(self):
+        # we fall back to compact vocabs if record files can't be written
+        self.create_external_vocab('psj.content.testvocab')
+        open(os.path.join(self.workdir, 'cache'), 'w').write('no dir')
+        binder = ExternalVocabBinder(
+            name='psj.content.testvocab', use_mmap=True)
+        vocab = binder(context=None)
+        assert isinstance(vocab, CompactVocabulary)
+        assert u'Vocab Entry 1' in vocab
+
+    def test_external_vocab_binder_reload(self):
+        # changed vocab files are reloaded in background
+        self.create_external_vocab('psj.content.testvocab')
+        binder = ExternalVocabBinder(
+            name='psj.content.testvocab', check_interval=0)
+        vocab1 = binder(context=None)
+        path = os.path.join(self.workdir, 'sample_vocab.csv')
+        open(path, 'a').write('Vocab Entry 3\n')
+        # we still get the old vocab while the new one is built
+        assert binder(context=None) is vocab1
+        binder.reloader.join()
+        vocab2 = binder(context=None)
+        assert vocab2 is not vocab1
+        assert u'Vocab Entry 3' in vocab2
+        assert binder(context=None) is vocab2
+
+    def test_external_vocab_binder_reload_rate_limited(self):
+        # we check vocab files for changes only every `check_interval` secs
+        self.create_external_vocab('psj.content.testvocab')
+        binder = ExternalVocabBinder(
+            name='psj.content.testvocab', check_interval=3600)
+        vocab1 = binder(context=None)
+        path = os.path.join(self.workdir, 'sample_vocab.csv')
+        open(path, 'a').write('Vocab Entry 3\n')
+        assert binder(context=None) is vocab1
+        assert binder.reloader is None
+        binder._checked = 0
+        binder(context=None)
+        binder.reloader.join()
+        assert u'Vocab Entry 3' in binder(context=None)
+
+    def test_external_vocab_binder_reload_mmap(self):
+        # record files are rebuilt when vocab files change
+        self.create_external_vocab('psj.content.testvocab')
+        binder = ExternalVocabBinder(
+            name='psj.content.testvocab', use_mmap=True, check_interval=0)
+        binder(context=None)
+        path = os.path.join(self.workdir, 'sample_vocab.csv')
+        open(path, 'w').write('Vocab Entry 3\n')
+        binder(context=None)
+        binder.reloader.join()
+        vocab = binder(context=None)
+        assert isinstance(vocab, MMapVocabulary)
+        self.assertEqual([x.value for x in vocab], [u'Vocab Entry 3'])
+
+    def test_external_vocab_binder_searchable(self):
+        # we can get searchable vocabularies
+        self.create_external_vocab('psj.content.testvocab')
+        binder = ExternalVocabBinder(
+            name='psj.content.testvocab', searchable=True)
+        vocab = binder(context=None)
+        assert isinstance(vocab, SearchableVocabulary)
+        self.assertEqual(
+            [x.value for x in vocab.search(u'\xfcm')], [u'\xdcmlaut Entry'])
+
+    def test_external_vocab_binder_compact(self):
+        # we can get compact vocabularies
+        self.create_external_vocab('psj.content.testvocab')
+        binder = ExternalVocabBinder(
+            name='psj.content.testvocab', compact=True)
+        vocab = binder(context=None)
+        assert isinstance(vocab, CompactVocabulary)
+        assert u'Vocab Entry 1' in vocab
+
+
+class CompactVocabularyTests(unittest.TestCase):
+
+    def get_vocab(self):
+        return CompactVocabulary([u'Foo', u'B\xe4r', u'Baz', u'Foo'])
+
+    def test_iface(self):
+        # make sure we fullfill promised interfaces
+        verify.verifyClass(IVocabularyTokenized, CompactVocabulary)
+        verify.verifyObject(IVocabularyTokenized, self.get_vocab())
+        verify.verifyClass(ITitledTokenizedTerm, CompactTerm)
+        verify.verifyObject(ITitledTokenizedTerm, CompactTerm(u'Foo'))
+
+    def test_terms(self):
+        # we get terms like the ones made by make_terms
+        vocab = self.get_vocab()
+        expected = make_terms(['Foo', 'B\xc3\xa4r', 'Baz'])
+        self.assertEqual(
+            [(x.value, x.token, x.title) for x in vocab],
+            [(x.value, x.token, x.title) for x in expected])
+        self.assertEqual(len(vocab), 3)
+
+    def test_get_term(self):
+        # we can lookup terms by value or token
+        vocab = self.get_vocab()
+        self.assertEqual(vocab.getTerm(u'B\xe4r').token, 'QsOkcg==')
+        self.assertEqual(vocab.getTermByToken('QsOkcg==').value, u'B\xe4r')
+        self.assertRaises(LookupError, vocab.getTerm, u'Bar')
+        self.assertRaises(LookupError, vocab.getTermByToken, 'invalid')
+        self.assertRaises(LookupError, vocab.getTermByToken, '#')
+        assert u'Foo' in vocab
+        assert u'Bar' not in vocab
+        assert [] not in vocab
+
+
+class ReadVocabFileTests(ExternalVocabSetup, unittest.TestCase):
+
+    def setUp(self):
+        super(ReadVocabFileTests, self).setUp()
+        self.path = os.path.join(self.workdir, 'vocab.csv')
+        open(self.path, 'w').write('Foo\n\nB\xc3\xa4r \r\n')
+
+    def test_read_vocab_file(self):
+        # we get the same terms as from make_terms
+        terms = read_vocab_file(self.path)
+        self.assertEqual(
+            [(x.token, x.value, x.title) for x in terms],
+            [(x.token, x.value, x.title)
+             for x in make_terms(['Foo', 'B\xc3\xa4r'])])
+        assert os.path.isfile(vocab_cache_path(self.path, '.cache'))
+        assert not os.path.exists(self.path + '.cache')
+
+    def test_read_vocab_file_cached(self):
+        # we read cached terms, if the vocab file did not change
+        digest = hashlib.md5(open(self.path).read()).hexdigest()
+        marshal.dump(
+            (VOCAB_CACHE_VERSION, digest, [('Y2FjaGVk', u'cached')]),
+            open(vocab_cache_path(self.path, '.cache'), 'wb'))
+        terms = read_vocab_file(self.path)
+        self.assertEqual([x.value for x in terms], [u'cached'])
+        open(self.path, 'a').write('Baz\n')
+        terms = read_vocab_file(self.path)
+        self.assertEqual(
+            [x.value for x in terms], [u'Foo', u'B\xe4r', u'Baz'])
+
+    def test_read_vocab_file_outdated_version(self):
+        # we do not read caches of other versions
+        digest = hashlib.md5(open(self.path).read()).hexdigest()
+        marshal.dump(
+            (VOCAB_CACHE_VERSION - 1, digest, [('Y2FjaGVk', u'cached')]),
+            open(vocab_cache_path(self.path, '.cache'), 'wb'))
+        terms = read_vocab_file(self.path)
+        self.assertEqual([x.value for x in terms], [u'Foo', u'B\xe4r'])
+
+    def test_read_vocab_file_broken_cache(self):
+        # broken cache files are replaced
+        open(vocab_cache_path(self.path, '.cache'), 'wb').write('broken')
+        terms = read_vocab_file(self.path)
+        self.assertEqual([x.value for x in terms], [u'Foo', u'B\xe4r'])
+        self.assertEqual(len(read_vocab_file(self.path)), 2)
+
+    def test_read_vocab_file_unwritable_cache(self):
+        # we cope with cache files that cannot be written
+        cache_path = os.path.join(self.workdir, 'not-existing', 'cache')
+        terms = read_vocab_file(self.path, cache_path=cache_path)
+        self.assertEqual([x.value for x in terms], [u'Foo', u'B\xe4r'])
+
+    def test_vocab_cache_path(self):
+        # cache paths depend on the vocab file path
+        cache_dir = os.path.join(self.workdir, 'cache')
+        path1 = vocab_cache_path(self.path, '.cache')
+        path2 = vocab_cache_path(
+            os.path.join(self.workdir, 'sub', 'vocab.csv'), '.cache')
+        self.assertEqual(os.path.dirname(path1), cache_dir)
+        assert os.path.isdir(cache_dir)
+        assert os.path.basename(path1).startswith('vocab.csv-')
+        assert path1.endswith('.cache')
+        self.assertNotEqual(path1, path2)
+        other_dir = os.path.join(self.workdir, 'other')
+        self.assertEqual(
+            vocab_cache_path(self.path, '.sorted', other_dir),
+            os.path.join(other_dir, os.path.basename(path1)[:-6] + '.sorted'))
+
+    def test_vocab_cache_path_created_private(self):
+        # cache dirs are created accessible for us only
+        cache_dir = os.path.join(self.workdir, 'cache')
+        vocab_cache_path(self.path, '.cache')
+        self.assertEqual(stat.S_IMODE(os.stat(cache_dir).st_mode) & 0o077, 0)
+        assert trusted_dir(cache_dir) is True
+
+    def test_vocab_cache_path_untrusted(self):
+        # cache dirs writable by others are not used
+        cache_dir = os.path.join(self.workdir, 'cache')
+        os.mkdir(cache_dir)
+        os.chmod(cache_dir, 0o777)
+        assert trusted_dir(cache_dir) is False
+        assert vocab_cache_path(self.path, '.cache') is None
+        terms = read_vocab_file(self.path)
+        self.assertEqual([x.value for x in terms], [u'Foo', u'B\xe4r'])
+        self.assertEqual(os.listdir(cache_dir), [])
+        self.assertRaises(IOError, compile_vocab_file, self.path)
+
+    def test_default_vocab_cache_dir(self):
+        # the default cache dir is not shared with other users
+        cache_dir = default_vocab_cache_dir()
+        assert os.path.basename(cache_dir).startswith('psj-vocab-cache')
+
+
+class SearchableVocabularyTests(unittest.TestCase):
+
+    def get_vocab(self):
+        return SearchableVocabulary(make_terms(
+            ['Foo', 'bar', 'B\xc3\xa4r', 'For', 'Baz', 'Other']))
+
+    def test_iface(self):
+        # make sure we fullfill promised interfaces
+        verify.verifyClass(IQuerySource, SearchableVocabulary)
+        verify.verifyObject(IQuerySource, self.get_vocab())
+
+    def test_vocab(self):
+        # searchable vocabs are still simple vocabs
+        vocab = self.get_vocab()
+        self.assertEqual(len(vocab), 6)
+        self.assertEqual(vocab.getTerm(u'Foo').token, tokenize('Foo'))
+        self.assertEqual(vocab.getTermByToken(tokenize('Foo')).value, u'Foo')
+
+    def test_search(self):
+        # we can search normalized titles for prefixes
+        vocab = self.get_vocab()
+        self.assertEqual(
+            [x.value for x in vocab.search('fo')], [u'Foo', u'For'])
+        self.assertEqual(
+            [x.value for x in vocab.search(u'B\xe4')],
+            [u'bar', u'B\xe4r', u'Baz'])
+        self.assertEqual([x.value for x in vocab.search('x')], [])
+        self.assertEqual(len(list(vocab.search(''))), 6)
+
+    def test_search_limit(self):
+        # we deliver at most `limit` terms
+        vocab = self.get_vocab()
+        self.assertEqual(len(list(vocab.search('', limit=2))), 2)
+
+
+class MMapVocabularyTests(ExternalVocabSetup, unittest.TestCase):
+
+    def get_vocab(self):
+        self.create_external_vocab('psj.content.testvocab')
+        path = os.path.join(self.workdir, 'sample_vocab.csv')
+        return MMapVocabulary(compile_vocab_file(path))
+
+    def test_iface(self):
+        # make sure we fullfill promised interfaces
+        vocab = self.get_vocab()
+        verify.verifyClass(IVocabularyTokenized, MMapVocabulary)
+        verify.verifyObject(IVocabularyTokenized, vocab)
+
+    def test_compile_vocab_file(self):
+        # record files are only rebuilt if outdated
+        path = os.path.join(self.workdir, 'sample_vocab.csv')
+        open(path, 'w').write('foo\n')
+        os.utime(path, (2, 2))
+        sorted_path = compile_vocab_file(path)
+        self.assertEqual(
+            sorted_path, vocab_cache_path(path, '.sorted') + '.2000-4')
+        open(sorted_path, 'wb').write('not rebuilt')
+        self.assertEqual(compile_vocab_file(path), sorted_path)
+        self.assertEqual(open(sorted_path, 'rb').read(), 'not rebuilt')
+        self.assertEqual(
+            len(MMapVocabulary(compile_vocab_file(path, force=True))), 1)
+
+    def test_compile_vocab_file_older(self):
+        # vocab files replaced by older ones are compiled again
+        path = os.path.join(self.workdir, 'sample_vocab.csv')
+        open(path, 'w').write('foo\n')
+        os.utime(path, (2, 2))
+        sorted_path = compile_vocab_file(path)
+        open(path, 'w').write('foo\nbar\n')
+        os.utime(path, (1, 1))
+        self.assertEqual(
+            len(MMapVocabulary(compile_vocab_file(path))), 2)
+        # former record files are removed
+        assert not os.path.exists(sorted_path)
+
+    def test_contains(self):
+        # we can tell whether values are part of the vocab
+        vocab = self.get_vocab()
+        assert u'Vocab Entry 1' in vocab
+        assert u'\xdcmlaut Entry' in vocab
+        assert u'Vocab Entry' not in vocab
+        assert u'' not in vocab
+
+    def test_get_term(self):
+        # we get terms like the ones of simple vocabs
+        vocab = self.get_vocab()
+        term = vocab.getTerm(u'\xdcmlaut Entry')
+        self.assertEqual(term.value, u'\xdcmlaut Entry')
+        self.assertEqual(term.title, u'\xdcmlaut Entry')
+        self.assertEqual(term.token, tokenize('\xc3\x9cmlaut Entry'))
+        self.assertRaises(LookupError, vocab.getTerm, u'Vocab Entry')
+
+    def test_get_term_by_token(self):
+        # we can lookup terms by token
+        vocab = self.get_vocab()
+        term = vocab.getTermByToken(tokenize('Vocab Entry 2'))
+        self.assertEqual(term.value, u'Vocab Entry 2')
+        self.assertRaises(LookupError, vocab.getTermByToken, 'invalid')
+        self.assertRaises(LookupError, vocab.getTermByToken, '#')
+
+    def test_iter(self):
+        # we iterate over terms in the order of the vocab file
+        vocab = self.get_vocab()
+        self.assertEqual(
+            [x.value for x in vocab],
+            [u'Vocab Entry 1', u'Vocab Entry 2', u'\xdcmlaut Entry'])
+        self.assertEqual(len(vocab), 3)
+
 
 class ExternalRedisBinderTests(unittest.TestCase):
 
@@ -533,6 +1533,85 @@ class ExternalRedisAutocompleteBinderTests(unittest.TestCase):
         self.assertEqual(term.value, u'1')
         self.assertEqual(term.title, u'Foo (1)')
 
+    def test_external_redis_binder_cache(self):
+        # binders can provide sources sharing a term cache
+        self.register_redis_conf(name='my-test-redis-conf')
+        binder = ExternalRedisAutocompleteBinder(
+            name='my-test-redis-conf', zset_name='autocomplete-foo',
+            cache_size=10)
+        try:
+            source1 = binder(context=None)
+            source2 = binder(context=None)
+            assert source1.cache is not None
+            assert source1.cache is source2.cache
+            assert binder.invalidator.is_alive()
+        finally:
+            binder.invalidator.stop()
+
+    def test_external_redis_binder_connection_options(self):
+        # connection options set in configs are passed to sources
+        gsm = getGlobalSiteManager()
+        conf = {'host': self.redis_host, 'port': self.redis_port, 'db': 0,
+                'socket_timeout': 2.0, 'socket_connect_timeout': 1.0}
+        gsm.registerUtility(
+            conf, provided=IRedisStoreConfig, name='my-tuned-redis-conf')
+        binder = ExternalRedisAutocompleteBinder(
+            name='my-tuned-redis-conf', zset_name='autocomplete-foo')
+        source = binder(context=None)
+        self.assertEqual(
+            source.connection_options,
+            {'socket_timeout': 2.0, 'socket_connect_timeout': 1.0})
+        self.assertEqual(source.getTerm(u'1').title, u'Foo (1)')
+        pool = source._get_client().connection_pool
+        self.assertEqual(pool.connection_kwargs['socket_timeout'], 2.0)
+
+    def test_external_redis_binder_fallback(self):
+        # sources get breakers, timeouts and configured snapshots
+        gsm = getGlobalSiteManager()
+        conf = {'host': self.redis_host, 'port': self.redis_port, 'db': 0,
+                'snapshot_path': '/not/existing', 'socket_timeout': 5.0}
+        gsm.registerUtility(
+            conf, provided=IRedisStoreConfig, name='my-snapshot-conf')
+        binder = ExternalRedisAutocompleteBinder(
+            name='my-snapshot-conf', zset_name='autocomplete-foo',
+            timeout=0.5)
+        source = binder(context=None)
+        assert isinstance(source.breaker, CircuitBreaker)
+        self.assertEqual(source.snapshot.path, '/not/existing')
+        assert binder(context=None).snapshot is source.snapshot
+        self.assertEqual(
+            source.connection_options,
+            {'socket_timeout': 5.0, 'socket_connect_timeout': 0.5})
+        self.assertEqual(source.getTerm(u'1').title, u'Foo (1)')
+
+    def test_external_redis_binder_hash_layout(self):
+        # binders can provide sources reading titles from hashes
+        self.register_redis_conf(name='my-test-redis-conf')
+        binder = ExternalRedisAutocompleteBinder(
+            name='my-test-redis-conf', zset_name='autocomplete-foo',
+            hash_prefix='titles', buckets=4)
+        source = binder(context=None)
+        assert isinstance(source, RedisHashAutocompleteSource)
+        self.assertEqual(source.hash_prefix, 'titles')
+        self.assertEqual(source.buckets, 4)
+
+    def test_external_redis_binder_ranked(self):
+        # binders can provide ranked sources
+        self.register_redis_conf(name='my-test-redis-conf')
+        binder = ExternalRedisAutocompleteBinder(
+            name='my-test-redis-conf', zset_name='autocomplete-foo',
+            ranked=True)
+        assert binder(context=None).ranked is True
+        assert gndterms_source.ranked is True
+
+    def test_external_redis_binder_fuzzy(self):
+        # binders can provide fuzzy sources
+        self.register_redis_conf(name='my-test-redis-conf')
+        binder = ExternalRedisAutocompleteBinder(
+            name='my-test-redis-conf', zset_name='autocomplete-foo',
+            hash_prefix='titles', fuzzy=True)
+        assert binder(context=None).fuzzy is True
+
     def test_external_redis_binder_no_iter(self):
         # for huge datasets, redis autocomplete binders forbids iter()
         self.register_redis_conf(name='my-test-redis-conf')
@@ -552,7 +1631,182 @@ class ExternalRedisAutocompleteBinderTests(unittest.TestCase):
         self.redis.set("2", "Bar")
         self.register_redis_conf(name=u'psj.content.redis_conf')
         gndterms_source.vocab = None  # avoid cached entries
+        gndterms_source.cache = None  # avoid cached terms
         src = gndterms_source(context=None)
         assert isinstance(src, RedisAutocompleteSource)
         assert u'1' in src
         assert u'3' not in src
+
+
+class GNDTermsGetterTests(unittest.TestCase):
+
+    layer = RedisLayer
+
+    def setUp(self):
+        settings = self.layer['redis_server'].settings['redis_conf']
+        self.redis = redis.StrictRedis(
+            host='localhost', port=settings['port'], db=0)
+        self.redis.flushdb()
+        self.redis.set("1", "Foo")
+        self.redis.set("2", u"B\xe4r")
+        self.conf = {'host': settings['bind'], 'port': settings['port'],
+                     'db': 0}
+
+    def tearDown(self):
+        gsm = getGlobalSiteManager()
+        gsm.unregisterUtility(
+            provided=IRedisStoreConfig, name=u'psj.content.redis-GND')
+        self.redis.flushdb()
+
+    def register_redis_conf(self):
+        gsm = getGlobalSiteManager()
+        gsm.registerUtility(
+            self.conf, provided=IRedisStoreConfig,
+            name=u'psj.content.redis-GND')
+
+    def test_iface(self):
+        # make sure we fullfill promised interfaces
+        getter = GNDTermsGetter()
+        verify.verifyClass(IPSJGNDTermsGetter, GNDTermsGetter)
+        verify.verifyObject(IPSJGNDTermsGetter, getter)
+
+    def test_no_conf(self):
+        # without a redis store configured, we get no terms
+        getter = GNDTermsGetter()
+        self.assertEqual(getter.terms_from_ids(["1", "2"]), [])
+
+    def test_terms_from_ids(self):
+        # we can get terms for GND ids
+        self.register_redis_conf()
+        getter = GNDTermsGetter()
+        self.assertEqual(
+            getter.terms_from_ids(["2", "3", "1", "2"]),
+            [u"B\xe4r", "3", u"Foo", u"B\xe4r"])
+
+    def test_terms_are_cached(self):
+        # found terms are cached, unknown ids are not
+        self.register_redis_conf()
+        getter = GNDTermsGetter(cache_size=10)
+        getter.terms_from_ids(["1", "3"])
+        self.redis.set("1", "Changed")
+        self.redis.set("3", "Baz")
+        self.assertEqual(getter.terms_from_ids(["1", "3"]), [u"Foo", u"Baz"])
+        self.assertEqual(len(getter.cache), 2)
+
+    def test_unavailable_store(self):
+        # we read from snapshots while the store is not available
+        workdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(workdir, "snapshot")
+            write_records(path, [("t:1", "Snapshot Foo")])
+            self.conf['snapshot_path'] = path
+            self.register_redis_conf()
+            getter = GNDTermsGetter(cache_size=10)
+            getter.timeout = None
+            breaker = connection_pools.breaker(
+                self.conf['host'], self.conf['port'], 0)
+            breaker.opened = time.time()
+            try:
+                self.assertEqual(
+                    getter.terms_from_ids(["1", "2"]),
+                    [u"Snapshot Foo", "2"])
+                self.assertEqual(len(getter.cache), 0)
+            finally:
+                breaker.success()
+            self.assertEqual(
+                getter.terms_from_ids(["1", "2"]), [u"Foo", u"B\xe4r"])
+        finally:
+            shutil.rmtree(workdir)
+
+
+class RedisCacheInvalidatorTests(unittest.TestCase):
+
+    layer = RedisLayer
+
+    def setUp(self):
+        settings = self.layer['redis_server'].settings['redis_conf']
+        self.redis = redis.StrictRedis(
+            host='localhost', port=settings['port'], db=0)
+        self.redis_host = settings['bind']
+        self.redis_port = settings['port']
+        self.cache = LRUCache()
+        self.cache['foo'] = 'bar'
+        self.cache['baz'] = None
+
+    def test_handle_keyspace_notification(self):
+        # keys announced by keyspace notifications are invalidated
+        invalidator = RedisCacheInvalidator(self.cache)
+        invalidator.handle({
+            'type': 'pmessage', 'pattern': '__keyspace@0__:*',
+            'channel': '__keyspace@0__:foo', 'data': 'set'})
+        assert 'foo' not in self.cache
+        assert 'baz' in self.cache
+
+    def test_handle_hash_notification(self):
+        # changes of hash fields empty the cache
+        invalidator = RedisCacheInvalidator(self.cache)
+        invalidator.handle({
+            'type': 'pmessage', 'pattern': '__keyspace@0__:*',
+            'channel': '__keyspace@0__:gnd-autocomplete-titles:3',
+            'data': 'hset'})
+        self.assertEqual(len(self.cache), 0)
+
+    def test_handle_invalidation_message(self):
+        # keys published on the invalidation channel are invalidated
+        invalidator = RedisCacheInvalidator(self.cache)
+        invalidator.handle({
+            'type': 'message', 'pattern': None,
+            'channel': 'psj-invalidate', 'data': 'baz'})
+        assert 'foo' in self.cache
+        assert 'baz' not in self.cache
+        invalidator.handle({
+            'type': 'message', 'pattern': None,
+            'channel': 'psj-invalidate', 'data': '*'})
+        self.assertEqual(len(self.cache), 0)
+
+    def test_listen(self):
+        # running invalidators react on published invalidations
+        invalidator = RedisCacheInvalidator(
+            self.cache, host=self.redis_host, port=self.redis_port)
+        invalidator.start()
+        try:
+            for x in range(50):
+                publish_invalidation(self.redis, ['foo'])
+                if 'foo' not in self.cache:
+                    break
+                time.sleep(0.1)
+        finally:
+            invalidator.stop()
+        assert 'foo' not in self.cache
+        assert 'baz' in self.cache
+
+    def test_listen_survives_errors(self):
+        # failures empty the cache, we reconnect afterwards
+        invalidator = RedisCacheInvalidator(
+            self.cache, host=self.redis_host, port=self.redis_port,
+            retry_delay=0.1)
+        handle = invalidator.handle
+        failures = []
+
+        def failing_handle(message):
+            if not failures:
+                failures.append(message)
+                raise ValueError('broken')
+            handle(message)
+
+        invalidator.handle = failing_handle
+        invalidator.start()
+        try:
+            for x in range(50):
+                if failures:
+                    self.cache['foo'] = 'bar'
+                    publish_invalidation(self.redis, ['foo'])
+                else:
+                    publish_invalidation(self.redis, ['baz'])
+                if failures and 'foo' not in self.cache:
+                    break
+                time.sleep(0.1)
+        finally:
+            invalidator.stop()
+        assert failures
+        assert 'foo' not in self.cache
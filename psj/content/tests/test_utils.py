@@ -1,7 +1,15 @@
 # -*- coding: utf-8 -*-
 # Tests for utils module.
+import hashlib
+import shutil
+import tempfile
+import transaction
 import unittest
 from plone.app.textfield.value import RichTextValue
+from plone.namedfile.file import NamedBlobFile
+from ZODB.blob import BlobStorage
+from ZODB.DB import DB
+from ZODB.MappingStorage import MappingStorage
 from zope.component import queryUtility
 from zope.interface import verify
 from zope.schema.vocabulary import SimpleTerm
@@ -9,7 +17,7 @@ from psj.content.interfaces import ISearchableTextGetter
 from psj.content.testing import INTEGRATION_TESTING
 from psj.content.utils import (
     to_string, strip_tags, SearchableTextGetter, make_terms, tokenize,
-    untokenize,
+    untokenize, LRUCache, open_file, file_digest,
     )
 
 
@@ -311,3 +319,133 @@ class UtilsIntegrationTests(unittest.TestCase):
         # we can get an ISearchableTextGetter at runtime
         obj = queryUtility(ISearchableTextGetter)
         assert obj is not None
+
+
+class LRUCacheTests(unittest.TestCase):
+
+    def test_get_set(self):
+        # we can store and retrieve values
+        cache = LRUCache()
+        cache['foo'] = 'bar'
+        self.assertEqual(cache.get('foo'), 'bar')
+        self.assertEqual(cache.get('baz'), None)
+        self.assertEqual(cache.get('baz', 'default'), 'default')
+        assert 'foo' in cache
+        assert 'baz' not in cache
+
+    def test_maxsize(self):
+        # least recently used entries are dropped
+        cache = LRUCache(maxsize=2)
+        cache['a'] = 1
+        cache['b'] = 2
+        cache.get('a')
+        cache['c'] = 3
+        self.assertEqual(len(cache), 2)
+        assert 'a' in cache
+        assert 'b' not in cache
+        assert 'c' in cache
+
+    def test_clear(self):
+        # we can empty caches
+        cache = LRUCache()
+        cache['a'] = 1
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_invalidate(self):
+        # we can remove single entries
+        cache = LRUCache()
+        cache['a'] = 1
+        cache['b'] = 2
+        cache.invalidate('a')
+        cache.invalidate('c')
+        assert 'a' not in cache
+        assert 'b' in cache
+
+    def test_set_generation(self):
+        # values read before an invalidation are not stored
+        cache = LRUCache()
+        generation = cache.generation
+        cache.invalidate('a')
+        cache.set('a', 1, generation)
+        assert 'a' not in cache
+        cache.set('a', 1, cache.generation)
+        self.assertEqual(cache.get('a'), 1)
+
+    def test_ttl(self):
+        # entries can expire
+        cache = LRUCache(ttl=-1)
+        cache['a'] = 1
+        self.assertEqual(cache.get('a'), None)
+        cache.ttl = 60
+        cache['a'] = 1
+        self.assertEqual(cache.get('a'), 1)
+
+    def test_stats(self):
+        # we count hits and misses
+        cache = LRUCache(maxsize=10)
+        cache['a'] = None
+        cache.get('a')
+        cache.get('a')
+        cache.get('b')
+        self.assertEqual(
+            cache.stats(), dict(size=1, maxsize=10, hits=2, misses=1))
+
+
+class FileDigestTests(unittest.TestCase):
+
+    def test_open_file_blob(self):
+        # blob files are opened directly
+        named_file = NamedBlobFile(data='Hi there!', filename=u'a.txt')
+        fd = open_file(named_file)
+        try:
+            self.assertEqual(fd.read(), 'Hi there!')
+        finally:
+            fd.close()
+
+    def test_open_file_no_blob(self):
+        # we can also read files without blobs
+        fd = open_file(FakeHTMLProvider('Hi there!'))
+        self.assertEqual(fd.read(), 'Hi there!')
+        self.assertEqual(open_file(None).read(), '')
+
+    def test_file_digest(self):
+        # we get the MD5 sum of files
+        digest = '396199333edbf40ad43e62a1c1397793'
+        self.assertEqual(
+            file_digest(NamedBlobFile(data='Hi there!')), digest)
+        self.assertEqual(file_digest(FakeHTMLProvider('Hi there!')), digest)
+        self.assertEqual(
+            file_digest(None), 'd41d8cd98f00b204e9800998ecf8427e')
+
+    def test_file_digest_new_data(self):
+        # new data written into the same blob gets a new digest
+        named_file = NamedBlobFile(data='Hi there!')
+        file_digest(named_file)
+        named_file.data = 'Changed'
+        self.assertEqual(
+            file_digest(named_file), hashlib.md5('Changed').hexdigest())
+
+    def test_file_digest_remembered(self):
+        # digests of committed blobs are computed once per revision
+        blob_dir = tempfile.mkdtemp()
+        db = DB(BlobStorage(blob_dir, MappingStorage()))
+        try:
+            named_file = NamedBlobFile(data='Hi there!')
+            db.open().root()['file'] = named_file
+            transaction.commit()
+            digest = file_digest(named_file)
+            path, cached = named_file._blob._v_psj_md5
+            self.assertEqual(cached, digest)
+            named_file._blob._v_psj_md5 = (path, 'fake')
+            self.assertEqual(file_digest(named_file), 'fake')
+            # changed blobs are hashed again, also after commit
+            named_file.data = 'Changed'
+            digest = hashlib.md5('Changed').hexdigest()
+            self.assertEqual(file_digest(named_file), digest)
+            transaction.commit()
+            self.assertEqual(file_digest(named_file), digest)
+        finally:
+            transaction.abort()
+            db.close()
+            shutil.rmtree(blob_dir)
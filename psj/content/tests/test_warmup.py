@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# Tests for warmup module.
+import unittest
+from zope.component import getGlobalSiteManager
+from psj.content.interfaces import IExternalVocabConfig, IRedisStoreConfig
+from psj.content.sources import (
+    ExternalVocabBinder, ExternalRedisBinder, ExternalRedisAutocompleteBinder,
+    connection_pools,
+    institutes_source, gndterms_source,
+    )
+from psj.content.testing import ExternalVocabSetup, RedisLayer
+from psj.content.warmup import get_binders, store_timeouts, warm_up
+
+
+class WarmUpTests(ExternalVocabSetup, unittest.TestCase):
+
+    layer = RedisLayer
+
+    def setUp(self):
+        super(WarmUpTests, self).setUp()
+        settings = self.layer['redis_server'].settings['redis_conf']
+        self.conf = {
+            'host': settings['bind'], 'port': settings['port'], 'db': 0}
+        gsm = getGlobalSiteManager()
+        gsm.registerUtility(
+            self.conf, provided=IRedisStoreConfig, name='my-redis')
+        connection_pools.clear()
+
+    def tearDown(self):
+        gsm = getGlobalSiteManager()
+        gsm.unregisterUtility(provided=IRedisStoreConfig, name='my-redis')
+        gsm.unregisterUtility(
+            provided=IExternalVocabConfig, name='my-vocab')
+        super(WarmUpTests, self).tearDown()
+
+    def test_get_binders(self):
+        # we find the binders defined in sources
+        binders = get_binders()
+        assert institutes_source in binders
+        assert gndterms_source in binders
+
+    def test_warm_up(self):
+        # we load vocabularies and open connections for registered configs
+        self.create_external_vocab('my-vocab')
+        vocab_binder = ExternalVocabBinder('my-vocab')
+        redis_binder = ExternalRedisBinder('my-redis')
+        unregistered_binder = ExternalVocabBinder('not-registered')
+        threads = warm_up(
+            [vocab_binder, redis_binder, unregistered_binder])
+        self.assertEqual(len(threads), 3)
+        for thread in threads:
+            thread.join()
+        assert vocab_binder.vocab is not None
+        assert u'Vocab Entry 1' in vocab_binder.vocab
+        assert unregistered_binder.vocab is None
+        key = (self.conf['host'], self.conf['port'], 0)
+        self.assertEqual(connection_pools.stats()[key]['created'], 1)
+
+    def test_warm_up_binder_pool(self):
+        # we warm up the pool binders with timeouts use
+        binder = ExternalRedisAutocompleteBinder('my-redis', timeout=0.5)
+        for thread in warm_up([binder]):
+            thread.join()
+        pool = connection_pools.get(
+            self.conf['host'], self.conf['port'], 0,
+            socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.assertEqual(len(connection_pools.stats()), 1)
+        self.assertEqual(pool._created_connections, 1)
+        source = binder(context=None)
+        assert source._get_client().connection_pool is pool
+
+    def test_store_timeouts(self):
+        # we get the timeouts of all binders using a store
+        binders = [
+            ExternalRedisBinder('my-redis'),
+            ExternalRedisAutocompleteBinder('my-redis', timeout=0.5),
+            ExternalRedisAutocompleteBinder('other-redis', timeout=2.0),
+            ExternalVocabBinder('my-redis'),
+            ]
+        self.assertEqual(store_timeouts('my-redis', binders), [None, 0.5])
+        self.assertEqual(store_timeouts('other-redis', []), [None])
+
+    def test_warm_up_failing(self):
+        # failing warm-ups do not stop other ones
+        self.create_external_vocab('my-vocab')
+        vocab_binder = ExternalVocabBinder('my-vocab')
+
+        def failing(path):
+            raise ValueError()
+        broken_binder = ExternalVocabBinder('my-vocab')
+        broken_binder._load = failing
+        for thread in warm_up([broken_binder, vocab_binder]):
+            thread.join()
+        assert vocab_binder.vocab is not None
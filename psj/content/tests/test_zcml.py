@@ -5,7 +5,8 @@ import unittest
 from zope.component import queryUtility
 from zope.configuration import xmlconfig
 from psj.content.interfaces import (
-    IExternalVocabConfig, IRedisStoreConfig, IRedisStoreZSetConfig
+    IExternalVocabConfig, IRedisStoreConfig, IRedisStoreZSetConfig,
+    IConversionCacheConfig,
     )
 
 
@@ -19,10 +20,14 @@ class ZCMLDirectiveTests(unittest.TestCase):
         conf1 = queryUtility(IExternalVocabConfig, name=u'psj.content.bar')
         conf2 = queryUtility(IExternalVocabConfig, name=u'psj.content.baz')
         conf3 = queryUtility(IExternalVocabConfig, name=u'psj.content.foo')
+        conf4 = queryUtility(IExternalVocabConfig, name=u'psj.content.qux')
         self.assertEqual(
             conf1, {'path': u'/foo', 'name': u'psj.content.bar'})
         self.assertEqual(
             conf2, {'path': u'/bar', 'name': u'psj.content.baz'})
+        self.assertEqual(
+            conf4, {'path': u'/baz', 'name': u'psj.content.qux',
+                    'cache_dir': u'/tmp/psj-vocabs'})
         self.assertTrue(conf3 is None)
 
     def test_redis_store_config(self):
@@ -40,6 +45,19 @@ class ZCMLDirectiveTests(unittest.TestCase):
         self.assertEqual(
             conf3, {'host': 'localhost', 'port': 666, 'db': 0})
 
+    def test_redis_store_config_options(self):
+        # we can set optional connection parameters
+        sample_zcml = os.path.join(
+            os.path.dirname(__file__), 'sample.zcml')
+        xmlconfig.xmlconfig(open(sample_zcml, 'r'))
+        conf = queryUtility(
+            IRedisStoreConfig, name=u'psj.content.redis-tuned')
+        self.assertEqual(
+            conf, {'host': 'localhost', 'port': 6379, 'db': 0,
+                   'max_connections': 8, 'socket_timeout': 0.5,
+                   'socket_connect_timeout': 2.0, 'socket_keepalive': True,
+                   'unix_socket_path': '/tmp/redis.sock'})
+
     def test_redis_store_zset_config(self):
         # The local sample.zcml contains a couple of redis store zset configs
         sample_zcml = os.path.join(
@@ -51,3 +69,22 @@ class ZCMLDirectiveTests(unittest.TestCase):
             conf1, {'host': 'localhost', 'port': 1234, 'db': 42, 'zset_name': u'foo'})
         self.assertEqual(
             conf2, {'host': 'localhost', 'port': 6379, 'db': 0, 'zset_name': u'bar'})
+
+    def test_redis_store_zset_config_options(self):
+        # we can set optional connection parameters for zset configs
+        sample_zcml = os.path.join(
+            os.path.dirname(__file__), 'sample.zcml')
+        xmlconfig.xmlconfig(open(sample_zcml, 'r'))
+        conf = queryUtility(
+            IRedisStoreZSetConfig, name=u'psj.content.redis-zset-baz')
+        self.assertEqual(
+            conf, {'host': 'localhost', 'port': 6379, 'db': 0,
+                   'zset_name': u'baz', 'socket_timeout': 1.0})
+
+    def test_conversion_cache_config(self):
+        # we can configure a conversion cache
+        sample_zcml = os.path.join(
+            os.path.dirname(__file__), 'sample.zcml')
+        xmlconfig.xmlconfig(open(sample_zcml, 'r'))
+        conf = queryUtility(IConversionCacheConfig)
+        self.assertEqual(conf, {'path': u'/tmp/psj-cache', 'max_size': 10})
@@ -19,9 +19,15 @@
 """Utilities and helpers for PSJ.
 
 """
+import hashlib
+import threading
+import time
 from base64 import b64encode, b64decode
+from collections import OrderedDict
+from cStringIO import StringIO
 from five import grok
 from plone.app.textfield import RichTextValue
+from ZODB.interfaces import BlobError
 from zope.schema.vocabulary import SimpleTerm
 from psj.content import _
 from psj.content.interfaces import ISearchableTextGetter
@@ -35,6 +41,9 @@ FULLTEXT_ATTRIBUTES = (
     'psj_contributors', 'psj_urn', 'psj_issue_number',
     )
 
+#: The number of bytes read at once when hashing files.
+CHUNK_SIZE = 1024 * 1024
+
 
 def to_string(text):
     """Turn `text` into a string.
@@ -162,3 +171,152 @@ def make_terms(strings):
     tuples = [(tokenize(s), _(s.decode('utf-8'))) for s in strings if s]
     return [SimpleTerm(value=t[1], token=t[0], title=t[1])
             for t in tuples]
+
+
+class LRUCache(object):
+    """A size-bounded mapping.
+
+    If more than `maxsize` entries are stored, the least recently used
+    entries are dropped. If `ttl` is set, entries expire after `ttl`
+    seconds. Instances can be shared between threads.
+
+    The number of cache `hits` and `misses` of `get` is counted.
+
+    `generation` is incremented whenever entries are invalidated.
+    Callers reading a value from elsewhere can pass the generation
+    seen before reading to `set`, so that values changed meanwhile
+    are not cached.
+    """
+    def __init__(self, maxsize=1000, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Get the value stored for `key` or `default`.
+        """
+        with self._lock:
+            try:
+                expires, value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires < time.time():
+                self.misses += 1
+                return default
+            self._data[key] = (expires, value)  # mark as recently used
+            self.hits += 1
+            return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def set(self, key, value, generation=None):
+        """Store `value` for `key`.
+
+        If `generation` is given and entries were invalidated since
+        `generation`, nothing is stored.
+        """
+        expires = None
+        if self.ttl is not None:
+            expires = time.time() + self.ttl
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._data.pop(key, None)
+            self._data[key] = (expires, value)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def invalidate(self, key):
+        """Remove the entry for `key`, if it exists.
+        """
+        with self._lock:
+            self._data.pop(key, None)
+            self.generation += 1
+
+    def clear(self):
+        """Remove all entries.
+        """
+        with self._lock:
+            self._data.clear()
+            self.generation += 1
+
+    def stats(self):
+        """Get a dict with current `size`, `maxsize`, `hits`, and
+        `misses` of this cache.
+        """
+        return dict(size=len(self._data), maxsize=self.maxsize,
+                    hits=self.hits, misses=self.misses)
+
+
+def open_file(named_file):
+    """Get a file object to read the contents of `named_file`.
+
+    For blob files (`NamedBlobFile`) the blob file itself is opened.
+    Its `name` is the path of the file in the filesystem then. The
+    contents of other files are wrapped in a `StringIO`.
+
+    Callers have to close the returned file.
+    """
+    if getattr(named_file, '_blob', None) is not None:
+        return named_file.open()
+    return StringIO(getattr(named_file, 'data', ''))
+
+
+def _committed_path(blob):
+    """Get the path of the committed file of `blob` or ``None``.
+
+    Committed blob files never change. Each committed revision of a
+    blob gets its own file. Blobs with uncommitted changes have no
+    committed path.
+    """
+    if blob is None:
+        return None
+    blob._p_activate()
+    try:
+        return blob.committed()
+    except BlobError:
+        return None
+
+
+def file_digest(named_file):
+    """Get the MD5 sum of the contents of `named_file` as hex string.
+
+    The file is read in chunks of `CHUNK_SIZE` bytes, so big files are
+    never held in memory completely. The digest of committed blob files
+    is remembered in a volatile attribute of the blob together with
+    the path of the committed file. It is therefore computed only once
+    per revision of the blob.
+
+    The digest of ``None`` is the digest of the empty string.
+    """
+    blob = getattr(named_file, '_blob', None)
+    path = _committed_path(blob)
+    cached = getattr(blob, '_v_psj_md5', None)
+    if path is not None and cached is not None and cached[0] == path:
+        return cached[1]
+    md5 = hashlib.md5()
+    fd = open_file(named_file)
+    try:
+        while True:
+            chunk = fd.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            md5.update(chunk)
+    finally:
+        fd.close()
+    digest = md5.hexdigest()
+    if path is not None:
+        blob._v_psj_md5 = (path, digest)
+    return digest
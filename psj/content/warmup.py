@@ -0,0 +1,133 @@
+#  psj.content is copyright (c) 2014, 2015 Uli Fouquet
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#  MA 02111-1307 USA.
+#
+"""Warm up vocabularies on process start.
+
+Binders load their vocabularies and open Redis connections lazily,
+i.e. when a form is rendered the first time. To spare this wait to
+the first editors after a restart, we load all vocabularies with a
+config registered in background threads when the process starts.
+"""
+import logging
+import threading
+import time
+from five import grok
+from zope.component import getUtilitiesFor, queryUtility
+from zope.processlifetime import IProcessStarting
+from psj.content import sources
+from psj.content.interfaces import (
+    IExternalVocabConfig, IPSJGNDTermsGetter, IRedisStoreConfig,
+    )
+
+
+logger = logging.getLogger('psj.content')
+
+
+def get_binders(module=sources):
+    """Get all vocabulary binders defined in `module`.
+    """
+    return [obj for obj in vars(module).values()
+            if isinstance(obj, sources.ExternalVocabBinder)]
+
+
+def timed(title, func, *args):
+    """Call `func` with `args` and log how long it took.
+
+    Exceptions are logged but not raised.
+    """
+    start = time.time()
+    try:
+        func(*args)
+    except Exception:
+        logger.exception("Warm-up of %s failed", title)
+        return
+    logger.info(
+        "Warmed up %s in %.3f secs", title, time.time() - start)
+
+
+def connect(conf, timeout=None):
+    """Open a pooled connection to the Redis store configured in
+    `conf`.
+
+    The pool is the one used by lookups waiting at most `timeout`
+    seconds for the store (see `sources.connection_options`).
+    """
+    client = sources.connection_pools.get_client(
+        host=conf['host'], port=conf['port'], db=conf['db'],
+        **sources.connection_options(conf, timeout))
+    client.ping()
+
+
+def store_timeouts(name, binders):
+    """Get the timeouts used for the Redis store config `name`.
+
+    These are the timeouts of the Redis `binders` named `name` and,
+    if it uses this config, of the `IPSJGNDTermsGetter` utility. If
+    nobody of them uses the store, we return ``[None]``.
+    """
+    timeouts = set([binder.timeout for binder in binders
+                    if isinstance(binder, sources.ExternalRedisBinder)
+                    and binder.name == name])
+    getter = queryUtility(IPSJGNDTermsGetter)
+    if getattr(getter, 'conf_name', None) == name:
+        timeouts.add(getter.timeout)
+    return sorted(timeouts) or [None]
+
+
+def warm_up(binders=None):
+    """Warm up `binders` and Redis connection pools.
+
+    For each registered `IExternalVocabConfig` and `IRedisStoreConfig`
+    we call the binders with the respective name, and for each
+    `IRedisStoreConfig` we open a pooled connection in each pool
+    lookups will use (see `store_timeouts`). `binders`
+    defaults to the binders defined in `psj.content.sources`.
+
+    Each of these tasks is run in its own thread. Returns the list of
+    started threads.
+    """
+    if binders is None:
+        binders = get_binders()
+    tasks = []
+    for iface in (IExternalVocabConfig, IRedisStoreConfig):
+        for name, conf in getUtilitiesFor(iface):
+            if iface is IRedisStoreConfig:
+                for timeout in store_timeouts(name, binders):
+                    tasks.append(
+                        ("redis store %s" % name, connect, conf, timeout))
+            for binder in binders:
+                is_redis = isinstance(binder, sources.ExternalRedisBinder)
+                if binder.name == name and is_redis == (
+                        iface is IRedisStoreConfig):
+                    tasks.append(
+                        ("vocabulary %s" % name, binder, None))
+    threads = []
+    for task in tasks:
+        thread = threading.Thread(target=timed, args=task)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    return threads
+
+
+@grok.subscribe(IProcessStarting)
+def warm_up_on_start(event):
+    """Event handler warming up vocabularies when Zope starts.
+
+    We do not wait for the warm-up to finish.
+    """
+    warm_up()
@@ -0,0 +1,167 @@
+#  psj.content is copyright (c) 2014, 2015 Uli Fouquet
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#  MA 02111-1307 USA.
+#
+"""A worker performing queued office document conversions.
+
+The worker takes paths of objects from the conversion queue (see
+`psj.content.conversion`), creates their representations and commits
+the results. It is meant to be run with the Zope instance of the
+Plone site, e.g. with ``scripts/conversion-worker.py``::
+
+  $ bin/instance run scripts/conversion-worker.py
+
+Jobs being processed are kept in a second Redis list until they are
+done. Jobs left there by a worker that was stopped are queued again
+when a worker starts. Only one worker per queue should be run.
+"""
+import argparse
+import logging
+import sys
+import transaction
+from AccessControl.SecurityManagement import (
+    newSecurityManager, noSecurityManager)
+from AccessControl.SpecialUsers import system
+from Products.CMFCore.utils import getToolByName
+from ZODB.POSException import ConflictError
+from zope.component.hooks import setSite
+from psj.content.conversion import (
+    get_queue_client, create_reprs, QUEUE_NAME, PROCESSING_NAME, PENDING,
+    DONE, FAILED,
+    )
+
+
+logger = logging.getLogger('psj.content')
+
+#: How often we try to commit results in case of conflicts.
+ATTEMPTS = 3
+
+
+def get_pending(app, path):
+    """Get the object at `path` if its conversion is pending.
+
+    Returns ``None`` otherwise. The site of the object is set as local
+    site.
+    """
+    obj = app.unrestrictedTraverse(path, None)
+    if obj is None:
+        logger.warn("Cannot convert %s: not found", path)
+        return None
+    if getattr(obj, 'psj_conversion_state', None) != PENDING:
+        # converted already by an earlier job
+        return None
+    setSite(getToolByName(obj, 'portal_url').getPortalObject())
+    return obj
+
+
+def set_state(app, path, state):
+    """Set the conversion state of the object at `path` to `state`.
+    """
+    for num in range(ATTEMPTS):
+        transaction.begin()
+        app._p_jar.sync()
+        obj = app.unrestrictedTraverse(path, None)
+        if obj is None:
+            transaction.abort()
+            return
+        obj.psj_conversion_state = state
+        try:
+            transaction.commit()
+            return
+        except ConflictError:
+            transaction.abort()
+    logger.error("Cannot set conversion state of %s", path)
+
+
+def process_job(app, path):
+    """Convert the office document of the object at `path`.
+
+    Conflicting commits are retried up to `ATTEMPTS` times. If the
+    conversion fails, the conversion state is set to `FAILED`. The
+    object is reindexed, as its searchable text contains the HTML
+    representation.
+
+    Returns ``True`` if the object was converted.
+    """
+    newSecurityManager(None, system)
+    try:
+        for num in range(ATTEMPTS):
+            transaction.begin()
+            app._p_jar.sync()
+            try:
+                obj = get_pending(app, path)
+                if obj is None:
+                    transaction.abort()
+                    return False
+                if not create_reprs(obj):
+                    transaction.abort()
+                    logger.error("Conversion of %s failed", path)
+                    break
+                obj.psj_conversion_state = DONE
+                obj.reindexObject()
+                transaction.commit()
+                logger.info("Converted %s", path)
+                return True
+            except ConflictError:
+                transaction.abort()
+                logger.info("Conflict while converting %s, retrying", path)
+            except Exception:
+                transaction.abort()
+                logger.exception("Conversion of %s failed", path)
+                break
+        set_state(app, path, FAILED)
+        return False
+    finally:
+        setSite(None)
+        noSecurityManager()
+
+
+def run_worker(app, client, once=False, timeout=5):
+    """Process jobs queued in the Redis store of `client`.
+
+    We wait for new jobs forever, unless `once` is set. Then we return
+    when the queue is empty. `timeout` is the number of seconds we
+    wait for new jobs at once.
+
+    Returns the number of jobs processed.
+    """
+    while client.rpoplpush(PROCESSING_NAME, QUEUE_NAME) is not None:
+        pass  # requeue jobs of stopped workers
+    num = 0
+    while True:
+        path = client.brpoplpush(QUEUE_NAME, PROCESSING_NAME, timeout)
+        if path is None:
+            if once:
+                return num
+            continue
+        process_job(app, path)
+        client.lrem(PROCESSING_NAME, 1, path)
+        num += 1
+
+
+def main(app, argv=None):
+    """Perform queued office document conversions.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument(
+        '--once', action='store_true',
+        help='stop when the queue is empty')
+    args = parser.parse_args(argv)
+    client = get_queue_client()
+    if client is None:
+        sys.stderr.write("No conversion queue configured.\n")
+        sys.exit(1)
+    run_worker(app, client, once=args.once)
@@ -21,11 +21,12 @@
 """
 from zope.component.zcml import handler
 from psj.content.interfaces import (
-    IExternalVocabConfig, IRedisStoreConfig, IRedisStoreZSetConfig
+    IExternalVocabConfig, IRedisStoreConfig, IRedisStoreZSetConfig,
+    IConversionCacheConfig,
     )
 
 
-def external_vocab_conf(context, path, name):
+def external_vocab_conf(context, path, name, cache_dir=None):
     """Handler for ZCML ``external-vocab`` directive.
 
     Register a named global utility under IExternalVocabConfig, named
@@ -48,24 +49,49 @@ def external_vocab_conf(context, path, name):
       >>> conf['name']
       'foo.bar'
 
+    ``cache_dir`` is only contained if set.
+
     """
+    conf = {'path': path, 'name': name}
+    conf.update(set_options(cache_dir=cache_dir))
     context.action(
         discriminator=('utility', IExternalVocabConfig, name),
         callable=handler,
         args=('registerUtility',
-              {'path': path, 'name': name},
+              conf,
               IExternalVocabConfig,
               name)
         )
 
 
-def redis_store_conf(context, name, host, port, db):
+def set_options(**options):
+    """Get the connection `options` that were set.
+
+    Options not set in ZCML directives are ``None``. They are not
+    stored in configs.
+    """
+    return dict(
+        [(key, val) for key, val in options.items() if val is not None])
+
+
+def redis_store_conf(context, name, host, port, db, max_connections=None,
+                     socket_timeout=None, socket_connect_timeout=None,
+                     socket_keepalive=None, unix_socket_path=None,
+                     snapshot_path=None):
     """Handler for ZCML ``redis-store`` directive.
 
     Register a global utility under IRedisStoreConfig containing a
     directory with connection parameters ``host``, ``port``, and
     ``db``.
 
+    Optionally, ``max_connections``, ``socket_timeout``,
+    ``socket_connect_timeout`` (both in seconds), ``socket_keepalive``
+    and ``unix_socket_path`` can be set. They are only contained in the
+    directory, if set. If ``unix_socket_path`` is set, we connect to
+    this socket instead of ``host`` and ``port``. ``snapshot_path`` is
+    the path of a snapshot file sources can read from if the Redis
+    store is not available.
+
     The utility will be registered under name ``name``.
 
     Interested parties can ask for redis store configs like this:
@@ -88,23 +114,35 @@ def redis_store_conf(context, name, host, port, db):
       0
 
     """
+    conf = {'host': host, 'port': port, 'db': db}
+    conf.update(set_options(
+        max_connections=max_connections, socket_timeout=socket_timeout,
+        socket_connect_timeout=socket_connect_timeout,
+        socket_keepalive=socket_keepalive,
+        unix_socket_path=unix_socket_path, snapshot_path=snapshot_path))
     context.action(
         discriminator=('utility', IRedisStoreConfig, name),
         callable=handler,
         args=('registerUtility',
-              {'host': host, 'port': port, 'db': db},
+              conf,
               IRedisStoreConfig,
               name)
         )
 
 
-def redis_store_zset(context, name, host, port, db, zset_name):
+def redis_store_zset(context, name, host, port, db, zset_name,
+                     max_connections=None, socket_timeout=None,
+                     socket_connect_timeout=None, socket_keepalive=None,
+                     unix_socket_path=None, snapshot_path=None):
     """Handler for ZCML ``redis-store-zset`` directive.
 
     Register a global utility under IRedisStoreZSetConfig containing a
     directory with connection parameters ``host``, ``port``, and
     ``db``. Additionally, a redis store ZSET name is required.
 
+    The same optional connection parameters as for ``redis-store``
+    can be set.
+
     The utility will be registered under name ``name``.
 
     Interested parties can ask for redis store configs like this:
@@ -130,11 +168,47 @@ def redis_store_zset(context, name, host, port, db, zset_name):
       'foo'
 
     """
+    conf = {'host': host, 'port': port, 'db': db, 'zset_name': zset_name}
+    conf.update(set_options(
+        max_connections=max_connections, socket_timeout=socket_timeout,
+        socket_connect_timeout=socket_connect_timeout,
+        socket_keepalive=socket_keepalive,
+        unix_socket_path=unix_socket_path, snapshot_path=snapshot_path))
     context.action(
         discriminator=('utility', IRedisStoreZSetConfig, name),
         callable=handler,
         args=('registerUtility',
-              {'host': host, 'port': port, 'db': db, 'zset_name': zset_name},
+              conf,
               IRedisStoreZSetConfig,
               name)
         )
+
+
+def conversion_cache_conf(context, path, max_size=1024):
+    """Handler for ZCML ``conversion-cache`` directive.
+
+    Register a global utility under IConversionCacheConfig containing a
+    directory with the ``path`` of a directory to cache conversion
+    results in and the maximum size of the cache in megabytes
+    (``max_size``).
+
+    Interested parties can ask for the cache config like this:
+
+      >>> from psj.content.interfaces import IConversionCacheConfig
+      >>> from zope.component import queryUtility
+      >>> conf = queryUtility(IConversionCacheConfig)
+
+      >>> conf['path']
+      /var/cache/psj
+
+      >>> conf['max_size']
+      1024
+
+    """
+    context.action(
+        discriminator=('utility', IConversionCacheConfig, u''),
+        callable=handler,
+        args=('registerUtility',
+              {'path': path, 'max_size': max_size},
+              IConversionCacheConfig)
+        )
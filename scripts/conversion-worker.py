@@ -0,0 +1,23 @@
+# Perform queued conversions of office documents.
+#
+# Conversions are queued instead of done in requests, if a redis store
+# config named ``psj.content.conversion_queue`` is registered, e.g. in
+# ``site.zcml``:
+#
+#   <psj:redis-store-config
+#       name="psj.content.conversion_queue"
+#       host="localhost" port="6379" db="0" />
+#
+# Run this script with the Zope instance of your Plone site:
+#
+#   $ bin/instance run scripts/conversion-worker.py
+#
+# Add ``--once`` to stop when the queue is empty. The real work is
+# done by `psj.content.worker`.
+#
+import sys
+from psj.content.worker import main
+
+
+if __name__ == "__main__":
+    main(app, sys.argv[1:])  # `app` is provided by `bin/instance run`
@@ -14,10 +14,13 @@
 #
 import dinsort
 import gzip
+import multiprocessing
 import os
 import tempfile
 import shutil
 import unittest
+from collections import deque
+from itertools import islice
 
 
 INFILE_PATH = "identifier.txt.gz"
@@ -26,6 +29,12 @@ OUTFILE_PATH = "terms.txt"
 # how are numbers and terms separated in files?
 SEPARATOR = "&&"
 
+# number of worker processes (`None` means: one per CPU core)
+PROCESSES = None
+
+# number of lines handed to a worker process at once
+CHUNK_SIZE = 10000
+
 
 def filter_term(term):
     """Strip unwanted chars.
@@ -37,7 +46,43 @@ def filter_term(term):
     return term
 
 
-def normalize_list(inpath, outpath, separator):
+def normalize_line(line, separator):
+    """Turn a single line into normalized form.
+
+    Returns the utf-8 encoded output line.
+    """
+    id_num, term = line.strip().split(separator, 1)
+    term = filter_term(term)
+    term = term.decode("utf-8")
+    normalized = dinsort.normalize(term)
+    out_term = "%s%s%s%s%s\n" % (
+        id_num, separator, normalized, separator, term)
+    return out_term.encode("utf-8")
+
+
+def normalize_chunk(args):
+    """Normalize a list of lines.
+
+    `args` is a tuple `(lines, separator)`. Returns the output for all
+    `lines` as a single string.
+    """
+    lines, separator = args
+    return "".join([normalize_line(line, separator) for line in lines])
+
+
+def chunks(lines, size):
+    """Split an iterable of `lines` into lists of `size` lines.
+    """
+    lines = iter(lines)
+    while True:
+        chunk = list(islice(lines, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def normalize_list(inpath, outpath, separator, processes=PROCESSES,
+                   chunk_size=CHUNK_SIZE):
     """Turn a list of terms into normalized form.
 
     For instance::
@@ -52,22 +97,40 @@ def normalize_list(inpath, outpath, separator):
 
     etc. Here the `separator` string is "&&" in both,
     input and output file.
+
+    The input file is read incrementally in chunks of `chunk_size`
+    lines, which are normalized by a pool of `processes` worker
+    processes. Results are written in original order. At most two
+    chunks per worker are held in memory at any time.
     """
     print("Opening %s for reading..." % inpath)
-    with gzip.open(inpath, "r") as infile:
-        with open(outpath, "w") as outfile:
-            for cnt, line in enumerate(infile.readlines()):
-                if cnt % 100000 == 0:
-                    # ping back every 10**6th entry
-                    print("Done: %s entries" % cnt)
-                id_num, term = line.strip().split(separator, 1)
-                term = filter_term(term)
-                term = term.decode("utf-8")
-                normalized = dinsort.normalize(term)
-                out_term = "%s%s%s%s%s\n" % (
-                    id_num, separator, normalized, separator, term)
-                outfile.write(out_term.encode("utf-8"))
-    print("Done. Written results to %s" % outpath)
+    pool = multiprocessing.Pool(processes)
+    max_pending = 2 * (processes or multiprocessing.cpu_count())
+    pending = deque()
+    cnt = 0
+    try:
+        with gzip.open(inpath, "r") as infile:
+            with open(outpath, "w") as outfile:
+                for chunk in chunks(infile, chunk_size):
+                    pending.append((len(chunk), pool.apply_async(
+                        normalize_chunk, ((chunk, separator), ))))
+                    while len(pending) >= max_pending or (
+                            pending and pending[0][1].ready()):
+                        num, result = pending.popleft()
+                        outfile.write(result.get())
+                        if (cnt + num) // 100000 > cnt // 100000:
+                            # ping back every 10**5th entry
+                            print("Done: %s entries" % (cnt + num))
+                        cnt += num
+                while pending:
+                    num, result = pending.popleft()
+                    outfile.write(result.get())
+                    cnt += num
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    print("Done (%s entries). Written results to %s" % (cnt, outpath))
 
 
 class TestFilterTerm(unittest.TestCase):
@@ -120,5 +183,36 @@ class TestNormalizeList(unittest.TestCase):
             "2&&term2&&Term2\n"
             "3&&tarm3&&Tärm3\n")
 
+    def test_normalize_list_keeps_order(self):
+        # results of several chunks are written in original order
+        self.create_gzip_file(
+            b"".join([b"%s&&Term <%s>\n" % (n, n) for n in range(100)]))
+        normalize_list(
+            self.infile, self.outfile, "&&", processes=3, chunk_size=7)
+        with open(self.outfile, "rb") as fd:
+            result = fd.readlines()
+        assert len(result) == 100
+        assert result[0] == "0&&term 0&&Term 0\n"
+        assert result[99] == "99&&term 99&&Term 99\n"
+        assert [line.split("&&")[0] for line in result] == [
+            str(n) for n in range(100)]
+
+
+class TestNormalizeChunk(unittest.TestCase):
+
+    def test_normalize_chunk(self):
+        # we can normalize several lines at once
+        result = normalize_chunk((["1&&Tärm 1\n", "2&&<T2>\n"], "&&"))
+        assert result == "1&&tarm 1&&Tärm 1\n2&&t2&&T2\n"
+
+    def test_chunks(self):
+        # we can split iterables into chunks
+        assert list(chunks(iter(range(5)), 2)) == [[0, 1], [2, 3], [4]]
+
+    def test_chunks_list(self):
+        # we can split lists into chunks
+        assert list(chunks(range(5), 2)) == [[0, 1], [2, 3], [4]]
+
 if __name__ == "__main__":
-    normalize_list(INFILE_PATH, OUTFILE_PATH, SEPARATOR)
+    normalize_list(INFILE_PATH, OUTFILE_PATH, SEPARATOR,
+                   processes=PROCESSES, chunk_size=CHUNK_SIZE)
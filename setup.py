@@ -57,6 +57,7 @@ setup(name='psj.content',
           'zope.i18nmessageid',
           'zope.interface',
           'zope.lifecycleevent',
+          'zope.processlifetime',
           'zope.schema',
           'Products.ATVocabularyManager',
           'Products.FacultyStaffDirectory',
@@ -73,5 +74,8 @@ setup(name='psj.content',
 
       [z3c.autoinclude.plugin]
       target = plone
+
+      [console_scripts]
+      psj-fill-redis = psj.content.loader:main
       """,
       )